@@ -0,0 +1,66 @@
+import argparse
+import logging
+import os
+import sys
+
+from dotenv import load_dotenv
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python -m bench', description='end-to-end handler latency benchmark against a fake Bot API'
+    )
+
+    parser.add_argument('--chats', type=int, default=50, help='number of synthetic group chats')
+    parser.add_argument('--users', type=int, default=5, help='members per chat')
+    parser.add_argument('--scenarios', type=int, default=1000, help='number of commands and conversations to play')
+    parser.add_argument('--concurrency', type=int, default=16, help='chats played at the same time')
+    parser.add_argument('--days', type=int, default=30, help='age of the seeded targets in days')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='seconds the fake API waits on every call')
+    parser.add_argument('--timeout', type=float, default=10.0, help='seconds to wait for a reply to an update')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the generated updates')
+    parser.add_argument('--max-p95', type=float, default=None, help='fail when the total p95 exceeds it, in ms')
+    parser.add_argument('--keep', action='store_true', help='keep the seeded chats and steps after the run')
+
+    args = parser.parse_args()
+
+    project_path = os.path.realpath(os.path.join(os.path.dirname(__file__), os.pardir))
+    load_dotenv(os.path.join(project_path, os.environ.get('DOTENV', '.env')))
+
+    from step_bot import settings
+    from bench.runner import BenchRunner
+
+    logging.basicConfig(
+        level=getattr(logging, settings.LOG_LEVEL.upper()), format='%(levelname)s - %(asctime)s: %(message)s'
+    )
+
+    runner = BenchRunner(
+        settings, os.environ.get('BENCH_DATABASE_URL'), chats=args.chats, users=args.users, days=args.days,
+        api_latency=args.api_latency, timeout=args.timeout
+    )
+
+    runner.seed()
+    runner.start()
+
+    try:
+        report = runner.run(args.scenarios, concurrency=args.concurrency, seed=args.seed)
+    finally:
+        runner.stop()
+
+        if not args.keep:
+            runner.cleanup()
+
+    print(report)
+
+    if sum(report.timeouts.values()):
+        return 1
+
+    if args.max_p95 is not None and report.p95() * 1000 > args.max_p95:
+        print('p95 {0:.1f} ms exceeds {1:.1f} ms'.format(report.p95() * 1000, args.max_p95))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+import json
+import logging
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from email.parser import BytesParser
+from urllib.parse import parse_qsl
+
+BOT_USER = dict(id=100000, is_bot=True, first_name='StepBench', username='step_bench_bot')
+
+
+def parse_multipart(content_type, body):
+    # Uploads, e.g. of photos, come as form data, uploaded files are kept as bytes
+    message = BytesParser().parsebytes(b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+
+    params = dict()
+    for part in message.get_payload():
+        value = part.get_payload(decode=True)
+        params[part.get_param('name', header='content-disposition')] = \
+            value if part.get_filename() else value.decode('utf-8')
+
+    return params
+
+
+class FakeApiRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        method = self.path.rstrip('/').rsplit('/', 1)[-1]
+
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            params = json.loads(body.decode('utf-8') or '{}')
+        elif self.headers.get('Content-Type', '').startswith('multipart/form-data'):
+            params = parse_multipart(self.headers['Content-Type'], body)
+        else:
+            params = dict(parse_qsl(body.decode('utf-8')))
+
+        result = self.server.call(method, params)
+
+        if result is None:
+            payload = dict(ok=False, error_code=400, description='Bad Request: method {0} is not faked'.format(method))
+        else:
+            payload = dict(ok=True, result=result)
+
+        data = json.dumps(payload).encode('utf-8')
+
+        self.send_response(200 if result is not None else 400)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTelegramApi(ThreadingMixIn, HTTPServer):
+    """Stand-in for the Bot API which answers the methods handlers call and reports every sent message"""
+
+    daemon_threads = True
+
+    thread = None
+    webhook_url = None
+
+    def __init__(self, listen='127.0.0.1', port=0, latency=0.0, on_message=None, admins=None):
+        super(FakeTelegramApi, self).__init__((listen, port), FakeApiRequestHandler)
+
+        self.latency = latency
+        self.on_message = on_message
+        self.admins = admins or (lambda chat_id: [])
+
+        self.lock = threading.Lock()
+        self.message_id = 0
+        self.calls = dict()
+
+    @property
+    def base_url(self):
+        return 'http://{0}:{1}/bot'.format(*self.server_address)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='fake-telegram-api')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def next_message_id(self):
+        with self.lock:
+            self.message_id += 1
+
+            return self.message_id
+
+    def call(self, method, params):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        handler = getattr(self, 'api_' + method.lower(), None)
+        if handler is None:
+            logging.warning('Fake API got an unknown method %s', method)
+            return None
+
+        return handler(params)
+
+    def api_getme(self, params):
+        return BOT_USER
+
+    def api_sendmessage(self, params):
+        chat_id = int(params['chat_id'])
+
+        message = {
+            'message_id': self.next_message_id(), 'date': int(time.time()), 'from': BOT_USER,
+            'chat': dict(id=chat_id, type='group' if chat_id < 0 else 'private'), 'text': params.get('text', '')
+        }
+
+        if self.on_message:
+            self.on_message(chat_id, params)
+
+        return message
+
+    def api_sendphoto(self, params):
+        chat_id = int(params['chat_id'])
+
+        photo = params.get('photo')
+        # An uploaded photo gets a file_id, a file_id is sent as it is
+        file_id = 'photo-{0}'.format(self.next_message_id()) if isinstance(photo, bytes) else photo
+
+        message = {
+            'message_id': self.next_message_id(), 'date': int(time.time()), 'from': BOT_USER,
+            'chat': dict(id=chat_id, type='group' if chat_id < 0 else 'private'), 'caption': params.get('caption', ''),
+            'photo': [dict(file_id=file_id, width=800, height=450, file_size=len(photo or ''))]
+        }
+
+        if self.on_message:
+            self.on_message(chat_id, params)
+
+        return message
+
+    def api_getchatadministrators(self, params):
+        return [
+            dict(user=dict(id=user_id, is_bot=False, first_name='Admin'), status='administrator')
+            for user_id in self.admins(int(params['chat_id']))
+        ]
+
+    def api_deletewebhook(self, params):
+        self.webhook_url = None
+        return True
+
+    def api_setwebhook(self, params):
+        self.webhook_url = params.get('url') or None
+        return True
+
+    def post_update(self, update):
+        """Posts an update to the registered webhook as Telegram does, returns the status it was answered with"""
+
+        request = urllib.request.Request(
+            self.webhook_url, data=json.dumps(update).encode('utf-8'), headers={'Content-Type': 'application/json'}
+        )
+
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
@@ -0,0 +1,300 @@
+import logging
+import math
+import queue
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import sessionmaker
+from telegram import Update
+from telegram.ext import Updater
+
+from bench.fake_api import FakeTelegramApi
+from bench.updates import chat_ids, chat_users, generate
+from step_bot import cache
+from step_bot.aio import init_runtime, runtime
+from step_bot.broadcast import Broadcaster
+from step_bot.db import create_db_engine, create_dedicated_engine, database_url, session_scope
+from step_bot.db.queries import instrument_engine, query_stats
+from step_bot.dispatch import ChatExecutor, serialize_dispatcher
+from step_bot.handlers import init_handlers
+from step_bot.migrations import check_schema
+from step_bot.models import Chat, OutboxMessage, Step, Target, TargetDayStat, UserStat
+from step_bot.outbox.worker import OutboxWorker
+
+BENCH_TOKEN = '123456:bench'
+
+
+def percentile(values, percent):
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, math.ceil(percent / 100 * len(values)) - 1))
+
+    return values[index]
+
+
+class BenchSettings:
+    """Bot settings with overrides, e.g. without the Bot API rate limits the fake API does not enforce"""
+
+    def __init__(self, settings, **overrides):
+        self.settings = settings
+        self.overrides = overrides
+
+    def __getattr__(self, name):
+        if name in self.overrides:
+            return self.overrides[name]
+
+        return getattr(self.settings, name)
+
+
+def bench_settings(settings, url):
+    """Settings of the database at url, which must not be the bot's one: the bench seeds, drains and deletes rows"""
+
+    if not url:
+        raise RuntimeError('BENCH_DATABASE_URL must be set to a database other than the bot\'s one')
+
+    url = make_url(url)
+
+    bench = BenchSettings(
+        settings, POSTGRES_HOST=url.host or 'localhost', POSTGRES_PORT=int(url.port or 5432), POSTGRES_DB=url.database,
+        POSTGRES_USER=url.username or settings.POSTGRES_USER, POSTGRES_PASS=url.password or settings.POSTGRES_PASS
+    )
+
+    if database_url(bench).split('@')[-1] == database_url(settings).split('@')[-1]:
+        raise RuntimeError('BENCH_DATABASE_URL points to the bot\'s database {0}'.format(settings.POSTGRES_DB))
+
+    return bench
+
+
+class BenchReport:
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        self.latencies = defaultdict(list)
+        self.timeouts = defaultdict(int)
+
+        self.duration = 0.0
+        self.queries = 0
+        self.scopes = dict()
+        self.api_calls = dict()
+
+    def record(self, kind, latency):
+        with self.lock:
+            self.latencies[kind].append(latency)
+
+    def timeout(self, kind):
+        with self.lock:
+            self.timeouts[kind] += 1
+
+    @property
+    def updates(self):
+        return sum(len(values) for values in self.latencies.values()) + sum(self.timeouts.values())
+
+    def all_latencies(self):
+        return [latency for values in self.latencies.values() for latency in values]
+
+    def p95(self):
+        return percentile(self.all_latencies(), 95)
+
+    def __str__(self):
+        lines = ['{0:<16} {1:>8} {2:>9} {3:>9} {4:>9} {5:>9}'.format(
+            'kind', 'updates', 'p50 ms', 'p95 ms', 'p99 ms', 'timeouts'
+        )]
+
+        rows = sorted(self.latencies.items()) + [('total', self.all_latencies())]
+        for kind, values in rows:
+            timeouts = sum(self.timeouts.values()) if kind == 'total' else self.timeouts[kind]
+
+            lines.append('{0:<16} {1:>8} {2:>9.1f} {3:>9.1f} {4:>9.1f} {5:>9}'.format(
+                kind, len(values), percentile(values, 50) * 1000, percentile(values, 95) * 1000,
+                percentile(values, 99) * 1000, timeouts
+            ))
+
+        lines.append('')
+        lines.append('throughput: {0:.1f} updates/s in {1:.2f}s'.format(
+            self.updates / self.duration if self.duration else 0.0, self.duration
+        ))
+        lines.append('db queries: {0} total, {1:.2f} per update'.format(
+            self.queries, self.queries / self.updates if self.updates else 0.0
+        ))
+        for name, stats in sorted(self.scopes.items()):
+            lines.append('  {0:<22} {1:>6} calls {2:>7.2f} queries/call {3:>7.2f} ms/query {4} slow {5} n+1'.format(
+                name, stats['executions'], stats['per_execution'], stats['time_avg'] * 1000,
+                stats['slow'], stats['n_plus_one']
+            ))
+
+        lines.append('api calls: {0}'.format(
+            ', '.join('{0}={1}'.format(method, count) for method, count in sorted(self.api_calls.items()))
+        ))
+
+        return '\n'.join(lines)
+
+
+class BenchRunner:
+    """Pushes synthetic updates through the real dispatcher and handlers against a fake Bot API"""
+
+    def __init__(self, settings, url, chats=50, users=5, days=30, api_latency=0.0, timeout=10.0):
+        settings = self.settings = bench_settings(settings, url)
+
+        self.chats = chats
+        self.users = users
+        self.days = days
+        self.timeout = timeout
+
+        # Created upfront, the players of different chats look them up concurrently
+        self.replies = {chat_id: queue.Queue() for chat_id in chat_ids(chats)}
+        self.chat_locks = {chat_id: threading.Lock() for chat_id in chat_ids(chats)}
+
+        self.api = FakeTelegramApi(
+            latency=api_latency, on_message=self.on_message, admins=lambda chat_id: chat_users(chat_id, users)
+        )
+
+        self.db_engine = create_db_engine(settings)
+        self.get_db = sessionmaker(bind=self.db_engine)
+
+        instrument_engine(self.db_engine, settings)
+
+        check_schema(self.db_engine)
+
+        self.updater = Updater(
+            BENCH_TOKEN, base_url=self.api.base_url,
+            request_kwargs=dict(con_pool_size=8 + settings.ASYNC_IO_WORKERS + settings.DISPATCH_WORKERS)
+        )
+
+        self.chat_executor = None
+        if settings.DISPATCH_WORKERS:
+            self.chat_executor = ChatExecutor(settings.DISPATCH_WORKERS, settings.DISPATCH_MAX_PENDING)
+            serialize_dispatcher(self.updater.dispatcher, self.chat_executor)
+
+        cache.init_cache(settings)
+        init_runtime(settings, self.get_db)
+        init_handlers(dispatcher=self.updater.dispatcher, db=self.get_db, settings=settings)
+
+        # Confirmations of writes are delivered from the outbox, its latency is part of the measured one
+        unlimited = 10 ** 6
+        delivery = BenchSettings(
+            settings, BROADCAST_GLOBAL_RATE=unlimited, BROADCAST_GLOBAL_BURST=unlimited,
+            BROADCAST_CHAT_RATE=unlimited, BROADCAST_CHAT_BURST=unlimited
+        )
+
+        self.broadcaster = Broadcaster(self.updater.bot, delivery)
+        self.outbox = OutboxWorker(
+            create_dedicated_engine(settings), self.get_db, self.broadcaster, delivery, chats=chat_ids(chats)
+        )
+
+    def on_message(self, chat_id, params):
+        replies = self.replies.get(chat_id)
+        if replies is not None:
+            replies.put(time.perf_counter())
+
+    def seed(self):
+        date_creation = datetime.now(tz=self.settings.BOT_TZ) - timedelta(days=self.days)
+
+        with session_scope(self.get_db) as db_session:
+            self.__delete(db_session)
+
+            for chat_id in chat_ids(self.chats):
+                chat = Chat(id=uuid.uuid4(), chat_id=str(chat_id))
+                target = Target(
+                    id=uuid.uuid4(), chat_id=chat.id, name='Bench', initial_value=0, current_value=0,
+                    target_value=10 ** 9, target_date=date_creation + timedelta(days=365), date_creation=date_creation
+                )
+
+                chat.current_target_id = target.id
+
+                db_session.add(chat)
+                db_session.add(target)
+
+        logging.info('Seeded %d chats with %d members each', self.chats, self.users)
+
+    def cleanup(self):
+        with session_scope(self.get_db) as db_session:
+            self.__delete(db_session)
+
+    def __delete(self, db_session):
+        chats = [str(chat_id) for chat_id in chat_ids(self.chats)]
+
+        targets = db_session.query(Target.id) \
+            .join(Chat, Chat.id == Target.chat_id) \
+            .filter(Chat.chat_id.in_(chats)) \
+            .subquery()
+
+        for model, column in ((Step, Step.target_id), (TargetDayStat, TargetDayStat.target_id),
+                              (UserStat, UserStat.target_id)):
+            db_session.query(model).filter(column.in_(targets)).delete(synchronize_session=False)
+
+        db_session.query(OutboxMessage).filter(OutboxMessage.chat_id.in_(chats)).delete(synchronize_session=False)
+
+        db_session.query(Chat).filter(Chat.chat_id.in_(chats)).update(
+            {Chat.current_target_id: None}, synchronize_session=False
+        )
+        db_session.query(Target).filter(Target.id.in_(targets)).delete(synchronize_session=False)
+        db_session.query(Chat).filter(Chat.chat_id.in_(chats)).delete(synchronize_session=False)
+
+    def start(self):
+        self.api.start()
+
+        dispatcher = threading.Thread(target=self.updater.dispatcher.start, name='dispatcher')
+        dispatcher.daemon = True
+        dispatcher.start()
+
+        self.updater.job_queue.start()
+        runtime.start()
+        self.outbox.start()
+
+    def stop(self):
+        self.updater.dispatcher.stop()
+        self.updater.job_queue.stop()
+
+        if self.chat_executor:
+            self.chat_executor.shutdown()
+        runtime.stop()
+        self.outbox.stop()
+        self.broadcaster.shutdown()
+
+        self.api.stop()
+
+    def play(self, scenario, report):
+        replies = self.replies[scenario.chat_id]
+
+        # Updates of a chat are answered one by one, so replies are matched to the pending update
+        with self.chat_locks[scenario.chat_id]:
+            for data in scenario.updates:
+                while not replies.empty():
+                    replies.get_nowait()
+
+                started = time.perf_counter()
+                self.updater.update_queue.put(Update.de_json(data, self.updater.bot))
+
+                try:
+                    report.record(scenario.kind, replies.get(timeout=self.timeout) - started)
+                except queue.Empty:
+                    logging.warning('No reply to %s in chat %s', scenario.kind, scenario.chat_id)
+
+                    report.timeout(scenario.kind)
+                    return
+
+    def run(self, scenarios, concurrency=16, seed=0):
+        report = BenchReport()
+
+        plan = generate(self.chats, self.users, scenarios, self.settings.BOT_TZ, days=self.days, seed=seed)
+
+        query_stats.reset()
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bench') as executor:
+            for future in [executor.submit(self.play, scenario, report) for scenario in plan]:
+                future.result()
+
+        report.duration = time.perf_counter() - started
+        report.queries = query_stats.statements()
+        report.scopes = query_stats.stats()
+        report.api_calls = dict(self.api.calls)
+
+        return report
@@ -0,0 +1,114 @@
+import itertools
+import random
+import time
+from datetime import datetime, timedelta
+
+CHAT_ID_BASE = -1009000000000
+USER_ID_BASE = 9000000000
+
+
+def chat_ids(chats):
+    return [CHAT_ID_BASE - index for index in range(chats)]
+
+
+def chat_users(chat_id, users):
+    return [USER_ID_BASE + abs(chat_id - CHAT_ID_BASE) * users + index for index in range(users)]
+
+
+class UpdateFactory:
+    def __init__(self):
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+
+    def message(self, chat_id, user_id, text):
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': dict(id=chat_id, type='group', title='Bench {0}'.format(chat_id)),
+            'from': dict(id=user_id, is_bot=False, first_name='User{0}'.format(user_id % 1000)),
+            'text': text,
+        }
+
+        if text.startswith('/'):
+            command = text.split()[0]
+            message['entities'] = [dict(type='bot_command', offset=0, length=len(command))]
+
+        return dict(update_id=next(self.update_ids), message=message)
+
+
+class Scenario:
+    """A sequence of updates of one member which must be processed in order, e.g. a whole conversation"""
+
+    def __init__(self, kind, chat_id, updates):
+        self.kind = kind
+        self.chat_id = chat_id
+        self.updates = updates
+
+
+def today(factory, chat_id, user_id, rnd, tz, days):
+    return Scenario('today', chat_id, [
+        factory.message(chat_id, user_id, '/today'),
+        factory.message(chat_id, user_id, str(rnd.randint(1000, 20000))),
+    ])
+
+
+def day(factory, chat_id, user_id, rnd, tz, days):
+    date = datetime.now(tz=tz).date() - timedelta(days=rnd.randint(0, days - 1))
+
+    return Scenario('day', chat_id, [
+        factory.message(chat_id, user_id, '/day'),
+        factory.message(chat_id, user_id, date.strftime('%d.%m.%Y')),
+        factory.message(chat_id, user_id, str(rnd.randint(1000, 20000))),
+    ])
+
+
+def batch_days(factory, chat_id, user_id, rnd, tz, days):
+    now = datetime.now(tz=tz).date()
+    lines = [
+        '{0} {1}'.format((now - timedelta(days=offset)).strftime('%d.%m.%Y'), rnd.randint(1000, 20000))
+        for offset in range(min(days, 7))
+    ]
+
+    return Scenario('days', chat_id, [factory.message(chat_id, user_id, '/days\n' + '\n'.join(lines))])
+
+
+def stat(factory, chat_id, user_id, rnd, tz, days):
+    return Scenario('stat', chat_id, [factory.message(chat_id, user_id, '/stat')])
+
+
+def admin(factory, chat_id, user_id, rnd, tz, days):
+    return Scenario('update_target', chat_id, [
+        factory.message(chat_id, user_id, '/update_target name Bench{0}'.format(rnd.randint(0, 1000)))
+    ])
+
+
+SCENARIOS = {
+    'today': today,
+    'day': day,
+    'days': batch_days,
+    'stat': stat,
+    'admin': admin,
+}
+
+DEFAULT_MIX = dict(today=40, day=20, days=5, stat=30, admin=5)
+
+
+def generate(chats, users, scenarios, tz, days=30, mix=None, seed=0):
+    """Builds scenarios spread randomly over chats and members with the given weights of every kind"""
+
+    rnd = random.Random(seed)
+    factory = UpdateFactory()
+
+    mix = mix or DEFAULT_MIX
+    kinds = list(mix.keys())
+    weights = [mix[kind] for kind in kinds]
+
+    result = []
+    for _ in range(scenarios):
+        chat_id = rnd.choice(chat_ids(chats))
+        user_id = rnd.choice(chat_users(chat_id, users))
+        kind = rnd.choices(kinds, weights)[0]
+
+        result.append(SCENARIOS[kind](factory, chat_id, user_id, rnd, tz, days))
+
+    return result
@@ -2,6 +2,7 @@ import argparse
 import logging
 import os
 import signal
+import sys
 
 from logging.handlers import TimedRotatingFileHandler
 from dotenv import load_dotenv
@@ -40,6 +41,10 @@ if __name__ == "__main__":
     )
 
     parser.add_argument('-v', '--version', action='version', version=__version__)
+    parser.add_argument(
+        '--rebuild-aggregates', action='store_true', help='rebuild step aggregates from raw steps and exit'
+    )
+    parser.add_argument('--migrate', action='store_true', help='apply pending database migrations and exit')
 
     args = parser.parse_args()
 
@@ -56,5 +61,16 @@ if __name__ == "__main__":
 
     setup_logger()
 
+    if args.migrate:
+        from step_bot.db import create_db_engine
+        from step_bot.migrations import upgrade
+
+        upgrade(create_db_engine(settings))
+        sys.exit(0)
+
     bot = Bot(settings)
-    bot.start()
+
+    if args.rebuild_aggregates:
+        bot.rebuild_aggregates()
+    else:
+        bot.start()
@@ -0,0 +1,119 @@
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from step_bot.db.queries import query_scope
+
+
+class AsyncSession:
+    def __init__(self, runtime, session, name=None):
+        self.runtime = runtime
+        self.session = session
+        self.name = name
+
+    def __scoped(self, fn, *args, **kwargs):
+        # Statements run on executor threads, the scope is entered there for every call
+        with query_scope(self.name):
+            return fn(*args, **kwargs)
+
+    async def run(self, fn, *args, **kwargs):
+        return await self.runtime.run_db(self.__scoped, fn, self.session, *args, **kwargs)
+
+    async def commit(self):
+        await self.runtime.run_db(self.__scoped, self.session.commit)
+
+    async def rollback(self):
+        await self.runtime.run_db(self.__scoped, self.session.rollback)
+
+    async def close(self):
+        await self.runtime.run_db(self.__scoped, self.session.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                await self.commit()
+            else:
+                await self.rollback()
+        finally:
+            await self.close()
+
+
+class AsyncRuntime:
+    loop = None
+    thread = None
+
+    get_db = None
+
+    db_executor = None
+    io_executor = None
+
+    def __init__(self):
+        self.started = threading.Event()
+
+    def configure(self, settings, db):
+        self.get_db = db
+
+        self.db_executor = ThreadPoolExecutor(max_workers=settings.ASYNC_DB_WORKERS, thread_name_prefix='aio-db')
+        self.io_executor = ThreadPoolExecutor(max_workers=settings.ASYNC_IO_WORKERS, thread_name_prefix='aio-io')
+
+    def start(self):
+        if self.thread:
+            return
+
+        self.loop = asyncio.new_event_loop()
+
+        self.thread = threading.Thread(target=self.__run, name='aio-loop')
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.started.wait()
+
+    def __run(self):
+        asyncio.set_event_loop(self.loop)
+
+        self.loop.call_soon(self.started.set)
+        self.loop.run_forever()
+
+    def stop(self):
+        if not self.thread:
+            return
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.thread = None
+
+        self.db_executor.shutdown(wait=True)
+        self.io_executor.shutdown(wait=True)
+
+    def submit(self, coro):
+        self.start()
+
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        future.add_done_callback(self.__log_failure)
+
+        return future
+
+    def __log_failure(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.error('Async task failed', exc_info=future.exception())
+
+    async def run_db(self, fn, *args, **kwargs):
+        return await self.loop.run_in_executor(self.db_executor, functools.partial(fn, *args, **kwargs))
+
+    async def run_io(self, fn, *args, **kwargs):
+        return await self.loop.run_in_executor(self.io_executor, functools.partial(fn, *args, **kwargs))
+
+    def session(self, name=None):
+        return AsyncSession(self, self.get_db(), name)
+
+
+runtime = AsyncRuntime()
+
+
+def init_runtime(settings, db):
+    runtime.configure(settings, db)
@@ -1,12 +1,28 @@
 import logging
+import threading
 
-from telegram.ext import Updater
-from sqlalchemy import create_engine
+from telegram import Update
+from telegram.ext import Updater, TypeHandler
 from sqlalchemy.orm import sessionmaker
 
+from step_bot import cache
+from step_bot.aio import runtime, init_runtime
+from step_bot.broadcast import Broadcaster
+from step_bot.cache.sync import CacheListener
+from step_bot.charts import init_charts, renderer
+from step_bot.db import create_db_engine, create_dedicated_engine, pool_metrics, session_scope
+from step_bot.db.queries import instrument_engine, query_stats
+from step_bot.dispatch import ChatExecutor, serialize_dispatcher
 from step_bot.handlers import init_handlers
-from step_bot.jobs import init_scheduler
-from step_bot.models import Base
+from step_bot.jobs import execute_job, init_scheduler
+from step_bot.jobs.leader import LeaderElection
+from step_bot.migrations import check_schema
+from step_bot.metrics import init_metrics, instrument_bot
+from step_bot.metrics.server import MetricsServer
+from step_bot.models.aggregates import rebuild_aggregates
+from step_bot.outbox.worker import OutboxWorker
+from step_bot.shards import ShardRouter
+from step_bot.webhook import WebhookServer
 
 
 class Bot:
@@ -15,24 +31,75 @@ class Bot:
     updater = None
     handlers = set()
 
+    webhook = None
+    metrics = None
+
+    shard = None
+    router = None
+
     scheduler = None
     jobs = set()
+    leader = None
+
+    cache_listener = None
+
+    broadcaster = None
+    chat_executor = None
+    outbox = None
 
     db_engine = None
+    dedicated_engine = None
     get_db = None
 
-    def __init__(self, settings):
+    def __init__(self, settings, shard=None):
         logging.info('Step Count Bot initialization...')
 
         self.settings = settings
+        self.shard = shard
+
+        # A generated secret would differ between replicas and restarts, and Telegram would post to a stale path
+        if settings.BOT_MODE == 'webhook' and not settings.BOT_WEBHOOK_SECRET:
+            raise RuntimeError('BOT_WEBHOOK_SECRET must be set in webhook mode')
 
         self.init_database()
+        self.init_cache()
+        self.init_runtime()
+        self.init_charts()
 
         self.init_updater()
-        self.init_scheduler()
+
+        # Shard workers only process updates, jobs run in the front process
+        if self.shard is None:
+            self.init_broadcaster()
+            self.init_scheduler()
 
     def init_updater(self):
-        self.updater = Updater(self.settings.BOT_TOKEN, request_kwargs=self.settings.BOT_REQUEST_KWARGS)
+        request_kwargs = dict(self.settings.BOT_REQUEST_KWARGS)
+        # Dispatcher workers, updater threads and broadcast workers share one connection pool
+        request_kwargs.setdefault(
+            'con_pool_size', 8 + self.settings.BROADCAST_WORKERS + self.settings.DISPATCH_WORKERS
+        )
+
+        self.updater = Updater(self.settings.BOT_TOKEN, request_kwargs=request_kwargs)
+
+        instrument_bot(self.updater.bot)
+
+        if self.settings.BOT_SHARDS and self.shard is None:
+            init_metrics(self.updater, pool_metrics, query_stats)
+
+            self.router = ShardRouter(
+                self.settings.BOT_SHARDS, self.settings.BOT_SHARD_QUEUE_SIZE, self.settings.BOT_SHARD_PUT_TIMEOUT
+            )
+            self.updater.dispatcher.add_handler(TypeHandler(Update, self.route_update))
+
+            return
+
+        # Routing to shards is cheap, so only processes which handle updates hand them to the chat executor
+        if self.settings.DISPATCH_WORKERS:
+            self.chat_executor = ChatExecutor(self.settings.DISPATCH_WORKERS, self.settings.DISPATCH_MAX_PENDING)
+            serialize_dispatcher(self.updater.dispatcher, self.chat_executor)
+
+        init_metrics(self.updater, pool_metrics, query_stats, self.chat_executor)
 
         options = dict(
             settings=self.settings,
@@ -43,35 +110,174 @@ class Bot:
         self.handlers = init_handlers(**options)
 
     def init_database(self):
-        self.db_engine = create_engine(
-            "postgresql+psycopg2://{login}:{password}@{host}:{port}/{database}".format(
-                login=self.settings.POSTGRES_USER, password=self.settings.POSTGRES_PASS,
-                host=self.settings.POSTGRES_HOST, port=self.settings.POSTGRES_PORT,
-                database=self.settings.POSTGRES_DB
-            )
-        )
+        self.db_engine = create_db_engine(self.settings)
+        instrument_engine(self.db_engine, self.settings)
 
         self.get_db = sessionmaker(bind=self.db_engine)
 
-        Base.metadata.create_all(self.db_engine)
+        self.dedicated_engine = create_dedicated_engine(self.settings)
+
+        check_schema(self.db_engine, migrate=self.settings.DB_AUTO_MIGRATE)
+
+    def init_broadcaster(self):
+        self.broadcaster = Broadcaster(self.updater.bot, self.settings)
+
+        # Shard workers only queue messages, the front process of every replica delivers them
+        self.outbox = OutboxWorker(self.dedicated_engine, self.get_db, self.broadcaster, self.settings)
+
+    def init_runtime(self):
+        init_runtime(self.settings, self.get_db)
+
+    def init_cache(self):
+        cache.init_cache(self.settings)
+
+        self.cache_listener = CacheListener(self.dedicated_engine)
+
+    def init_charts(self):
+        init_charts(self.settings)
+
+    def rebuild_aggregates(self):
+        logging.info('Rebuilding step aggregates...')
+
+        with session_scope(self.get_db) as db_session:
+            rebuild_aggregates(db_session)
 
     def init_scheduler(self):
         options = dict(
             settings=self.settings,
             bot=self.updater.bot,
-            db=self.get_db
+            db=self.get_db,
+            engine=self.db_engine
         )
 
         self.scheduler, self.jobs = init_scheduler(**options)
 
+        self.leader = LeaderElection(
+            self.dedicated_engine, self.settings.SCHEDULER_LOCK_ID, self.settings.SCHEDULER_ELECTION_INTERVAL,
+            on_elected=self.on_elected, on_demoted=self.scheduler.pause
+        )
+
+    def on_elected(self):
+        self.scheduler.resume()
+
+        # Jobs in chat time zones are only bucketed by the leader, a new one must not wait for the hourly sync
+        try:
+            execute_job('time_zone_sync')
+        except Exception as e:
+            logging.exception(e)
+
+    def start_metrics(self):
+        if not self.settings.METRICS_PORT:
+            return
+
+        # Every shard worker has its own registry, so each one is scraped on the next port
+        port = self.settings.METRICS_PORT + (self.shard + 1 if self.shard is not None else 0)
+
+        self.metrics = MetricsServer((self.settings.METRICS_LISTEN, port))
+        self.metrics.start()
+
     def start(self):
         logging.info('Starting bot...')
 
-        self.updater.start_polling()
-        self.scheduler.start()
+        self.start_metrics()
+        self.cache_listener.start()
+
+        if self.router:
+            self.router.start()
+
+        if self.settings.BOT_MODE == 'webhook':
+            self.start_webhook()
+        else:
+            self.updater.start_polling()
+
+        # Only the replica holding the leader lock processes jobs
+        self.scheduler.start(paused=True)
+        self.leader.start()
+
+        self.outbox.start()
+
+        runtime.start()
+
+    def start_webhook(self):
+        path = '/{0}'.format(self.settings.BOT_WEBHOOK_SECRET)
+
+        self.webhook = WebhookServer(
+            (self.settings.BOT_WEBHOOK_LISTEN, self.settings.BOT_WEBHOOK_PORT), path,
+            self.router.route if self.router else self.push_update,
+            max_body=self.settings.BOT_WEBHOOK_MAX_BODY
+        )
+
+        self.start_dispatcher()
+
+        self.webhook.start()
+
+        if self.settings.BOT_WEBHOOK_URL:
+            self.updater.bot.set_webhook(url=self.settings.BOT_WEBHOOK_URL.rstrip('/') + path)
+
+    def start_dispatcher(self):
+        dispatcher = threading.Thread(target=self.updater.dispatcher.start, name='dispatcher')
+        dispatcher.daemon = True
+        dispatcher.start()
+
+        # Conversation timeouts are scheduled on the job queue, start_polling would start it too
+        self.updater.job_queue.start()
+
+    def push_update(self, data):
+        self.updater.update_queue.put(Update.de_json(data, self.updater.bot))
+
+    def route_update(self, bot, update):
+        self.router.route(update.to_dict())
+
+    def serve_shard(self, queue):
+        logging.info('Starting shard %s...', self.shard)
+
+        self.start_metrics()
+        self.cache_listener.start()
+        self.start_dispatcher()
+
+        runtime.start()
+
+        for data in iter(queue.get, None):
+            self.push_update(data)
+
+        logging.info('Stopping shard %s...', self.shard)
+
+        self.updater.stop()
+
+        if self.chat_executor:
+            self.chat_executor.shutdown()
+
+        runtime.stop()
+        renderer.stop()
+        self.cache_listener.stop()
+
+        if self.metrics:
+            self.metrics.stop()
 
     def stop(self):
         logging.info('Stopping bot...')
+        logging.info('Chat cache stats: %s', cache.chats.stats())
+        logging.info('Database pool stats: %s', pool_metrics.stats())
+        logging.info('Query stats: %s', query_stats.stats())
+
+        if self.webhook:
+            self.webhook.stop()
 
+        self.leader.stop()
         self.scheduler.shutdown()
+        self.outbox.stop()
+        self.broadcaster.shutdown()
         self.updater.stop()
+
+        if self.chat_executor:
+            self.chat_executor.shutdown()
+
+        if self.router:
+            self.router.stop()
+
+        runtime.stop()
+        renderer.stop()
+        self.cache_listener.stop()
+
+        if self.metrics:
+            self.metrics.stop()
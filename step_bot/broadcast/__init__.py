@@ -0,0 +1,105 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.error import RetryAfter, TimedOut, NetworkError, ChatMigrated, Unauthorized, BadRequest
+
+SENT = 'sent'
+FAILED = 'failed'
+RETRIED = 'retried'
+
+
+class TokenBucket:
+    rate = 1.0
+    capacity = 1.0
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+        self.lock = threading.Lock()
+
+    def __refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self):
+        with self.lock:
+            self.__refill(time.monotonic())
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self.consume()
+            if not wait:
+                return
+
+            time.sleep(wait)
+
+
+class Broadcaster:
+    bot = None
+    settings = None
+
+    executor = None
+
+    global_bucket = None
+
+    def __init__(self, bot, settings):
+        self.bot = bot
+        self.settings = settings
+
+        self.workers = settings.BROADCAST_WORKERS
+        self.backoff = settings.BROADCAST_BACKOFF
+
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='broadcast')
+
+        self.global_bucket = TokenBucket(settings.BROADCAST_GLOBAL_RATE, settings.BROADCAST_GLOBAL_BURST)
+
+    def send(self, method, payload, key=None, attempts=0):
+        """Makes one delivery attempt within the global rate limit, returns its result, the retry delay and the error
+
+        attempts is the number of attempts made before this one, the retry delay grows with it. The chat's own rate
+        limit is the caller's, the outbox worker only sends to chats with a token.
+        """
+
+        payload = dict(payload)
+
+        while True:
+            self.global_bucket.acquire()
+
+            try:
+                getattr(self.bot, method)(**payload)
+
+                return SENT, None, None
+            except RetryAfter as e:
+                logging.warning('Flood control for chat %s, retry in %s seconds', payload['chat_id'], e.retry_after)
+
+                # Flood control applies to the chat, the message delayed holds back the later ones of its chat only
+                return RETRIED, e.retry_after, str(e)
+            except ChatMigrated as e:
+                payload['chat_id'] = e.new_chat_id
+            except (Unauthorized, BadRequest) as e:
+                logging.warning('Message %s to chat %s rejected: %s', key, payload['chat_id'], e)
+
+                return FAILED, None, str(e)
+            except (TimedOut, NetworkError) as e:
+                logging.warning('Message %s to chat %s failed: %s', key, payload['chat_id'], e)
+
+                return RETRIED, self.backoff * 2 ** attempts, str(e)
+            except Exception as e:
+                logging.exception('Message %s to chat %s failed', key, payload['chat_id'])
+
+                return RETRIED, self.backoff * 2 ** attempts, str(e) or type(e).__name__
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,182 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.error import TelegramError
+
+
+class LRUCache:
+    maxsize = 1024
+    ttl = 300
+
+    def __init__(self, maxsize=None, ttl=None):
+        self.lock = threading.RLock()
+        self.items = OrderedDict()
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.configure(maxsize or self.maxsize, ttl or self.ttl)
+
+    def configure(self, maxsize, ttl):
+        with self.lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+
+            self.__shrink()
+
+    def __shrink(self):
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+
+            if item is None or item[1] < time.monotonic():
+                if item is not None:
+                    del self.items[key]
+
+                self.misses += 1
+                return None
+
+            self.items.move_to_end(key)
+            self.hits += 1
+
+            return item[0]
+
+    def put(self, key, value, generation=None):
+        with self.lock:
+            # A value loaded before an invalidation must not overwrite it
+            if generation is not None and generation != self.generation:
+                return
+
+            self.items[key] = (value, time.monotonic() + self.ttl)
+            self.items.move_to_end(key)
+
+            self.__shrink()
+
+    def get_or_load(self, key, loader):
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        generation = self.generation
+        value = loader()
+
+        self.put(key, value, generation)
+
+        return value
+
+    def invalidate(self, *keys):
+        with self.lock:
+            self.generation += 1
+
+            for key in keys:
+                self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.items.clear()
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                size=len(self.items), maxsize=self.maxsize,
+                hits=self.hits, misses=self.misses, evictions=self.evictions
+            )
+
+
+class AdminCache(LRUCache):
+    refresh = 300
+
+    def __init__(self, *args, **kwargs):
+        super(AdminCache, self).__init__(*args, **kwargs)
+
+        self.refreshing = set()
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='admins')
+
+    def fetch(self, bot, key):
+        generation = self.generation
+        admins = frozenset(member.user.id for member in bot.get_chat_administrators(key))
+
+        self.put(key, (admins, time.monotonic()), generation)
+
+        return admins
+
+    def get_admins(self, bot, chat_id):
+        key = str(chat_id)
+
+        item = self.get(key)
+        if item is None:
+            return self.fetch(bot, key)
+
+        admins, fetched = item
+        if time.monotonic() - fetched > self.refresh:
+            self.refresh_later(bot, key)
+
+        return admins
+
+    def refresh_later(self, bot, key):
+        with self.lock:
+            if key in self.refreshing:
+                return
+
+            self.refreshing.add(key)
+
+        self.executor.submit(self.__refresh, bot, key)
+
+    def __refresh(self, bot, key):
+        try:
+            self.fetch(bot, key)
+        except TelegramError as e:
+            logging.warning('Admins refresh for chat %s failed: %s', key, e)
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+
+ChatSnapshot = namedtuple('ChatSnapshot', ['id', 'chat_id', 'timezone', 'current_target_id', 'current_target'])
+TargetSnapshot = namedtuple(
+    'TargetSnapshot', ['id', 'name', 'initial_value', 'target_value', 'target_date', 'date_creation']
+)
+
+
+def snapshot_chat(chat, target):
+    current_target = None
+    if target is not None:
+        current_target = TargetSnapshot(
+            id=target.id, name=target.name, initial_value=target.initial_value, target_value=target.target_value,
+            target_date=target.target_date, date_creation=target.date_creation
+        )
+
+    return ChatSnapshot(
+        id=chat.id, chat_id=chat.chat_id, timezone=chat.timezone, current_target_id=chat.current_target_id,
+        current_target=current_target
+    )
+
+
+Leaderboard = namedtuple('Leaderboard', ['since', 'rows'])
+LeaderboardRow = namedtuple('LeaderboardRow', ['user_id', 'total', 'week', 'total_rank', 'week_rank'])
+
+
+chats = LRUCache()
+admins = AdminCache()
+leaderboards = LRUCache()
+members = LRUCache()
+
+
+def init_cache(settings):
+    chats.configure(settings.CHAT_CACHE_SIZE, settings.CHAT_CACHE_TTL)
+
+    admins.configure(settings.ADMIN_CACHE_SIZE, settings.ADMIN_CACHE_TTL)
+    admins.refresh = settings.ADMIN_CACHE_REFRESH
+
+    leaderboards.configure(settings.LEADERBOARD_CACHE_SIZE, settings.LEADERBOARD_CACHE_TTL)
+    members.configure(settings.MEMBER_CACHE_SIZE, settings.MEMBER_CACHE_TTL)
@@ -0,0 +1,150 @@
+import logging
+import select
+import threading
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from step_bot import cache
+
+CHANNEL = 'step_bot_cache'
+
+NOTIFY = text("SELECT pg_notify(:channel, :payload)").bindparams(channel=CHANNEL)
+
+ALL_KEYS = '*'
+
+# Notification payloads must be shorter than 8000 bytes
+MAX_PAYLOAD = 7000
+
+
+def synced_caches():
+    # Caches of database rows, every replica and shard worker holds its own copy
+    return dict(chats=cache.chats, leaderboards=cache.leaderboards)
+
+
+def touch(db_session, name, *keys):
+    """Drops the keys from the cache of every process once db_session commits, a rollback keeps them"""
+
+    db_session.info.setdefault('changed_cache_keys', dict()).setdefault(name, set()).update(str(key) for key in keys)
+
+
+def invalidate(name, keys):
+    synced = synced_caches().get(name)
+    if synced is None:
+        return
+
+    if ALL_KEYS in keys:
+        synced.clear()
+    else:
+        synced.invalidate(*keys)
+
+
+def payloads(changed):
+    for name, keys in changed.items():
+        if ALL_KEYS in keys:
+            yield '{0}:{1}'.format(name, ALL_KEYS)
+            continue
+
+        batch, size = [], 0
+        for key in sorted(keys):
+            if batch and size + len(key) > MAX_PAYLOAD:
+                yield '{0}:{1}'.format(name, ','.join(batch))
+                batch, size = [], 0
+
+            batch.append(key)
+            size += len(key) + 1
+
+        if batch:
+            yield '{0}:{1}'.format(name, ','.join(batch))
+
+
+@event.listens_for(Session, 'before_commit')
+def notify_changed(db_session):
+    # Notifications are delivered on commit, so other processes reload the committed rows
+    for payload in payloads(db_session.info.get('changed_cache_keys') or dict()):
+        db_session.execute(NOTIFY, dict(payload=payload))
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_changed(db_session):
+    # This process drops the keys right away rather than once its own notification comes back
+    for name, keys in (db_session.info.pop('changed_cache_keys', None) or dict()).items():
+        invalidate(name, keys)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_changed(db_session):
+    db_session.info.pop('changed_cache_keys', None)
+
+
+class CacheListener:
+    """Applies the invalidations committed by other processes to the caches of this one"""
+
+    connection = None
+    thread = None
+
+    interval = 5
+
+    def __init__(self, engine):
+        # The listening connection is opened on start and again after every failure, not here
+        self.engine = engine
+
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__run, name='cache-listener')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+        if self.thread:
+            self.thread.join()
+
+        self.__close()
+
+    def __run(self):
+        while not self.stopped.is_set():
+            try:
+                self.listen()
+                self.wait(self.interval)
+            except Exception as e:
+                logging.warning('Cache invalidation listener failed: %s', e)
+
+                self.__close()
+                self.stopped.wait(self.interval)
+
+    def listen(self):
+        if self.connection is not None:
+            return
+
+        self.connection = self.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        self.connection.execute(text('LISTEN {0}'.format(CHANNEL)))
+
+        # Invalidations committed while nobody listened are lost, so nothing cached before is trusted
+        for synced in synced_caches().values():
+            synced.clear()
+
+    def wait(self, timeout):
+        raw = self.connection.connection.connection
+
+        if not select.select([raw], [], [], timeout)[0]:
+            return
+
+        raw.poll()
+
+        for notify in raw.notifies:
+            name, _, keys = notify.payload.partition(':')
+            invalidate(name, keys.split(','))
+
+        del raw.notifies[:]
+
+    def __close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+
+            self.connection = None
@@ -0,0 +1,71 @@
+import importlib.util
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from step_bot.cache import LRUCache
+
+
+def render(kind, data):
+    # Runs in a worker process, so the plotting library is only imported there
+    if kind == 'progress':
+        from step_bot.charts.progress import render_progress
+
+        return render_progress(data)
+
+    raise ValueError("Unknown chart: {0}".format(kind))
+
+
+class ChartRenderer:
+    workers = 2
+
+    executor = None
+
+    def __init__(self):
+        self.files = LRUCache()
+
+    def configure(self, settings):
+        self.workers = settings.CHART_WORKERS
+        self.files.configure(settings.CHART_CACHE_SIZE, settings.CHART_CACHE_TTL)
+
+    @property
+    def enabled(self):
+        # Workers may be configured while matplotlib is missing or the renderer is stopped
+        return self.executor is not None
+
+    def start(self):
+        if not self.workers or self.executor:
+            return
+
+        if importlib.util.find_spec('matplotlib') is None:
+            logging.warning('matplotlib is not installed, charts are disabled')
+
+            self.workers = 0
+            return
+
+        # Images are rendered away from the dispatcher and the event loop, spawned workers share no locks with them
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def stop(self):
+        if self.executor:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def submit(self, kind, data):
+        return self.executor.submit(render, kind, data)
+
+    def get_file_id(self, key):
+        return self.files.get(key)
+
+    def put_file_id(self, key, file_id):
+        self.files.put(key, file_id)
+
+
+renderer = ChartRenderer()
+
+
+def init_charts(settings):
+    renderer.configure(settings)
+
+    # Worker processes are spawned on the first render
+    renderer.start()
@@ -0,0 +1,63 @@
+import io
+from datetime import timedelta
+
+import matplotlib
+
+matplotlib.use('Agg')
+
+import matplotlib.pyplot as plt  # noqa: E402
+from matplotlib.dates import DateFormatter  # noqa: E402
+
+
+def cumulative(days, points):
+    values = dict(points)
+
+    total = 0
+    result = []
+    for day in days:
+        total += values.get(day, 0)
+        result.append(total / 1000)
+
+    return result
+
+
+def render_progress(data):
+    date_from, date_to, today = data['date_from'], data['date_to'], data['today']
+
+    last_day = min(today, date_to)
+    days = [date_from + timedelta(days=offset) for offset in range((last_day - date_from).days + 1)]
+
+    figure, axes = plt.subplots(figsize=(8, 4.5), dpi=100)
+
+    try:
+        layers = [[data['initial'] / 1000] * len(days)]
+        labels = ['Начальное значение']
+
+        for label, points in data['series']:
+            layers.append(cumulative(days, points))
+            labels.append(label)
+
+        axes.stackplot(days, *layers, labels=labels, alpha=0.8)
+
+        axes.plot(
+            [date_from, date_to], [data['initial'] / 1000, data['target_value'] / 1000],
+            color='black', linestyle='--', linewidth=1.5, label='Идеальный темп'
+        )
+
+        axes.set_title(data['name'])
+        axes.set_ylabel('км')
+        axes.set_xlim(date_from, date_to)
+        axes.set_ylim(bottom=0)
+        axes.xaxis.set_major_formatter(DateFormatter('%d.%m'))
+        axes.grid(alpha=0.3)
+        axes.legend(loc='upper left', fontsize='small')
+
+        figure.autofmt_xdate()
+        figure.tight_layout()
+
+        stream = io.BytesIO()
+        figure.savefig(stream, format='png')
+
+        return stream.getvalue()
+    finally:
+        plt.close(figure)
@@ -0,0 +1,200 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from step_bot.db import session_scope
+from step_bot.models import ConversationState
+
+
+def conversation_key(key):
+    if isinstance(key, tuple):
+        return ':'.join(str(part) for part in key)
+
+    return str(key)
+
+
+class MemoryConversationStore:
+    ttl = 600
+    max_entries = 10000
+
+    def __init__(self, name, ttl=None, max_entries=None):
+        self.name = name
+        self.ttl = ttl or self.ttl
+        self.max_entries = max_entries or self.max_entries
+
+        self.lock = threading.RLock()
+        self.entries = OrderedDict()
+
+    def __entry(self, key):
+        entry = self.entries.get(key)
+
+        # Expired rows are purged from the persistent store on load or overwritten on the next update
+        if entry is not None and entry['expire'] < time.time():
+            del self.entries[key]
+            return None
+
+        return entry
+
+    def __evict(self):
+        evicted = []
+
+        while len(self.entries) > self.max_entries:
+            key, _ = self.entries.popitem(last=False)
+
+            logging.warning('Conversation %s of %s evicted, store is full', key, self.name)
+
+            evicted.append(key)
+
+        return evicted
+
+    def keys(self):
+        with self.lock:
+            return [key for key in list(self.entries.keys()) if self.__entry(key) is not None]
+
+    def get_state(self, key):
+        with self.lock:
+            entry = self.__entry(key)
+
+            return entry['state'] if entry else None
+
+    def get_data(self, key):
+        with self.lock:
+            entry = self.__entry(key)
+
+            return entry['data'] if entry else None
+
+    def update(self, key, **values):
+        with self.lock:
+            entry = dict(self.__entry(key) or dict(state=None, data=None))
+            entry.update(values)
+            entry['expire'] = time.time() + self.ttl
+
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+
+            evicted = self.__evict()
+
+        for evicted_key in evicted:
+            self.forget(evicted_key)
+
+        return entry
+
+    def set_state(self, key, state):
+        self.update(key, state=state)
+
+    def set_data(self, key, data):
+        self.update(key, data=data)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+        self.forget(key)
+
+    def forget(self, key):
+        pass
+
+
+class PostgresConversationStore(MemoryConversationStore):
+    get_db = None
+
+    def __init__(self, name, get_db, *args, **kwargs):
+        super(PostgresConversationStore, self).__init__(name, *args, **kwargs)
+
+        self.get_db = get_db
+
+        self.load()
+
+    def load(self):
+        now = datetime.now(tz=pytz.utc)
+
+        with session_scope(self.get_db) as db_session:
+            db_session.query(ConversationState) \
+                .filter(ConversationState.date_expire < now) \
+                .delete(synchronize_session=False)
+
+            rows = db_session.query(ConversationState) \
+                .filter(ConversationState.handler == self.name) \
+                .order_by(ConversationState.date_expire) \
+                .all()
+
+            for row in rows:
+                self.entries[row.key] = dict(
+                    state=row.state, data=row.data, expire=time.time() + (row.date_expire - now).total_seconds()
+                )
+
+        logging.info('Restored %d conversations of %s', len(rows), self.name)
+
+    def update(self, key, **values):
+        entry = super(PostgresConversationStore, self).update(key, **values)
+
+        stmt = insert(ConversationState.__table__).values(
+            handler=self.name, key=key, state=entry['state'], data=entry['data'],
+            date_expire=datetime.now(tz=pytz.utc) + timedelta(seconds=self.ttl)
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['handler', 'key'],
+            set_=dict(state=stmt.excluded.state, data=stmt.excluded.data, date_expire=stmt.excluded.date_expire)
+        )
+
+        try:
+            with session_scope(self.get_db) as db_session:
+                db_session.execute(stmt)
+        except SQLAlchemyError as e:
+            logging.warning('Conversation %s of %s was not persisted: %s', key, self.name, e)
+
+        return entry
+
+    def forget(self, key):
+        try:
+            with session_scope(self.get_db) as db_session:
+                db_session.query(ConversationState) \
+                    .filter(ConversationState.handler == self.name, ConversationState.key == key) \
+                    .delete(synchronize_session=False)
+        except SQLAlchemyError as e:
+            logging.warning('Conversation %s of %s was not removed: %s', key, self.name, e)
+
+
+class ConversationMapping(MutableMapping):
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, key):
+        state = self.store.get_state(conversation_key(key))
+        if state is None:
+            raise KeyError(key)
+
+        return state
+
+    def __setitem__(self, key, state):
+        self.store.set_state(conversation_key(key), state)
+
+    def __delitem__(self, key):
+        key = conversation_key(key)
+
+        if self.store.get_state(key) is None:
+            raise KeyError(key)
+
+        self.store.delete(key)
+
+    def __iter__(self):
+        return iter(self.store.keys())
+
+    def __len__(self):
+        return len(self.store.keys())
+
+
+def create_store(settings, db, name, ttl):
+    options = dict(ttl=ttl, max_entries=settings.CONVERSATION_MAX_ENTRIES)
+
+    if settings.CONVERSATION_STORE == 'postgres':
+        return PostgresConversationStore(name, db, **options)
+
+    return MemoryConversationStore(name, **options)
@@ -0,0 +1,111 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+from step_bot.db.queries import query_scope
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+        self.pool = None
+
+    def record_wait(self, seconds, timed_out=False):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(
+                checkouts=self.checkouts, timeouts=self.timeouts,
+                wait_total=self.wait_total, wait_max=self.wait_max,
+                wait_avg=self.wait_total / self.checkouts if self.checkouts else 0.0
+            )
+
+        pool = self.pool
+        if pool is not None:
+            stats.update(
+                size=pool.size(), checked_out=pool.checkedout(), checked_in=pool.checkedin(), overflow=pool.overflow()
+            )
+
+        return stats
+
+
+pool_metrics = PoolMetrics()
+
+
+class MeteredQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super(MeteredQueuePool, self).__init__(*args, **kwargs)
+
+        pool_metrics.pool = self
+
+    def _do_get(self):
+        started = time.monotonic()
+
+        try:
+            connection = super(MeteredQueuePool, self)._do_get()
+        except TimeoutError:
+            pool_metrics.record_wait(time.monotonic() - started, timed_out=True)
+            raise
+
+        pool_metrics.record_wait(time.monotonic() - started)
+
+        return connection
+
+
+def database_url(settings):
+    return "postgresql+psycopg2://{login}:{password}@{host}:{port}/{database}".format(
+        login=settings.POSTGRES_USER, password=settings.POSTGRES_PASS,
+        host=settings.POSTGRES_HOST, port=settings.POSTGRES_PORT,
+        database=settings.POSTGRES_DB
+    )
+
+
+def create_db_engine(settings):
+    return create_engine(
+        database_url(settings),
+        poolclass=MeteredQueuePool,
+        pool_size=settings.POSTGRES_MAX_CONN,
+        max_overflow=settings.POSTGRES_MAX_OVERFLOW,
+        pool_timeout=settings.POSTGRES_POOL_TIMEOUT,
+        pool_recycle=settings.POSTGRES_POOL_RECYCLE,
+        pool_pre_ping=settings.POSTGRES_POOL_PRE_PING
+    )
+
+
+def create_dedicated_engine(settings):
+    # Connections held for the process lifetime, e.g. by an advisory lock, are opened outside of the pool
+    return create_engine(database_url(settings), poolclass=NullPool)
+
+
+@contextmanager
+def session_scope(get_db, name=None):
+    with query_scope(name):
+        db_session = get_db()
+
+        try:
+            yield db_session
+
+            db_session.commit()
+        except Exception:
+            db_session.rollback()
+            raise
+        finally:
+            db_session.close()
@@ -0,0 +1,166 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+UNSCOPED = 'unscoped'
+
+
+class QueryScope:
+    def __init__(self, name):
+        self.name = name
+
+        self.statements = 0
+        self.seen = defaultdict(int)
+
+
+class QueryStats:
+    slow_query = 0.25
+    n_plus_one = 10
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        self.scopes = defaultdict(lambda: dict(
+            executions=0, statements=0, time_total=0.0, time_max=0.0, slow=0, n_plus_one=0
+        ))
+
+    def configure(self, slow_query, n_plus_one):
+        self.slow_query = slow_query
+        self.n_plus_one = n_plus_one
+
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+
+        return self.local.stack
+
+    def current(self):
+        stack = self.stack()
+
+        return stack[-1] if stack else None
+
+    def enter(self, name):
+        scope = QueryScope(name)
+
+        self.stack().append(scope)
+
+        return scope
+
+    def leave(self, scope):
+        self.stack().remove(scope)
+
+        with self.lock:
+            self.scopes[scope.name]['executions'] += 1
+
+    def record(self, statement, parameters, elapsed):
+        scope = self.current()
+        name = scope.name if scope else UNSCOPED
+
+        repeated = 0
+        if scope is not None:
+            scope.statements += 1
+            scope.seen[statement] += 1
+
+            # The same statement over and over in one handler call is a lazy load or a query in a loop
+            if scope.seen[statement] == self.n_plus_one:
+                repeated = scope.seen[statement]
+
+        with self.lock:
+            stats = self.scopes[name]
+
+            stats['statements'] += 1
+            if elapsed is not None:
+                stats['time_total'] += elapsed
+                stats['time_max'] = max(stats['time_max'], elapsed)
+
+            if elapsed is not None and elapsed >= self.slow_query:
+                stats['slow'] += 1
+            if repeated:
+                stats['n_plus_one'] += 1
+
+        if elapsed is not None and elapsed >= self.slow_query:
+            logging.warning(
+                'Slow query in %s took %.3fs: %s; parameters: %.1000r', name, elapsed, statement, parameters
+            )
+
+        if repeated:
+            logging.warning('Possible N+1 in %s, statement repeated %d times: %s', name, repeated, statement)
+
+    def statements(self, name=None):
+        with self.lock:
+            if name is not None:
+                return self.scopes[name]['statements'] if name in self.scopes else 0
+
+            return sum(stats['statements'] for stats in self.scopes.values())
+
+    def stats(self):
+        with self.lock:
+            result = dict()
+
+            for name, stats in self.scopes.items():
+                executions = stats['executions']
+
+                result[name] = dict(
+                    stats,
+                    per_execution=stats['statements'] / executions if executions else 0.0,
+                    time_avg=stats['time_total'] / stats['statements'] if stats['statements'] else 0.0
+                )
+
+            return result
+
+    def reset(self):
+        with self.lock:
+            self.scopes.clear()
+
+
+query_stats = QueryStats()
+
+
+@contextmanager
+def query_scope(name):
+    if name is None:
+        yield query_stats.current()
+        return
+
+    scope = query_stats.enter(name)
+
+    try:
+        yield scope
+    finally:
+        query_stats.leave(scope)
+
+
+@contextmanager
+def query_budget(limit, name=None):
+    """Fails when more than limit statements are issued inside the block, overall or in the named scope"""
+
+    before = query_stats.statements(name)
+
+    yield
+
+    issued = query_stats.statements(name) - before
+    if issued > limit:
+        raise AssertionError('{0} issued {1} statements, the budget is {2}'.format(name or 'Block', issued, limit))
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.monotonic()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_started', None)
+
+    query_stats.record(statement, parameters, time.monotonic() - started if started is not None else None)
+
+
+def instrument_engine(engine, settings):
+    query_stats.configure(settings.SQL_SLOW_QUERY / 1000, settings.SQL_N_PLUS_ONE)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
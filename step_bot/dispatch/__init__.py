@@ -0,0 +1,110 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram import Update
+
+
+def update_key(update):
+    if not isinstance(update, Update):
+        return None
+
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+
+    # Updates without a chat, e.g. inline queries, are ordered with the other updates of their user
+    if update.effective_user is not None:
+        return update.effective_user.id
+
+    return None
+
+
+class ChatExecutor:
+    """Runs updates of different chats in parallel and the updates of one chat strictly one after another
+
+    Every chat with pending updates has a queue, only its head is running on the pool at a time. After each update
+    the next one of the chat goes to the back of the pool queue, so a busy chat does not starve the others.
+    """
+
+    workers = 8
+    max_pending = 1000
+
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chat')
+
+        self.lock = threading.Lock()
+        self.queues = dict()
+
+        # Bounds updates taken off the update queue, a backlog stays visible as its depth
+        self.slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, key, fn, *args):
+        self.slots.acquire()
+
+        task = (fn, args)
+
+        with self.lock:
+            queue = self.queues.get(key)
+            if queue is not None:
+                queue.append(task)
+                return
+
+            self.queues[key] = deque()
+
+        self.executor.submit(self.__run, key, task)
+
+    def __run(self, key, task):
+        fn, args = task
+
+        try:
+            fn(*args)
+        except Exception:
+            logging.exception('Update of chat %s failed', key)
+        finally:
+            self.slots.release()
+
+        with self.lock:
+            queue = self.queues[key]
+            if not queue:
+                del self.queues[key]
+                return
+
+            task = queue.popleft()
+
+        self.executor.submit(self.__run, key, task)
+
+    def depths(self):
+        """Updates of every chat waiting or running"""
+
+        with self.lock:
+            return {key: len(queue) + 1 for key, queue in self.queues.items()}
+
+    def stats(self):
+        depths = self.depths()
+
+        return dict(
+            chats=len(depths), pending=sum(depths.values()), max_depth=max(depths.values()) if depths else 0
+        )
+
+    def shutdown(self):
+        # Tasks of a chat queue each other, so the pool is only shut down once every queue is drained
+        for _ in range(self.max_pending):
+            self.slots.acquire()
+
+        self.executor.shutdown(wait=True)
+
+
+def serialize_dispatcher(dispatcher, executor):
+    process_update = dispatcher.process_update
+
+    def submit_update(update):
+        executor.submit(update_key(update), process_update, update)
+
+    # The dispatcher thread only hands updates over, handlers and conversations run on the chat executor
+    dispatcher.process_update = submit_update
+
+    return dispatcher
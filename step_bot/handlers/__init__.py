@@ -1,14 +1,29 @@
 import logging
 import textwrap
+import threading
+from datetime import datetime
 
+from telegram.error import TelegramError
+from sqlalchemy.orm.exc import NoResultFound
 from telegram.ext import CommandHandler, ConversationHandler
 
+from step_bot import cache, outbox
+from step_bot.aio import runtime
+from step_bot.cache import sync
+from step_bot.conversations import ConversationMapping, conversation_key, create_store
+from step_bot.db import session_scope
+from step_bot.metrics import handler_errors, handler_latency, timed_callback
+from step_bot.models import Chat, Target
+from step_bot.timezones import get_timezone
+
 
 def init_handlers(dispatcher, db, settings):
-    from step_bot.handlers.steps import TodayHandler, DayHandler
+    from step_bot.handlers.steps import TodayHandler, DayHandler, DaysHandler
     from step_bot.handlers.targets import NewTargetHandler, UpdateTargetHandler
     from step_bot.handlers.greetings import GroupHandler, P2PEchoHandler
-    from step_bot.handlers.stats import StatHandler
+    from step_bot.handlers.stats import HistoryHandler, StatHandler, TopHandler
+    from step_bot.handlers.imports import ImportHandler
+    from step_bot.handlers.chats import TimezoneHandler
 
     dispatcher.add_error_handler(log_error)
 
@@ -25,8 +40,13 @@ def init_handlers(dispatcher, db, settings):
 
     handlers.add(TodayHandler(**options))
     handlers.add(DayHandler(**options))
+    handlers.add(DaysHandler(**options))
+    handlers.add(ImportHandler(**options))
 
     handlers.add(StatHandler(**options))
+    handlers.add(TopHandler(**options))
+    handlers.add(HistoryHandler(**options))
+    handlers.add(TimezoneHandler(**options))
 
     return handlers
 
@@ -37,22 +57,28 @@ def log_error(bot, update, error):
 
 def restricted(handler):
 
+    def allowed(bot, update):
+        from_user_id = update.message.from_user.id
+        admins = cache.admins.get_admins(bot, update.effective_chat.id)
+
+        is_admin = from_user_id in admins
+
+        if is_admin or update.effective_chat.all_members_are_administrators is not None:
+            return True
+
+        bot.send_message(
+            chat_id=update.message.chat_id, text="Управлять мной может только администратор группы!"
+        )
+
+        return False
+
     def wrapped(self, bot, update, cleaned_args, *args, **kwargs):
         if not isinstance(self, CommandBaseHandler):
             logging.error("restricted decorator can use only with commands!")
             return
 
-        from_user_id = update.message.from_user.id
-        admins = update.effective_chat.get_administrators()
-
-        is_admin = any(admin for admin in admins if admin.user.id == from_user_id)
-
-        if is_admin or update.effective_chat.all_members_are_administrators is not None:
+        if allowed(bot, update):
             return handler(self, bot, update, cleaned_args, *args, **kwargs)
-        else:
-            bot.send_message(
-                chat_id=update.message.chat_id, text="Управлять мной может только администратор группы!"
-            )
 
     return wrapped
 
@@ -69,6 +95,65 @@ class BaseHandler:
 
         self.settings = settings
 
+    def add_handler(self, handler):
+        self.dispatcher.add_handler(self.timed(handler))
+
+    def timed(self, handler):
+        handler.callback = timed_callback(type(self).__name__, handler.callback)
+
+        return handler
+
+    def session_scope(self):
+        return session_scope(self.get_db, type(self).__name__)
+
+    def get_chat(self, db_session, chat_id):
+        def load():
+            chat, target = db_session.query(Chat, Target) \
+                .outerjoin(Target, Target.id == Chat.current_target_id) \
+                .filter(Chat.chat_id == str(chat_id)) \
+                .one()
+
+            return cache.snapshot_chat(chat, target)
+
+        return cache.chats.get_or_load(str(chat_id), load)
+
+    def chat_timezone(self, chat):
+        return get_timezone(chat.timezone if chat is not None else None, self.settings.BOT_TZ)
+
+    def chat_today(self, chat):
+        return datetime.now(tz=self.chat_timezone(chat)).date()
+
+    def target_start(self, chat):
+        # Targets are created at a moment, the first day of the target is the chat's day of that moment
+        return chat.current_target.date_creation.astimezone(self.chat_timezone(chat)).date()
+
+    def get_chat_timezone(self, chat_id):
+        with self.session_scope() as db_session:
+            try:
+                return self.chat_timezone(self.get_chat(db_session, chat_id))
+            except NoResultFound:
+                return self.settings.BOT_TZ
+
+    def get_member_name(self, bot, chat_id, user_id):
+        def load():
+            try:
+                return bot.get_chat_member(chat_id, int(user_id)).user.first_name
+            except (TelegramError, ValueError):
+                return str(user_id)
+
+        return cache.members.get_or_load('{0}:{1}'.format(chat_id, user_id), load)
+
+    def invalidate_chat(self, db_session, *chat_ids):
+        # Every replica drops the chats once the transaction commits
+        sync.touch(db_session, 'chats', *chat_ids)
+
+    def invalidate_admins(self, *chat_ids):
+        cache.admins.invalidate(*[str(chat_id) for chat_id in chat_ids])
+
+    def queue_message(self, db_session, update, index=0, **kwargs):
+        # Delivered by the outbox worker once the transaction commits, a rollback discards the message
+        return outbox.send_message(db_session, outbox.message_key(update, index), **kwargs)
+
     def send_error(self, bot, chat_id, **kwargs):
         bot.send_message(chat_id=chat_id, text="Ой! Что-то пошло не так, соощите разработчикам!", **kwargs)
 
@@ -76,8 +161,34 @@ class BaseHandler:
         bot.send_message(chat_id=chat_id, text=msg, **kwargs)
 
 
+class LocalConversationHandler(ConversationHandler):
+    """Keeps the conversation being handled per thread, updates of different chats are handled concurrently"""
+
+    def __init__(self, *args, **kwargs):
+        self.local = threading.local()
+
+        super(LocalConversationHandler, self).__init__(*args, **kwargs)
+
+    @property
+    def current_conversation(self):
+        return getattr(self.local, 'conversation', None)
+
+    @current_conversation.setter
+    def current_conversation(self, value):
+        self.local.conversation = value
+
+    @property
+    def current_handler(self):
+        return getattr(self.local, 'handler', None)
+
+    @current_handler.setter
+    def current_handler(self, value):
+        self.local.handler = value
+
+
 class ConversationBaseHandler(BaseHandler):
     handler = None
+    store = None
 
     entry_points = []
     states = {}
@@ -90,12 +201,25 @@ class ConversationBaseHandler(BaseHandler):
     def __init__(self, *args, **kwargs):
         super(ConversationBaseHandler, self).__init__(*args, **kwargs)
 
-        self.handler = ConversationHandler(
+        state_handlers = [handler for handlers in self.states.values() for handler in handlers]
+        for handler in self.entry_points + self.fallbacks + state_handlers:
+            self.timed(handler)
+
+        self.handler = LocalConversationHandler(
             entry_points=self.entry_points, states=self.states, fallbacks=self.fallbacks,
             per_user=self.per_user, per_chat=self.per_chat, conversation_timeout=self.conversation_timeout)
 
+        self.store = create_store(self.settings, self.get_db, type(self).__name__, self.conversation_timeout)
+        self.handler.conversations = ConversationMapping(self.store)
+
         self.dispatcher.add_handler(self.handler)
 
+    def get_conversation_data(self, conversation=None):
+        return self.store.get_data(conversation_key(conversation or self.handler.current_conversation))
+
+    def set_conversation_data(self, data, conversation=None):
+        self.store.set_data(conversation_key(conversation or self.handler.current_conversation), data)
+
 
 class CommandBaseHandler(BaseHandler):
     command = None
@@ -106,7 +230,7 @@ class CommandBaseHandler(BaseHandler):
     def __init__(self, *args, **kwargs):
         super(CommandBaseHandler, self).__init__(*args, **kwargs)
 
-        self.dispatcher.add_handler(CommandHandler(self.command, self.handle, pass_args=True))
+        self.add_handler(CommandHandler(self.command, self.handle, pass_args=True))
 
     def clean_args(self, args):
         raise NotImplemented
@@ -145,3 +269,52 @@ class CheckTargetMixin:
 
             return False
         return True
+
+
+class AsyncBaseHandler(BaseHandler):
+    runtime = runtime
+
+    def timed(self, handler):
+        # Callbacks only wait for their coroutines here, guard observes the whole run
+        return handler
+
+    def get_async_db(self):
+        return self.runtime.session(type(self).__name__)
+
+    async def run_io(self, fn, *args, **kwargs):
+        return await self.runtime.run_io(fn, *args, **kwargs)
+
+    async def guard(self, coro, update):
+        with handler_latency.time(handler=type(self).__name__):
+            try:
+                return await coro
+            except Exception as e:
+                handler_errors.inc(handler=type(self).__name__)
+
+                self.dispatcher.dispatch_error(update, e)
+
+    def run(self, coro, update):
+        # The callback waits for its coroutine, so it keeps the slot of the chat on the ChatExecutor and the next
+        # update of the chat starts only after it
+        return self.runtime.submit(self.guard(coro, update)).result()
+
+
+class AsyncCommandBaseHandler(AsyncBaseHandler, CommandBaseHandler):
+    def handle(self, bot, update, args):
+        self.run(self.handle_async(bot, update, args), update)
+
+    async def handle_async(self, bot, update, args):
+        try:
+            cleaned_args = self.clean_args(args)
+
+            await self.execute(bot, update, cleaned_args)
+        except ValueError as e:
+            await self.run_io(
+                self.send_clean_error,
+                bot, update.effective_chat.id, reply_to_message_id=update.effective_message.message_id
+            )
+
+            logging.exception(e)
+
+    async def execute(self, bot, update, cleaned_args):
+        raise NotImplementedError
@@ -0,0 +1,48 @@
+import logging
+import textwrap
+from datetime import datetime
+
+import pytz
+import telegram
+from sqlalchemy.orm.exc import NoResultFound
+
+from step_bot.handlers import CommandBaseHandler, restricted
+from step_bot.models import Chat
+
+
+class TimezoneHandler(CommandBaseHandler):
+    command = "timezone"
+    clean_error_message = "Неизвестный часовой пояс!"
+    usage_params = "<Часовой пояс, например Europe/Moscow или Asia/Yekaterinburg>"
+
+    def clean_args(self, args):
+        if len(args) != 1:
+            raise ValueError("Number of arguments incorrect")
+
+        try:
+            tz = pytz.timezone(args[0])
+        except pytz.UnknownTimeZoneError:
+            raise ValueError("Unknown time zone")
+
+        return dict(timezone=tz)
+
+    @restricted
+    def execute(self, bot, update, cleaned_args):
+        chat_id = update.effective_chat.id
+        tz = cleaned_args.get("timezone")
+
+        with self.session_scope() as db_session:
+            try:
+                db_session.query(Chat).filter(Chat.chat_id == str(chat_id)).one().timezone = tz.zone
+                self.invalidate_chat(db_session, chat_id)
+
+                self.queue_message(
+                    db_session, update, chat_id=chat_id, text=textwrap.dedent("""\
+                    Теперь у чата часовой пояс *{0}*, сейчас здесь *{1}*
+                    Напоминания будут приходить по этому времени
+                    """.format(tz.zone, datetime.now(tz=tz).strftime("%d.%m.%Y %H:%M"))),
+                    reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN)
+            except NoResultFound as e:
+                self.send_error(bot, chat_id, reply_to_message_id=update.effective_message.message_id)
+
+                logging.exception(e)
@@ -33,42 +33,40 @@ class GroupHandler(BaseHandler):
     def __init__(self, *args, **kwargs):
         super(GroupHandler, self).__init__(*args, **kwargs)
 
-        self.dispatcher.add_handler(MessageHandler(Filters.status_update.chat_created, self.chat_created))
-        self.dispatcher.add_handler(MessageHandler(Filters.status_update.migrate, self.chat_migrate))
-        self.dispatcher.add_handler(MessageHandler(Filters.status_update.new_chat_members, self.new_member))
+        self.add_handler(MessageHandler(Filters.status_update.chat_created, self.chat_created))
+        self.add_handler(MessageHandler(Filters.status_update.migrate, self.chat_migrate))
+        self.add_handler(MessageHandler(Filters.status_update.new_chat_members, self.new_member))
+        self.add_handler(MessageHandler(Filters.status_update.left_chat_member, self.left_member))
 
     def __create_chat(self, bot, chat_id):
-        db_session = self.get_db()
+        with self.session_scope() as db_session:
+            try:
+                db_session.query(Chat).filter(Chat.chat_id == str(chat_id)).one()
+            except NoResultFound:
+                new_chat = Chat(id=uuid.uuid4(), chat_id=chat_id)
 
-        try:
-            db_session.query(Chat).filter(Chat.chat_id == str(chat_id)).one()
-        except NoResultFound:
-            new_chat = Chat(id=uuid.uuid4(), chat_id=chat_id)
+                db_session.add(new_chat)
 
-            db_session.add(new_chat)
-        finally:
-            bot.send_message(
-                chat_id=chat_id, text=textwrap.dedent("""\
-                Всем привет!
-
-                Меня зовут *%s*, я запомнил ваш чат!
-                Нужно установить цель для этой дружной команды!
-                """ % bot.first_name), parse_mode=telegram.ParseMode.MARKDOWN
-            )
+        bot.send_message(
+            chat_id=chat_id, text=textwrap.dedent("""\
+            Всем привет!
 
-            db_session.commit()
+            Меня зовут *%s*, я запомнил ваш чат!
+            Нужно установить цель для этой дружной команды!
+            """ % bot.first_name), parse_mode=telegram.ParseMode.MARKDOWN
+        )
 
     def __migrate_chat(self, chat_id, new_chat_id):
-        db_session = self.get_db()
+        with self.session_scope() as db_session:
+            try:
+                chat = db_session.query(Chat).filter(Chat.chat_id == str(chat_id)).one()
 
-        try:
-            chat = db_session.query(Chat).filter(Chat.chat_id == str(chat_id)).one()
+                chat.chat_id = new_chat_id
+                self.invalidate_chat(db_session, chat_id, new_chat_id)
+            except NoResultFound:
+                pass
 
-            chat.chat_id = new_chat_id
-        except NoResultFound:
-            pass
-        finally:
-            db_session.commit()
+        self.invalidate_admins(chat_id, new_chat_id)
 
     def chat_created(self, bot, update):
         logging.debug('New chat created %s' % update.effective_chat.id)
@@ -83,6 +81,8 @@ class GroupHandler(BaseHandler):
 
         logging.debug('New members in chat %s' % chat_id)
 
+        self.invalidate_admins(chat_id)
+
         members = list(filter(
             lambda m: not m.is_bot, update.effective_message.new_chat_members))
         i_am = list(filter(
@@ -104,12 +104,17 @@ class GroupHandler(BaseHandler):
                 """.format(self.greetings_text)), parse_mode=telegram.ParseMode.MARKDOWN
             )
 
+    def left_member(self, bot, update):
+        logging.debug('Member left chat %s' % update.effective_chat.id)
+
+        self.invalidate_admins(update.effective_chat.id)
+
 
 class P2PEchoHandler(BaseHandler):
     def __init__(self, *args, **kwargs):
         super(P2PEchoHandler, self).__init__(*args, **kwargs)
 
-        self.dispatcher.add_handler(MessageHandler(Filters.private, self.p2p_warning))
+        self.add_handler(MessageHandler(Filters.private, self.p2p_warning))
 
     def p2p_warning(self, bot, update):
         logging.debug('Someone write me in p2p chat, suck it!')
@@ -0,0 +1,112 @@
+import io
+import logging
+import textwrap
+
+import telegram
+from sqlalchemy.orm.exc import NoResultFound
+from telegram.ext import MessageHandler, Filters
+
+from step_bot.handlers import BaseHandler, CheckTargetMixin
+from step_bot.importers import ImportFileError, ImportReport, parser_for, save_steps
+
+
+class ImportHandler(BaseHandler, CheckTargetMixin):
+    def __init__(self, *args, **kwargs):
+        super(ImportHandler, self).__init__(*args, **kwargs)
+
+        self.add_handler(MessageHandler(Filters.document, self.import_document))
+
+    def download(self, bot, document):
+        stream = io.BytesIO()
+
+        bot.get_file(document.file_id).download(out=stream)
+        stream.seek(0)
+
+        return stream
+
+    def import_document(self, bot, update):
+        chat_id = update.effective_chat.id
+        user_id = update.effective_user.id
+        document = update.effective_message.document
+
+        parser = parser_for(document.file_name)
+        if parser is None:
+            return
+
+        if document.file_size and document.file_size > self.settings.IMPORT_MAX_SIZE:
+            self.send_clean_error(
+                bot, chat_id, "Файл слишком большой, я принимаю выгрузки до {0} КБ!".format(
+                    self.settings.IMPORT_MAX_SIZE // 1024),
+                reply_to_message_id=update.effective_message.message_id
+            )
+            return
+
+        try:
+            # The file is read before the transaction, so no connection is held while it downloads
+            collector = parser(self.download(bot, document), self.get_chat_timezone(chat_id))
+        except ImportFileError as e:
+            self.send_clean_error(
+                bot, chat_id, "Я не смог прочитать файл, нужна выгрузка шагов по дням в CSV или JSON!",
+                reply_to_message_id=update.effective_message.message_id
+            )
+
+            logging.exception(e)
+            return
+
+        imported = collector.result()
+        report = ImportReport(collector.rows, collector.invalid)
+
+        with self.session_scope() as db_session:
+            try:
+                current_chat = self.get_chat(db_session, chat_id)
+
+                if not self.have_target(bot, current_chat):
+                    return
+
+                date_from = self.target_start(current_chat)
+                date_to = self.chat_today(current_chat)
+
+                days = dict()
+                for day, steps in imported.items():
+                    if date_from <= day <= date_to:
+                        days[day] = steps
+                    else:
+                        report.skipped += 1
+
+                if days:
+                    report.date_from, report.date_to = min(days), max(days)
+
+                save_steps(db_session, current_chat.current_target.id, user_id, days, report)
+
+                if report.days:
+                    self.queue_message(
+                        db_session, update, chat_id=chat_id, text=textwrap.dedent("""\
+                        *{0}*, шаги из файла загружены за *{1}* - *{2}*!
+                        Новых дней: *{3}*, обновлено: *{4}*, без изменений: *{5}*
+                        Пропущено дней вне цели: *{6}*, нераспознанных строк: *{7}*
+                        Итого к твоему вкладу: *{8}* шагов!
+                        """.format(
+                            update.effective_user.first_name,
+                            report.date_from.strftime("%d.%m.%Y"), report.date_to.strftime("%d.%m.%Y"),
+                            report.created, report.updated, report.unchanged, report.skipped, report.invalid,
+                            report.delta
+                        )),
+                        reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN
+                    )
+            except NoResultFound as e:
+                self.send_error(bot, chat_id)
+                logging.exception(e)
+                return
+
+        if not report.days:
+            self.send_clean_error(
+                bot, chat_id, "В файле не нашлось шагов за время цели!",
+                reply_to_message_id=update.effective_message.message_id
+            )
+            return
+
+        logging.info(
+            'Imported %d days for %s in %s: %d new, %d updated, %d unchanged, %d skipped, %d invalid rows',
+            report.days, user_id, chat_id, report.created, report.updated, report.unchanged,
+            report.skipped, report.invalid
+        )
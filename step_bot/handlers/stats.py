@@ -1,63 +1,369 @@
+import asyncio
+import io
 import logging
 import textwrap
+from collections import defaultdict
+from datetime import datetime, timedelta
 
 import telegram
-from sqlalchemy import func
+from sqlalchemy import and_, case, func, null
 from sqlalchemy.orm.exc import NoResultFound
+from telegram.utils.helpers import escape_markdown
 
-from step_bot.handlers import CommandBaseHandler, CheckTargetMixin
-from step_bot.models import Chat, Step
+from step_bot import cache, reports
+from step_bot.charts import renderer
+from step_bot.handlers import AsyncCommandBaseHandler, CheckTargetMixin
+from step_bot.models import Step, Target, UserStat
 
 
-class StatHandler(CommandBaseHandler, CheckTargetMixin):
+class StatHandler(AsyncCommandBaseHandler, CheckTargetMixin):
     command = "stat"
 
+    renderer = renderer
+
     def clean_args(self, args):
         return dict()
 
-    def execute(self, bot, update, cleaned_args):
+    def get_progress(self, db_session, target_id, user_id):
+        return db_session.query(
+            Target.current_value, UserStat.steps, func.coalesce(Target.date_edit, Target.date_creation)
+        ) \
+            .outerjoin(UserStat, and_(
+                UserStat.target_id == Target.id,
+                UserStat.user_id == str(user_id)
+            )) \
+            .filter(Target.id == target_id) \
+            .one()
+
+    def get_member_days(self, db_session, target_id, limit):
+        # Members are ranked by their totals kept in user_stats, the rest are summed up per day as one series
+        top = [user_id for user_id, in db_session.query(UserStat.user_id)
+               .filter(UserStat.target_id == target_id)
+               .order_by(UserStat.steps.desc(), UserStat.user_id)
+               .limit(limit)]
+        if not top:
+            return top, []
+
+        member = case([(Step.user_id.in_(top), Step.user_id)], else_=null())
+
+        rows = db_session.query(member.label('user_id'), Step.date, func.sum(Step.steps).label('steps')) \
+            .filter(Step.target_id == target_id) \
+            .group_by(member, Step.date) \
+            .order_by(Step.date) \
+            .all()
+
+        return top, rows
+
+    def chart_key(self, target_id, version, today):
+        # Every step write bumps date_edit of the target, so a new version makes a new chart
+        return '{0}:{1}:{2}'.format(target_id, version.timestamp() if version else 0, today.isoformat())
+
+    async def get_chart_data(self, db_session, bot, chat_id, target, today, tz):
+        top, rows = await db_session.run(self.get_member_days, target.id, self.settings.CHART_TOP_MEMBERS)
+
+        days = defaultdict(list)
+        for user_id, day, steps in rows:
+            days[user_id].append((day, steps))
+
+        names = await asyncio.gather(*[self.run_io(self.get_member_name, bot, chat_id, user_id) for user_id in top])
+
+        series = [(name, days[user_id]) for user_id, name in zip(top, names)]
+
+        if days.get(None):
+            series.append(("Остальные", days[None]))
+
+        date_from = target.date_creation.astimezone(tz).date()
+        if rows:
+            date_from = min(date_from, rows[0].date)
+
+        return dict(
+            name=target.name, initial=target.initial_value, target_value=target.target_value,
+            date_from=date_from, date_to=max(target.target_date.astimezone(tz).date(), today),
+            today=today, series=series
+        )
+
+    async def send_chart(self, db_session, bot, update, chat, version, caption):
         chat_id = update.effective_chat.id
+        target = chat.current_target
+        tz = self.chat_timezone(chat)
+        today = datetime.now(tz=tz).date()
+        key = self.chart_key(target.id, version, today)
 
-        db_session = self.get_db()
+        options = dict(
+            chat_id=chat_id, caption=caption, reply_to_message_id=update.effective_message.message_id,
+            parse_mode=telegram.ParseMode.MARKDOWN
+        )
 
-        try:
-            current_chat = db_session.query(Chat).outerjoin(Chat.current_target) \
-                .filter(Chat.chat_id == str(chat_id)) \
-                .one()
+        file_id = self.renderer.get_file_id(key)
+        if file_id is not None:
+            await self.run_io(bot.send_photo, photo=file_id, **options)
+            return
 
-            if not self.have_target(bot, current_chat):
-                return
+        data = await self.get_chart_data(db_session, bot, chat_id, target, today, tz)
+        image = await asyncio.wrap_future(self.renderer.submit('progress', data))
+
+        message = await self.run_io(bot.send_photo, photo=io.BytesIO(image), **options)
+
+        # Telegram keeps the uploaded file, sending it again by file_id costs no rendering and no upload
+        self.renderer.put_file_id(key, message.photo[-1].file_id)
 
-            user_steps = 0
+    async def execute(self, bot, update, cleaned_args):
+        chat_id = update.effective_chat.id
+
+        async with self.get_async_db() as db_session:
             try:
-                aggregate = db_session.query(func.sum(Step.steps).label('user_steps')) \
-                    .filter(
-                        Step.user_id == str(update.message.from_user.id),
-                        Step.target_id == current_chat.current_target_id
-                    ) \
-                    .group_by(Step.target_id) \
-                    .one()
-                user_steps = aggregate.user_steps
-            except NoResultFound:
-                pass
-
-            name = current_chat.current_target.name
-            target = current_chat.current_target.target_value / 1000
-            now = current_chat.current_target.current_value / 1000
-            end_date = current_chat.current_target.target_date.strftime("%d.%m.%Y")
-            percent = now / target * 100
-
-            bot.send_message(
-                chat_id=chat_id, text=textwrap.dedent("""\
+                current_chat = await db_session.run(self.get_chat, chat_id)
+
+                if not await self.run_io(self.have_target, bot, current_chat):
+                    return
+
+                current_value, user_steps, version = await db_session.run(
+                    self.get_progress, current_chat.current_target_id, update.message.from_user.id
+                )
+
+                name = current_chat.current_target.name
+                target = current_chat.current_target.target_value / 1000
+                now = current_value / 1000
+                end_date = current_chat.current_target.target_date.strftime("%d.%m.%Y")
+                percent = now / target * 100
+
+                text = textwrap.dedent("""\
                 Наша цель *{0}* в *{1} км* к *{2}*
                 На данный момент мы прошли: *{3} км* (*{4:.2f}%* от цели)
                 
                 Твой вклад в эту цель составляет *{5} км*!
-                """.format(name, target, end_date, now, percent, user_steps / 1000)),
-                reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN)
-        except NoResultFound as e:
-            self.send_error(bot, chat_id, reply_to_message_id=update.effective_message.message_id)
-
-            logging.exception(e)
-        finally:
-            db_session.commit()
+                """.format(name, target, end_date, now, percent, (user_steps or 0) / 1000))
+
+                if self.renderer.enabled:
+                    try:
+                        await self.send_chart(db_session, bot, update, current_chat, version, text)
+                        return
+                    except Exception as e:
+                        logging.exception(e)
+
+                await self.run_io(
+                    bot.send_message,
+                    chat_id=chat_id, text=text,
+                    reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN)
+            except NoResultFound as e:
+                await self.run_io(
+                    self.send_error, bot, chat_id, reply_to_message_id=update.effective_message.message_id
+                )
+
+                logging.exception(e)
+
+
+class TopHandler(AsyncCommandBaseHandler, CheckTargetMixin):
+    command = "top"
+
+    top_size = 10
+    week_days = 7
+
+    def clean_args(self, args):
+        return dict()
+
+    def load_leaderboard(self, db_session, target_id, since):
+        total = func.sum(Step.steps)
+        week = func.coalesce(func.sum(Step.steps).filter(Step.date >= since), 0)
+
+        # One pass over the (target_id, user_id, date) index ranks both periods
+        rows = db_session.query(
+            Step.user_id, total.label('total'), week.label('week'),
+            func.rank().over(order_by=total.desc()).label('total_rank'),
+            func.rank().over(order_by=week.desc()).label('week_rank')
+        ) \
+            .filter(Step.target_id == target_id) \
+            .group_by(Step.user_id) \
+            .all()
+
+        return cache.Leaderboard(since=since, rows=[cache.LeaderboardRow(*row) for row in rows])
+
+    def get_leaderboard(self, db_session, chat):
+        target_id = chat.current_target_id
+        since = self.chat_today(chat) - timedelta(days=self.week_days - 1)
+        key = str(target_id)
+
+        leaderboard = cache.leaderboards.get_or_load(key, lambda: self.load_leaderboard(db_session, target_id, since))
+
+        # The weekly window moves at midnight even without new steps
+        if leaderboard.since != since:
+            cache.leaderboards.invalidate(key)
+            leaderboard = cache.leaderboards.get_or_load(
+                key, lambda: self.load_leaderboard(db_session, target_id, since)
+            )
+
+        return leaderboard
+
+    def format_rows(self, rows, names, field):
+        return "\n".join(
+            "{0}. {1} - *{2} км*".format(
+                getattr(row, field + '_rank'), escape_markdown(names[row.user_id]), getattr(row, field) / 1000
+            ) for row in rows
+        ) or "пока никто не указал шаги"
+
+    async def execute(self, bot, update, cleaned_args):
+        chat_id = update.effective_chat.id
+        user_id = str(update.effective_user.id)
+
+        async with self.get_async_db() as db_session:
+            try:
+                current_chat = await db_session.run(self.get_chat, chat_id)
+
+                if not await self.run_io(self.have_target, bot, current_chat):
+                    return
+
+                leaderboard = await db_session.run(self.get_leaderboard, current_chat)
+            except NoResultFound as e:
+                await self.run_io(
+                    self.send_error, bot, chat_id, reply_to_message_id=update.effective_message.message_id
+                )
+
+                logging.exception(e)
+                return
+
+        by_total = sorted(leaderboard.rows, key=lambda row: row.total_rank)[:self.top_size]
+        by_week = sorted((row for row in leaderboard.rows if row.week), key=lambda row: row.week_rank)[:self.top_size]
+
+        user_ids = {row.user_id for row in by_total + by_week}
+        names = dict(zip(user_ids, await asyncio.gather(*[
+            self.run_io(self.get_member_name, bot, chat_id, member_id) for member_id in user_ids
+        ])))
+
+        own = next((row for row in leaderboard.rows if row.user_id == user_id), None)
+        own_text = "Твое место: *{0}* за все время и *{1}* за неделю".format(own.total_rank, own.week_rank) \
+            if own else "Ты еще не указал(а) шаги для этой цели"
+
+        await self.run_io(
+            bot.send_message,
+            chat_id=chat_id, text=textwrap.dedent("""\
+            Лучшие участники цели *{0}*
+
+            За все время:
+            {1}
+
+            За последние {2} дней:
+            {3}
+
+            {4}
+            """).format(
+                escape_markdown(current_chat.current_target.name), self.format_rows(by_total, names, 'total'),
+                self.week_days, self.format_rows(by_week, names, 'week'), own_text
+            ),
+            reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN)
+
+
+class HistoryHandler(AsyncCommandBaseHandler, CheckTargetMixin):
+    command = "history"
+
+    weeks = 8
+    months = 6
+    members = 10
+    pace_days = 7
+
+    def clean_args(self, args):
+        return dict()
+
+    def load_report(self, db_session, target_id, date_from, today):
+        daily = reports.load_daily(db_session, target_id)
+        if daily:
+            date_from = min(date_from, daily[0].date)
+
+        weeks, months = reports.load_periods(db_session, target_id)
+        members = reports.load_consistency(db_session, target_id, (today - date_from).days + 1)
+
+        current_value = db_session.query(Target.current_value).filter(Target.id == target_id).scalar()
+
+        return dict(
+            daily=reports.daily_series(daily, date_from, today), weeks=weeks, months=months, members=members,
+            current_value=current_value or 0, days=(today - date_from).days + 1
+        )
+
+    def format_periods(self, periods, date_format):
+        return "\n".join(
+            "{0} - *{1} км*".format(period.start.strftime(date_format), period.steps / 1000) for period in periods
+        ) or "пока нет шагов"
+
+    def format_forecast(self, forecast, target, current_value):
+        if current_value >= target.target_value:
+            return "Цель уже достигнута!"
+
+        lines = ["Средний темп за {0} дней: *{1:.2f} км* в день".format(self.pace_days, forecast.pace / 1000)]
+
+        if forecast.required is not None and forecast.required > 0:
+            lines.append("Нужный темп: *{0:.2f} км* в день".format(forecast.required / 1000))
+
+        if forecast.on_track:
+            lines.append("Цель будет достигнута в срок{0}".format(
+                " (примерно {0})".format(forecast.reach_date.strftime("%d.%m.%Y")) if forecast.reach_date else ""
+            ))
+        else:
+            lines.append("При текущем темпе к {0} будет *{1:.2f} км* (*{2:.2f}%* от цели)".format(
+                target.target_date.strftime("%d.%m.%Y"), forecast.projected / 1000,
+                forecast.projected / target.target_value * 100
+            ))
+
+        return "\n".join(lines)
+
+    async def execute(self, bot, update, cleaned_args):
+        chat_id = update.effective_chat.id
+
+        async with self.get_async_db() as db_session:
+            try:
+                current_chat = await db_session.run(self.get_chat, chat_id)
+
+                if not await self.run_io(self.have_target, bot, current_chat):
+                    return
+
+                target = current_chat.current_target
+                tz = self.chat_timezone(current_chat)
+                today = datetime.now(tz=tz).date()
+                date_from = target.date_creation.astimezone(tz).date()
+
+                report = await db_session.run(self.load_report, target.id, min(date_from, today), today)
+            except NoResultFound as e:
+                await self.run_io(
+                    self.send_error, bot, chat_id, reply_to_message_id=update.effective_message.message_id
+                )
+
+                logging.exception(e)
+                return
+
+        forecast = reports.forecast(
+            report['daily'], report['current_value'], target.target_value, today,
+            target.target_date.astimezone(tz).date(), window=self.pace_days
+        )
+
+        members = report['members'][:self.members]
+        names = await asyncio.gather(*[
+            self.run_io(self.get_member_name, bot, chat_id, member.user_id) for member in members
+        ])
+
+        consistency = "\n".join(
+            "{0}. {1} - {2} из {3} дней (*{4:.0f}%*), *{5:.2f} км* в активный день".format(
+                index, escape_markdown(name), member.active_days, report['days'], member.share * 100,
+                member.total / member.active_days / 1000 if member.active_days else 0
+            ) for index, (member, name) in enumerate(zip(members, names), 1)
+        ) or "пока никто не указал шаги"
+
+        await self.run_io(
+            bot.send_message,
+            chat_id=chat_id, text=textwrap.dedent("""\
+            История цели *{0}*
+
+            По неделям:
+            {1}
+
+            По месяцам:
+            {2}
+
+            Постоянство участников:
+            {3}
+
+            Прогноз:
+            {4}
+            """).format(
+                escape_markdown(target.name), self.format_periods(report['weeks'][-self.weeks:], "%d.%m.%Y"),
+                self.format_periods(report['months'][-self.months:], "%m.%Y"), consistency,
+                self.format_forecast(forecast, target, report['current_value'])
+            ),
+            reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN)
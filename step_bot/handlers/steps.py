@@ -1,26 +1,28 @@
 import logging
 import textwrap
-import uuid
 from datetime import datetime
 
 import telegram
-from sqlalchemy import func
 from sqlalchemy.orm.exc import NoResultFound
 from telegram import ForceReply
 from telegram.ext import CommandHandler, MessageHandler, ConversationHandler, Filters
 
-from step_bot.handlers import CheckTargetMixin, ConversationBaseHandler
-from step_bot.models import Chat, Step
+from step_bot.handlers import CheckTargetMixin, CommandBaseHandler, ConversationBaseHandler
+from step_bot.importers import ImportReport, save_steps
+from step_bot.models import MAX_DAY_STEPS
+from step_bot.models.aggregates import apply_steps_delta, upsert_step
 
 
 class StepCalculateMixin:
-    def recalculate_steps(self, db_session, chat):
-        sum = db_session.query(func.sum(Step.steps).label('total_steps')) \
-            .filter(Step.target == chat.current_target) \
-            .group_by(Step.target_id) \
-            .one()
+    def apply_steps(self, db_session, target, user_id, day, delta):
+        apply_steps_delta(db_session, target.id, user_id, day, delta)
 
-        chat.current_target.current_value = chat.current_target.initial_value + sum.total_steps
+    def store_steps(self, db_session, target, user_id, day, steps):
+        prev_value = upsert_step(db_session, target.id, user_id, day, steps)
+
+        self.apply_steps(db_session, target, user_id, day, steps - (prev_value or 0))
+
+        return prev_value
 
 
 class TodayHandler(ConversationBaseHandler, CheckTargetMixin, StepCalculateMixin):
@@ -38,13 +40,13 @@ class TodayHandler(ConversationBaseHandler, CheckTargetMixin, StepCalculateMixin
 
     def clean_steps(self, text):
         value = int(text)
-        if value < 0:
-            raise ValueError("Steps must greater than 0")
+        if value < 0 or value > MAX_DAY_STEPS:
+            raise ValueError("Steps must be between 0 and {0}".format(MAX_DAY_STEPS))
 
         return value
 
     def start(self, bot, update):
-        today = datetime.now(tz=self.settings.BOT_TZ).date()
+        today = datetime.now(tz=self.get_chat_timezone(update.effective_chat.id)).date()
 
         bot.send_message(
             chat_id=update.effective_chat.id, text=textwrap.dedent("""\
@@ -60,76 +62,52 @@ class TodayHandler(ConversationBaseHandler, CheckTargetMixin, StepCalculateMixin
         chat_id = update.effective_chat.id
         user_id = update.effective_user.id
 
-        db_session = self.get_db()
-
-        try:
-            steps = self.clean_steps(update.effective_message.text)
-            today = datetime.now(tz=self.settings.BOT_TZ).date()
-
-            current_chat = db_session.query(Chat).outerjoin(Chat.current_target) \
-                .filter(Chat.chat_id == str(chat_id)) \
-                .one()
-
-            if not self.have_target(bot, current_chat):
-                return
-
+        with self.session_scope() as db_session:
             try:
-                step_info = db_session.query(Step) \
-                    .filter(
-                        Step.target == current_chat.current_target,
-                        Step.user_id == str(user_id),
-                        Step.date == today) \
-                    .one()
-
-                prev_value = step_info.steps
-
-                step_info.steps = steps
-
-                bot.send_message(
-                    chat_id=chat_id, text=textwrap.dedent("""\
-                    *{0}*, твои шаги за сегодня обновлены! Сегодня (*{1}*) ты прошел(а) *{2}* шагов, вместо _{3}_ шагов!
-                    """.format(update.effective_user.first_name, today.strftime("%d.%m.%Y"), steps, prev_value)),
-                    reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN
-                )
-            except NoResultFound:
-                step_info = Step(
-                    id=uuid.uuid4(), user_id=user_id,
-                    target=current_chat.current_target,
-                    date=today, steps=steps
+                steps = self.clean_steps(update.effective_message.text)
+
+                current_chat = self.get_chat(db_session, chat_id)
+
+                if not self.have_target(bot, current_chat):
+                    return
+
+                today = self.chat_today(current_chat)
+
+                prev_value = self.store_steps(db_session, current_chat.current_target, user_id, today, steps)
+
+                if prev_value is not None:
+                    self.queue_message(
+                        db_session, update, chat_id=chat_id, text=(
+                            "*{0}*, твои шаги за сегодня обновлены! Сегодня (*{1}*) ты прошел(а) *{2}* шагов, "
+                            "вместо _{3}_ шагов!\n"
+                        ).format(update.effective_user.first_name, today.strftime("%d.%m.%Y"), steps, prev_value),
+                        reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN
+                    )
+                else:
+                    self.queue_message(
+                        db_session, update, chat_id=chat_id, text=textwrap.dedent("""\
+                        *{0}*! *{1}* ты прошел(а) *{2}* шагов! Молодец!
+                        """.format(update.effective_user.first_name, today.strftime("%d.%m.%Y"), steps)),
+                        reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN
+                    )
+
+                return ConversationHandler.END
+            except NoResultFound as e:
+                self.send_error(bot, chat_id)
+                logging.exception(e)
+            except ValueError as e:
+                self.send_clean_error(
+                    bot, chat_id, "Указано не верное количество шагов, напиши количество шагов в виде числа!",
+                    reply_to_message_id=update.effective_message.message_id, reply_markup=ForceReply(selective=True)
                 )
 
-                db_session.add(step_info)
-
-                bot.send_message(
-                    chat_id=chat_id, text=textwrap.dedent("""\
-                    *{0}*! *{1}* ты прошел(а) *{2}* шагов! Молодец!
-                    """.format(update.effective_user.first_name, today.strftime("%d.%m.%Y"), steps)),
-                    reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN
-                )
-
-            self.recalculate_steps(db_session, current_chat)
-
-            return ConversationHandler.END
-        except NoResultFound as e:
-            self.send_error(bot, chat_id)
-            logging.exception(e)
-        except ValueError as e:
-            self.send_clean_error(
-                bot, chat_id, "Указано не верное количество шагов, напиши количество шагов в виде числа!",
-                reply_to_message_id=update.effective_message.message_id, reply_markup=ForceReply(selective=True)
-            )
-
-            logging.exception(e)
-        finally:
-            db_session.commit()
+                logging.exception(e)
 
 
 class DayHandler(ConversationBaseHandler, CheckTargetMixin, StepCalculateMixin):
     INPUT_DATE = 'input_date'
     INPUT_STEPS = 'input_steps'
 
-    conversation_data = dict()
-
     def __init__(self, *args, **kwargs):
         self.entry_points = [
             CommandHandler('day', self.start)
@@ -148,11 +126,18 @@ class DayHandler(ConversationBaseHandler, CheckTargetMixin, StepCalculateMixin):
 
     def clean_steps(self, text):
         value = int(text)
-        if value < 0:
-            raise ValueError("Steps must greater than 0")
+        if value < 0 or value > MAX_DAY_STEPS:
+            raise ValueError("Steps must be between 0 and {0}".format(MAX_DAY_STEPS))
 
         return value
 
+    def get_day(self):
+        data = self.get_conversation_data()
+        if not data or 'day' not in data:
+            raise NoResultFound("Conversation data expired")
+
+        return datetime.strptime(data['day'], "%Y-%m-%d").date()
+
     def start(self, bot, update):
         bot.send_message(
             chat_id=update.effective_chat.id, text=textwrap.dedent("""\
@@ -167,129 +152,172 @@ class DayHandler(ConversationBaseHandler, CheckTargetMixin, StepCalculateMixin):
     def input_date(self, bot, update):
         chat_id = update.effective_chat.id
 
-        db_session = self.get_db()
-
-        try:
-            day = self.clean_date(update.effective_message.text)
-            today = datetime.now(tz=self.settings.BOT_TZ).date()
-
-            current_chat = db_session.query(Chat).outerjoin(Chat.current_target) \
-                .filter(Chat.chat_id == str(chat_id)) \
-                .one()
-
-            if not self.have_target(bot, current_chat):
-                return
+        with self.session_scope() as db_session:
+            try:
+                day = self.clean_date(update.effective_message.text)
+
+                current_chat = self.get_chat(db_session, chat_id)
+
+                if not self.have_target(bot, current_chat):
+                    return
+
+                today = self.chat_today(current_chat)
+                date_from = self.target_start(current_chat)
+
+                if day < date_from:
+                    bot.send_message(
+                        chat_id=update.message.chat_id, text=textwrap.dedent("""\
+                        *{0}*, дата для шагов не может быть раньше чем дата начала (*{1}*) у цели!
+                        """.format(
+                            update.message.from_user.first_name, date_from.strftime("%d.%m.%Y"))
+                        ), reply_to_message_id=update.effective_message.message_id,
+                        reply_markup=ForceReply(selective=True), parse_mode=telegram.ParseMode.MARKDOWN
+                    )
+                    return
+                if day > today:
+                    bot.send_message(
+                        chat_id=update.message.chat_id, text=textwrap.dedent("""\
+                        *{0}*, дата для шагов не может быть больше чем сегодня! Читер!
+                        """.format(update.message.from_user.first_name)
+                        ), reply_to_message_id=update.effective_message.message_id,
+                        reply_markup=ForceReply(selective=True), parse_mode=telegram.ParseMode.MARKDOWN
+                    )
+                    return
+
+                self.set_conversation_data(dict(day=day.isoformat()))
 
-            if day < current_chat.current_target.date_creation.date():
                 bot.send_message(
-                    chat_id=update.message.chat_id, text=textwrap.dedent("""\
-                    *{0}*, дата для шагов не может быть раньше чем дата начала (*{1}*) у цели!
-                    """.format(
-                        update.message.from_user.first_name,
-                        current_chat.current_target.date_creation.strftime("%d.%m.%Y"))
-                    ), reply_to_message_id=update.effective_message.message_id, reply_markup=ForceReply(selective=True),
+                    chat_id=update.effective_chat.id, text=textwrap.dedent("""\
+                    *{0}*, понял! А сколько шагов пройдено за *{1}*?
+                    """.format(update.effective_user.first_name, day.strftime("%d.%m.%Y"))),
+                    reply_to_message_id=update.effective_message.message_id, reply_markup=ForceReply(selective=True),
                     parse_mode=telegram.ParseMode.MARKDOWN
                 )
-                return
-            if day > today:
-                bot.send_message(
-                    chat_id=update.message.chat_id, text=textwrap.dedent("""\
-                    *{0}*, дата для шагов не может быть больше чем сегодня! Читер!
-                    """.format(update.message.from_user.first_name)
-                    ), reply_to_message_id=update.effective_message.message_id, reply_markup=ForceReply(selective=True),
-                    parse_mode=telegram.ParseMode.MARKDOWN
+
+                return DayHandler.INPUT_STEPS
+            except ValueError as e:
+                self.send_clean_error(
+                    bot, chat_id, "Я не понимаю что ты указал(а), мне понятны даты в виде ДД.ММ.ГГГГ!",
+                    reply_to_message_id=update.effective_message.message_id, reply_markup=ForceReply(selective=True)
                 )
-                return
-
-            self.conversation_data[self.handler.current_conversation] = day
-
-            bot.send_message(
-                chat_id=update.effective_chat.id, text=textwrap.dedent("""\
-                *{0}*, понял! А сколько шагов пройдено за *{1}*?
-                """.format(update.effective_user.first_name, day.strftime("%d.%m.%Y"))),
-                reply_to_message_id=update.effective_message.message_id, reply_markup=ForceReply(selective=True),
-                parse_mode=telegram.ParseMode.MARKDOWN
-            )
-
-            return DayHandler.INPUT_STEPS
-        except ValueError as e:
-            self.send_clean_error(
-                bot, chat_id, "Я не понимаю что ты указал(а), мне понятны даты в виде ДД.ММ.ГГГГ!",
-                reply_to_message_id=update.effective_message.message_id, reply_markup=ForceReply(selective=True)
-            )
-
-            logging.exception(e)
-        except NoResultFound as e:
-            self.send_error(bot, update.message.chat_id)
-            logging.exception(e)
+
+                logging.exception(e)
+            except NoResultFound as e:
+                self.send_error(bot, update.message.chat_id)
+                logging.exception(e)
 
     def input_steps(self, bot, update):
         chat_id = update.effective_chat.id
         user_id = update.effective_user.id
 
-        db_session = self.get_db()
+        with self.session_scope() as db_session:
+            try:
+                steps = self.clean_steps(update.effective_message.text)
+                day = self.get_day()
+
+                current_chat = self.get_chat(db_session, chat_id)
+
+                if not self.have_target(bot, current_chat):
+                    return
+
+                prev_value = self.store_steps(db_session, current_chat.current_target, user_id, day, steps)
+
+                if prev_value is not None:
+                    self.queue_message(
+                        db_session, update, chat_id=update.message.chat_id, text=textwrap.dedent("""\
+                        *{0}*, твои шаги обновлены! *{1}* ты прошел(а) *{2}* шагов, вместо _{3}_ шагов!
+                        """.format(
+                            update.message.from_user.first_name, day.strftime("%d.%m.%Y"), steps, prev_value
+                        )),
+                        reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN
+                    )
+                else:
+                    self.queue_message(
+                        db_session, update, chat_id=update.message.chat_id, text=textwrap.dedent("""\
+                        *{0}*! *{1}* ты прошел(а) *{2}* шагов! Молодец!
+                        """.format(update.message.from_user.first_name, day.strftime("%d.%m.%Y"), steps)),
+                        reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN
+                    )
+
+                return ConversationHandler.END
+            except NoResultFound as e:
+                self.send_error(bot, update.message.chat_id)
+                logging.exception(e)
+            except ValueError as e:
+                self.send_clean_error(
+                    bot, chat_id, "Указано не верное количество шагов, напиши количество шагов в виде числа!",
+                    reply_to_message_id=update.effective_message.message_id, reply_markup=ForceReply(selective=True)
+                )
 
-        try:
-            steps = self.clean_steps(update.effective_message.text)
-            day = self.conversation_data[self.handler.current_conversation]
+                logging.exception(e)
 
-            current_chat = db_session.query(Chat).outerjoin(Chat.current_target) \
-                .filter(Chat.chat_id == str(chat_id)) \
-                .one()
 
-            if not self.have_target(bot, current_chat):
-                return
+class DaysHandler(CommandBaseHandler, CheckTargetMixin):
+    command = "days"
+    clean_error_message = "Неправильно указаны шаги! Каждый день укажи с новой строки в виде ДД.ММ.ГГГГ и числа шагов"
+    usage_params = "<ДД.ММ.ГГГГ> <Количество шагов> ..."
 
-            try:
-                step_info = db_session.query(Step) \
-                    .filter(
-                        Step.target == current_chat.current_target,
-                        Step.user_id == str(user_id),
-                        Step.date == day) \
-                    .one()
+    max_days = 62
 
-                prev_value = step_info.steps
+    def clean_args(self, args):
+        if not args or len(args) % 2 or len(args) // 2 > self.max_days:
+            raise ValueError("Number of arguments incorrect")
 
-                step_info.steps = steps
+        days = dict()
+        for index in range(0, len(args), 2):
+            day = datetime.strptime(args[index], "%d.%m.%Y").date()
+            steps = int(args[index + 1])
+            if steps < 0 or steps > MAX_DAY_STEPS:
+                raise ValueError("Steps must be between 0 and {0}".format(MAX_DAY_STEPS))
 
-                bot.send_message(
-                    chat_id=update.message.chat_id, text=textwrap.dedent("""\
-                    *{0}*, твои шаги обновлены! *{1}* ты прошел(а) *{2}* шагов, вместо _{3}_ шагов!
-                    """.format(
-                        update.message.from_user.first_name, day.strftime("%d.%m.%Y"), steps, prev_value
-                    )),
-                    reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN
-                )
-            except NoResultFound:
-                step_info = Step(
-                    id=uuid.uuid4(), user_id=user_id,
-                    target=current_chat.current_target,
-                    date=day, steps=steps
-                )
-
-                db_session.add(step_info)
+            # The last line wins when a day is repeated, as if it was entered again with /day
+            days[day] = steps
 
-                bot.send_message(
-                    chat_id=update.message.chat_id, text=textwrap.dedent("""\
-                    *{0}*! *{1}* ты прошел(а) *{2}* шагов! Молодец!
-                    """.format(update.message.from_user.first_name, day.strftime("%d.%m.%Y"), steps)),
-                    reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN
-                )
+        return dict(days=days)
 
-            self.recalculate_steps(db_session, current_chat)
+    def execute(self, bot, update, cleaned_args):
+        chat_id = update.effective_chat.id
+        user_id = update.effective_user.id
+        days = cleaned_args.get("days")
 
-            del self.conversation_data[self.handler.current_conversation]
+        with self.session_scope() as db_session:
+            try:
+                current_chat = self.get_chat(db_session, chat_id)
+
+                if not self.have_target(bot, current_chat):
+                    return
+
+                date_from = self.target_start(current_chat)
+                date_to = self.chat_today(current_chat)
+
+                invalid = sorted(day for day in days if day < date_from or day > date_to)
+                if invalid:
+                    bot.send_message(
+                        chat_id=chat_id, text=textwrap.dedent("""\
+                        *{0}*, шаги можно указать только с *{1}* по *{2}*, а эти даты не подходят: {3}
+                        Ничего не сохранено, исправь даты и отправь еще раз!
+                        """.format(
+                            update.effective_user.first_name, date_from.strftime("%d.%m.%Y"),
+                            date_to.strftime("%d.%m.%Y"), ", ".join(day.strftime("%d.%m.%Y") for day in invalid))
+                        ), reply_to_message_id=update.effective_message.message_id,
+                        parse_mode=telegram.ParseMode.MARKDOWN
+                    )
+                    return
+
+                report = save_steps(
+                    db_session, current_chat.current_target.id, user_id, days, ImportReport(len(days), 0)
+                )
 
-            return ConversationHandler.END
-        except NoResultFound as e:
-            self.send_error(bot, update.message.chat_id)
-            logging.exception(e)
-        except ValueError as e:
-            self.send_clean_error(
-                bot, chat_id, "Указано не верное количество шагов, напиши количество шагов в виде числа!",
-                reply_to_message_id=update.effective_message.message_id, reply_markup=ForceReply(selective=True)
-            )
+                self.queue_message(
+                    db_session, update, chat_id=chat_id, text=textwrap.dedent("""\
+                    *{0}*, шаги за *{1}* дней сохранены! Новых дней: *{2}*, обновлено: *{3}*
+                    Итого к твоему вкладу: *{4}* шагов! Молодец!
+                    """.format(
+                        update.effective_user.first_name, report.days, report.created, report.updated, report.delta
+                    )), reply_to_message_id=update.effective_message.message_id,
+                    parse_mode=telegram.ParseMode.MARKDOWN
+                )
+            except NoResultFound as e:
+                self.send_error(bot, chat_id, reply_to_message_id=update.effective_message.message_id)
 
-            logging.exception(e)
-        finally:
-            db_session.commit()
+                logging.exception(e)
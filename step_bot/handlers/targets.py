@@ -6,6 +6,7 @@ from datetime import datetime
 import telegram
 from sqlalchemy.orm.exc import NoResultFound
 
+from step_bot import cache
 from step_bot.handlers import CommandBaseHandler, CheckTargetMixin, restricted
 from step_bot.models import Chat, Target
 
@@ -18,9 +19,7 @@ class NewTargetHandler(CommandBaseHandler):
     def clean_args(self, args):
         if len(args) != 2:
             raise ValueError("Number of arguments incorrect")
-        end_date = datetime.strptime(args[1], "%d.%m.%Y").replace(tzinfo=self.settings.BOT_TZ).date()
-        if end_date < datetime.now(tz=self.settings.BOT_TZ).date():
-            raise ValueError("End date must greater than now!")
+        end_date = datetime.strptime(args[1], "%d.%m.%Y").date()
 
         return dict(value=int(args[0]), end=end_date)
 
@@ -28,38 +27,42 @@ class NewTargetHandler(CommandBaseHandler):
     def execute(self, bot, update, cleaned_args):
         chat_id = update.effective_chat.id
 
-        db_session = self.get_db()
+        with self.session_scope() as db_session:
+            try:
+                value = cleaned_args.get("value")
+                end_date = cleaned_args.get("end")
 
-        try:
-            value = cleaned_args.get("value")
-            end_date = cleaned_args.get("end")
+                current_chat = db_session.query(Chat).filter(Chat.chat_id == str(chat_id)).one()
 
-            current_chat = db_session.query(Chat).filter(Chat.chat_id == str(chat_id)).one()
-            new_target = Target(
-                id=uuid.uuid4(), chat=current_chat, name="Новая цель", target_date=end_date, target_value=value * 1000
-            )
+                # The end date is a day of the chat, so it is compared with the today of its time zone
+                if end_date < self.chat_today(current_chat):
+                    raise ValueError("End date must greater than now!")
 
-            current_chat.current_target_id = new_target.id
-            current_chat.current_target = new_target
+                new_target = Target(
+                    id=uuid.uuid4(), chat=current_chat, name="Новая цель", target_date=end_date,
+                    target_value=value * 1000
+                )
 
-            db_session.add(new_target)
+                current_chat.current_target_id = new_target.id
+                current_chat.current_target = new_target
 
-            bot.send_message(
-                chat_id=update.message.chat_id, text=textwrap.dedent("""\
-                Для этого чата установлена новая цель!
+                db_session.add(new_target)
+                self.invalidate_chat(db_session, chat_id)
+
+                self.queue_message(
+                    db_session, update, chat_id=update.message.chat_id, text=textwrap.dedent("""\
+                    Для этого чата установлена новая цель!
                
-                *{0}* в *{1} км* к *{2}*
-                """.format(
-                    new_target.name,
-                    new_target.target_value / 1000,
-                    new_target.target_date.strftime("%d.%m.%Y")
-                )), reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN)
-        except NoResultFound as e:
-            self.send_error(bot, chat_id, reply_to_message_id=update.effective_message.message_id)
+                    *{0}* в *{1} км* к *{2}*
+                    """.format(
+                        new_target.name,
+                        new_target.target_value / 1000,
+                        new_target.target_date.strftime("%d.%m.%Y")
+                    )), reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN)
+            except NoResultFound as e:
+                self.send_error(bot, chat_id, reply_to_message_id=update.effective_message.message_id)
 
-            logging.exception(e)
-        finally:
-            db_session.commit()
+                logging.exception(e)
 
 
 class UpdateTargetHandler(CommandBaseHandler, CheckTargetMixin):
@@ -90,54 +93,60 @@ class UpdateTargetHandler(CommandBaseHandler, CheckTargetMixin):
     def execute(self, bot, update, cleaned_args):
         chat_id = update.effective_chat.id
 
-        db_session = self.get_db()
-
-        try:
-            action = cleaned_args.get("action")
-            new_value = cleaned_args.get("value")
-
-            current_chat = db_session.query(Chat).outerjoin(Chat.current_target)\
-                .filter(Chat.chat_id == str(chat_id))\
-                .one()
-
-            if not self.have_target(bot, current_chat):
-                return
-
-            if action == "value":
-                current_chat.current_target.target_value = new_value * 1000
-
-                bot.send_message(
-                    chat_id=chat_id, text=textwrap.dedent("""\
-                    Наша цель изменилась! Теперь нам необходимо пройти *{0} км*
-                    """.format(new_value)),
-                    reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN)
-            elif action == "initial":
-                current_chat.current_target.initial_value = new_value
-
-                bot.send_message(
-                    chat_id=chat_id, text=textwrap.dedent("""\
-                    Наша цель изменилась! Начальное значение шагов стало равняться *{0}*
-                    """.format(new_value)),
-                    reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN)
-            elif action == "date":
-                current_chat.current_target.target_date = new_value
-
-                bot.send_message(
-                    chat_id=chat_id, text=textwrap.dedent("""\
-                    Теперь наша цель заканчивается *{0}*
-                    """.format(new_value.strftime("%d.%m.%Y"))),
-                    reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN)
-            elif action == "name":
-                current_chat.current_target.name = new_value
-
-                bot.send_message(
-                    chat_id=chat_id, text=textwrap.dedent("""\
-                    Теперь наша цель называется *{0}*
-                    """.format(new_value)),
-                    reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN)
-        except NoResultFound as e:
-            self.send_error(bot, chat_id, reply_to_message_id=update.effective_message.message_id)
-
-            logging.exception(e)
-        finally:
-            db_session.commit()
+        with self.session_scope() as db_session:
+            try:
+                action = cleaned_args.get("action")
+                new_value = cleaned_args.get("value")
+
+                # Read from the database rather than the cache, the target written is the current one
+                current_chat, current_target = db_session.query(Chat, Target) \
+                    .outerjoin(Target, Target.id == Chat.current_target_id) \
+                    .filter(Chat.chat_id == str(chat_id)) \
+                    .one()
+
+                if not self.have_target(bot, cache.snapshot_chat(current_chat, current_target)):
+                    return
+
+                self.invalidate_chat(db_session, chat_id)
+
+                if action == "value":
+                    current_target.target_value = new_value * 1000
+
+                    self.queue_message(
+                        db_session, update, chat_id=chat_id, text=textwrap.dedent("""\
+                        Наша цель изменилась! Теперь нам необходимо пройти *{0} км*
+                        """.format(new_value)),
+                        reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN)
+                elif action == "initial":
+                    db_session.query(Target) \
+                        .filter(Target.id == current_target.id) \
+                        .update({
+                            Target.current_value: Target.current_value - Target.initial_value + new_value,
+                            Target.initial_value: new_value
+                        }, synchronize_session=False)
+
+                    self.queue_message(
+                        db_session, update, chat_id=chat_id, text=textwrap.dedent("""\
+                        Наша цель изменилась! Начальное значение шагов стало равняться *{0}*
+                        """.format(new_value)),
+                        reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN)
+                elif action == "date":
+                    current_target.target_date = new_value
+
+                    self.queue_message(
+                        db_session, update, chat_id=chat_id, text=textwrap.dedent("""\
+                        Теперь наша цель заканчивается *{0}*
+                        """.format(new_value.strftime("%d.%m.%Y"))),
+                        reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN)
+                elif action == "name":
+                    current_target.name = new_value
+
+                    self.queue_message(
+                        db_session, update, chat_id=chat_id, text=textwrap.dedent("""\
+                        Теперь наша цель называется *{0}*
+                        """.format(new_value)),
+                        reply_to_message_id=update.effective_message.message_id, parse_mode=telegram.ParseMode.MARKDOWN)
+            except NoResultFound as e:
+                self.send_error(bot, chat_id, reply_to_message_id=update.effective_message.message_id)
+
+                logging.exception(e)
@@ -0,0 +1,250 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+import pytz
+
+from step_bot.models import MAX_DAY_STEPS
+from step_bot.models.aggregates import apply_steps_deltas, upsert_member_steps
+
+DATE_COLUMNS = ('date', 'day_time', 'day', 'start_time', 'starttime', 'starttimemillis')
+STEP_COLUMNS = ('steps', 'step count', 'step_count', 'count', 'value', 'intval')
+
+# Columns which hold the start of a short interval rather than a whole day, such rows are summed up
+INTERVAL_COLUMNS = ('start_time', 'starttime')
+# Samsung Health stores daily records as the UTC midnight of the day
+UTC_COLUMNS = ('day_time',)
+
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y', '%m/%d/%Y', '%Y/%m/%d')
+
+
+class ImportFileError(ValueError):
+    pass
+
+
+def normalize_column(name):
+    # Samsung Health prefixes every column with the data type, e.g. com.samsung.health.step_count.count
+    return name.strip().lower().rsplit('.', 1)[-1]
+
+
+def find_column(columns, candidates):
+    for candidate in candidates:
+        if candidate in columns:
+            return columns.index(candidate)
+
+    return None
+
+
+def parse_day(value, tz):
+    value = str(value).strip()
+
+    if value.isdigit():
+        # Epoch milliseconds
+        return datetime.fromtimestamp(int(value) / 1000, tz=tz).date()
+
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value[:10], date_format).date()
+        except ValueError:
+            continue
+
+    raise ValueError("Unknown date format: {0}".format(value))
+
+
+def parse_steps(value):
+    try:
+        steps = int(float(str(value).strip() or 0))
+    except OverflowError:
+        raise ValueError("Steps out of range: {0}".format(value))
+
+    if steps < 0 or steps > MAX_DAY_STEPS:
+        raise ValueError("Steps must be between 0 and {0}".format(MAX_DAY_STEPS))
+
+    return steps
+
+
+class DayCollector:
+    def __init__(self):
+        self.days = dict()
+        self.intervals = dict()
+
+        self.rows = 0
+        self.invalid = 0
+
+    def add(self, day, steps, interval=False):
+        self.rows += 1
+
+        if interval:
+            self.intervals[day] = self.intervals.get(day, 0) + steps
+        else:
+            # Daily exports repeat a day for every source device, the largest one already includes the others
+            self.days[day] = max(self.days.get(day, 0), steps)
+
+    def skip(self):
+        self.rows += 1
+        self.invalid += 1
+
+    def result(self):
+        result = dict(self.intervals)
+
+        for day, steps in self.days.items():
+            result[day] = max(result.get(day, 0), steps)
+
+        # Every interval is in range, their sum may still be out of it
+        for day in [day for day, steps in result.items() if steps > MAX_DAY_STEPS]:
+            del result[day]
+            self.invalid += 1
+
+        return result
+
+
+def parse_csv(stream, tz):
+    collector = DayCollector()
+
+    date_column = steps_column = None
+    interval = False
+    day_tz = tz
+
+    try:
+        for row in csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')):
+            if date_column is None:
+                # Some exports start with a line of metadata before the header
+                columns = [normalize_column(column) for column in row]
+
+                date_column = find_column(columns, DATE_COLUMNS)
+                steps_column = find_column(columns, STEP_COLUMNS)
+
+                if date_column is None or steps_column is None:
+                    date_column = None
+                else:
+                    interval = columns[date_column] in INTERVAL_COLUMNS
+                    day_tz = pytz.utc if columns[date_column] in UTC_COLUMNS else tz
+
+                continue
+
+            try:
+                collector.add(parse_day(row[date_column], day_tz), parse_steps(row[steps_column]), interval)
+            except (IndexError, ValueError):
+                collector.skip()
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise ImportFileError("Invalid CSV: {0}".format(e))
+
+    if date_column is None:
+        raise ImportFileError("No date and steps columns found")
+
+    return collector
+
+
+def iter_records(data):
+    if isinstance(data, list):
+        for item in data:
+            yield from iter_records(item)
+    elif isinstance(data, dict):
+        # Google Fit aggregate responses keep the values of a bucket in nested datasets
+        if 'bucket' in data:
+            yield from iter_records(data['bucket'])
+        elif 'dataset' in data:
+            steps = sum(
+                value.get('intVal', 0)
+                for dataset in data['dataset'] for point in dataset.get('point', []) for value in point.get('value', [])
+            )
+
+            yield dict(data, steps=steps)
+        elif any(isinstance(value, list) for value in data.values()) and len(data) <= 2:
+            for value in data.values():
+                if isinstance(value, list):
+                    yield from iter_records(value)
+        else:
+            yield data
+
+
+def parse_json(stream, tz):
+    collector = DayCollector()
+
+    try:
+        data = json.load(io.TextIOWrapper(stream, encoding='utf-8-sig'))
+    except ValueError as e:
+        raise ImportFileError("Invalid JSON: {0}".format(e))
+
+    for record in iter_records(data):
+        record = {normalize_column(key): value for key, value in record.items()}
+        columns = list(record.keys())
+
+        date_column = find_column(columns, DATE_COLUMNS)
+        steps_column = find_column(columns, STEP_COLUMNS)
+
+        if date_column is None or steps_column is None:
+            collector.skip()
+            continue
+
+        date_key, steps_key = columns[date_column], columns[steps_column]
+        interval = date_key in INTERVAL_COLUMNS
+        day_tz = pytz.utc if date_key in UTC_COLUMNS else tz
+
+        try:
+            collector.add(parse_day(record[date_key], day_tz), parse_steps(record[steps_key]), interval)
+        except (TypeError, ValueError):
+            collector.skip()
+
+    return collector
+
+
+PARSERS = {
+    '.csv': parse_csv,
+    '.json': parse_json,
+}
+
+
+def parser_for(file_name):
+    for extension, parser in PARSERS.items():
+        if (file_name or '').lower().endswith(extension):
+            return parser
+
+    return None
+
+
+class ImportReport:
+    def __init__(self, rows, invalid):
+        self.rows = rows
+        self.invalid = invalid
+
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.skipped = 0
+
+        self.delta = 0
+        self.date_from = None
+        self.date_to = None
+
+    @property
+    def days(self):
+        return self.created + self.updated + self.unchanged
+
+
+def save_steps(db_session, target_id, user_id, days, report):
+    # One statement for all days, concurrent imports of the same member update the rows rather than collide
+    previous = upsert_member_steps(db_session, target_id, user_id, days)
+
+    deltas = dict()
+
+    for day, steps in sorted(days.items()):
+        prev_value = previous[day]
+
+        if prev_value is None:
+            prev_value = 0
+            report.created += 1
+        elif prev_value == steps:
+            report.unchanged += 1
+            continue
+        else:
+            report.updated += 1
+
+        deltas[day] = steps - prev_value
+
+    apply_steps_deltas(db_session, target_id, user_id, deltas)
+
+    report.delta = sum(deltas.values())
+
+    return report
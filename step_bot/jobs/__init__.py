@@ -1,22 +1,43 @@
+import logging
+import time
+
+import pytz
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.cron import CronTrigger
+from sqlalchemy import false, or_
+
+from step_bot import outbox
+from step_bot.db import session_scope
+from step_bot.metrics import job_duration, job_failures, job_last_success
+from step_bot.models import Chat, Target
+from step_bot.timezones import group_by_offset, utc_time
 
 jobs = dict()
 
 
-def init_scheduler(settings, bot, db):
+def chunks(iterable, size):
+    batch = []
+
+    for item in iterable:
+        batch.append(item)
+
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def init_scheduler(settings, bot, db, engine):
     scheduler = BackgroundScheduler()
 
     jobstores = dict(
-        default=SQLAlchemyJobStore(
-            url="postgresql+psycopg2://{login}:{password}@{host}:{port}/{database}".format(
-                login=settings.POSTGRES_USER, password=settings.POSTGRES_PASS,
-                host=settings.POSTGRES_HOST, port=settings.POSTGRES_PORT,
-                database=settings.POSTGRES_DB
-            )
-        )
+        default=SQLAlchemyJobStore(engine=engine)
     )
-    job_defaults = dict(coalesce=False, max_instances=3)
+    # A replica taking over the leadership runs a job it missed during failover once, within the grace time
+    job_defaults = dict(coalesce=True, max_instances=3, misfire_grace_time=settings.SCHEDULER_MISFIRE_GRACE)
     executors = dict(default=dict(type="threadpool", max_workers=5))
 
     scheduler.configure(
@@ -29,22 +50,32 @@ def init_scheduler(settings, bot, db):
 def init_jobs(scheduler, bot, db, settings):
     from step_bot.jobs.notify import EveningReminder
     from step_bot.jobs.stats import EveningStat
+    from step_bot.jobs.zones import TimeZoneSync
 
     options = dict(scheduler=scheduler, bot=bot, db=db, settings=settings)
 
     evening_reminder = EveningReminder(**options)
     evening_stat = EveningStat(**options)
+    time_zone_sync = TimeZoneSync(**options)
 
     jobs[evening_reminder.name] = evening_reminder
     jobs[evening_stat.name] = evening_stat
+    jobs[time_zone_sync.name] = time_zone_sync
 
     return jobs
 
 
-def execute_job(job_name):
+def execute_job(job_name, **kwargs):
     job = jobs[job_name]
 
-    job.execute()
+    with job_duration.time(job=job_name):
+        try:
+            job.execute(**kwargs)
+        except Exception:
+            job_failures.inc(job=job_name)
+            raise
+
+    job_last_success.set(time.time(), job=job_name)
 
 
 class BotJob:
@@ -54,6 +85,7 @@ class BotJob:
     at = dict()
 
     job = None
+    scheduler = None
 
     bot = None
     get_db = None
@@ -64,9 +96,115 @@ class BotJob:
         self.bot = bot
         self.get_db = db
 
-        self.job = scheduler.add_job(
+        self.scheduler = scheduler
+        self.schedule()
+
+    def schedule(self):
+        self.job = self.scheduler.add_job(
             execute_job, 'cron', **self.at, id=self.name, kwargs=dict(job_name=self.name), replace_existing=True
         )
 
     def execute(self):
-        NotImplemented("It is abstract job!")
+        raise NotImplementedError("It is abstract job!")
+
+    def session_scope(self):
+        return session_scope(self.get_db, self.name)
+
+    def stream(self, query):
+        return query.yield_per(self.settings.JOB_STREAM_BATCH)
+
+    def active_targets(self, db_session):
+        return db_session.query(Chat.chat_id, Target.id.label('target_id')) \
+            .join(Target, Target.id == Chat.current_target_id) \
+            .filter(Target.current_value < Target.target_value)
+
+    def message_key(self, day, chat_id):
+        # A run repeated after a failover queues the same keys, so chats are not notified twice a day. The day is the
+        # one the run was scheduled on, a run delayed past midnight must not count as the next day's
+        return '{0}:{1}:{2}'.format(self.name, day.isoformat(), chat_id)
+
+    def enqueue(self, db_session, messages, source=None):
+        total = 0
+
+        for batch in chunks(messages, self.settings.JOB_STREAM_BATCH):
+            total += outbox.enqueue(db_session, batch, source=source)
+
+        logging.info('Job %s queued %d messages', self.name, total)
+
+        return total
+
+    def report(self, source):
+        """Waits for the messages of a run to leave the outbox and logs their delivery report"""
+
+        deadline = time.monotonic() + self.settings.JOB_REPORT_TIMEOUT
+
+        while True:
+            with self.session_scope() as db_session:
+                report = outbox.delivery_report(db_session, source)
+
+            if not report.pending or time.monotonic() >= deadline:
+                break
+
+            time.sleep(self.settings.OUTBOX_POLL_INTERVAL)
+
+        logging.info(str(report))
+
+        return report
+
+
+class LocalTimeJob(BotJob):
+    """Runs at the `at` time of every chat's own time zone
+
+    Chats whose zones share a UTC offset at that time share one cron job, so the number of jobs is bounded by the
+    number of distinct offsets rather than by the number of chats. The buckets are kept up to date by TimeZoneSync.
+    """
+
+    def schedule(self):
+        # Buckets depend on the zones in use, they are created once the leader syncs them
+        pass
+
+    def bucket_id(self, offset):
+        return '{0}:{1:+d}'.format(self.name, offset)
+
+    def run_id(self, offset, day):
+        return '{0}:{1}'.format(self.bucket_id(offset), day.isoformat())
+
+    def reschedule(self, time_zones):
+        buckets = group_by_offset(time_zones, self.settings.BOT_TZ, self.at)
+
+        wanted = set()
+        for offset in buckets:
+            job_id = self.bucket_id(offset)
+            trigger = CronTrigger(**utc_time(self.at, offset), timezone=pytz.utc)
+
+            wanted.add(job_id)
+
+            # Replacing an unchanged job would move its next run time, e.g. past a run due right now
+            current = self.scheduler.get_job(job_id)
+            if current is not None and str(current.trigger) == str(trigger):
+                continue
+
+            self.scheduler.add_job(
+                execute_job, trigger, id=job_id, kwargs=dict(job_name=self.name, offset=offset), replace_existing=True
+            )
+
+        for job in self.scheduler.get_jobs():
+            if (job.id == self.name or job.id.startswith(self.name + ':')) and job.id not in wanted:
+                job.remove()
+
+        logging.info('Job %s runs in %d time zone buckets', self.name, len(wanted))
+
+    def execute(self, offset=None):
+        raise NotImplementedError("It is abstract job!")
+
+    def local_targets(self, db_session, offset):
+        time_zones = db_session.query(Chat.timezone).distinct().all()
+
+        # Zones are matched again at run time, so a daylight saving change since the last sync is taken into account
+        names = group_by_offset([name for name, in time_zones], self.settings.BOT_TZ, self.at).get(offset, set())
+
+        conditions = [Chat.timezone.in_(names - {None, ''})] if names - {None, ''} else []
+        if None in names or '' in names:
+            conditions += [Chat.timezone.is_(None), Chat.timezone == '']
+
+        return self.active_targets(db_session).filter(or_(*conditions) if conditions else false())
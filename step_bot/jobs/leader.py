@@ -0,0 +1,89 @@
+import logging
+import threading
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import SQLAlchemyError
+
+
+class LeaderElection:
+    engine = None
+    connection = None
+
+    lock_id = 0
+    interval = 5
+
+    thread = None
+
+    def __init__(self, engine, lock_id, interval, on_elected, on_demoted):
+        self.engine = engine
+        self.lock_id = lock_id
+        self.interval = interval
+
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+
+        self.is_leader = False
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__run, name='leader-election')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+        if self.thread:
+            self.thread.join()
+
+        if self.is_leader:
+            try:
+                self.connection.execute(select([func.pg_advisory_unlock(self.lock_id)]))
+            except SQLAlchemyError as e:
+                logging.warning('Scheduler leadership release failed: %s', e)
+
+        self.__reset()
+
+    def __run(self):
+        timeout = 0
+
+        while not self.stopped.wait(timeout):
+            timeout = self.interval
+
+            try:
+                self.__tick()
+            except SQLAlchemyError as e:
+                logging.warning('Scheduler leader election failed: %s', e)
+
+                self.__reset()
+
+    def __tick(self):
+        if self.connection is None:
+            # Advisory locks belong to the database session, so a dedicated connection is kept for its lifetime
+            self.connection = self.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+
+        if self.is_leader:
+            self.connection.execute(select([1]))
+            return
+
+        if self.connection.execute(select([func.pg_try_advisory_lock(self.lock_id)])).scalar():
+            logging.info('This replica is now the scheduler leader')
+
+            self.is_leader = True
+            self.on_elected()
+
+    def __reset(self):
+        if self.is_leader:
+            logging.info('This replica is no longer the scheduler leader')
+
+            self.is_leader = False
+            self.on_demoted()
+
+        if self.connection is not None:
+            try:
+                self.connection.invalidate()
+                self.connection.close()
+            except SQLAlchemyError:
+                pass
+
+            self.connection = None
@@ -1,24 +1,28 @@
 import telegram
 
-from step_bot.jobs import BotJob
-from step_bot.models import Chat
+from step_bot.jobs import LocalTimeJob
+from step_bot.timezones import fire_date
 
 
-class EveningReminder(BotJob):
+class EveningReminder(LocalTimeJob):
     name = "evening_reminder"
     at = dict(
         hour=21
     )
 
-    def execute(self):
-        db_session = self.get_db()
+    def execute(self, offset=None):
+        today = fire_date(self.at, offset)
+        source = self.run_id(offset, today)
 
-        chats = db_session.query(Chat).outerjoin(Chat.current_target) \
-                .all()
+        with self.session_scope() as db_session:
+            self.enqueue(db_session, self.messages(db_session, offset, today), source)
 
-        for chat in chats:
-            if chat.current_target and not chat.is_target_complete():
-                self.bot.send_message(
-                    chat_id=chat.chat_id, text="А *ты* не забыл сдать показания шагов?!",
-                    parse_mode=telegram.ParseMode.MARKDOWN
-                )
+        self.report(source)
+
+    def messages(self, db_session, offset, today):
+        for chat in self.stream(self.local_targets(db_session, offset)):
+            yield dict(
+                key=self.message_key(today, chat.chat_id),
+                chat_id=chat.chat_id, text="А *ты* не забыл сдать показания шагов?!",
+                parse_mode=telegram.ParseMode.MARKDOWN
+            )
@@ -1,47 +1,38 @@
-from datetime import datetime
-
 import telegram
-from sqlalchemy import func
-from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy import and_, func
 
-from step_bot.jobs import BotJob
-from step_bot.models import Chat, Step
+from step_bot.jobs import LocalTimeJob
+from step_bot.models import Target, TargetDayStat
+from step_bot.timezones import fire_date
 
 
-class EveningStat(BotJob):
+class EveningStat(LocalTimeJob):
     name = "evening_stat"
     at = dict(
         hour=23,
         minute=55
     )
 
-    def execute(self):
-        db_session = self.get_db()
-
-        chats = db_session.query(Chat).outerjoin(Chat.current_target) \
-            .all()
-
-        today = datetime.now(tz=self.settings.BOT_TZ).date()
-
-        for chat in chats:
-            if chat.current_target and not chat.is_target_complete():
-                steps = 0
-
-                try:
-                    aggregate = db_session.query(func.sum(Step.steps).label('today'))\
-                        .filter(
-                            Step.target == chat.current_target,
-                            Step.date == today
-                        )\
-                        .group_by(Step.target_id)\
-                        .one()
-                    steps = aggregate.today
-                except NoResultFound:
-                    pass
-                finally:
-                    self.bot.send_message(
-                        chat_id=chat.chat_id, text="День подходит к концу и сегодня мы прошли *{0:.2f} км*".format(
-                            steps / 1000
-                        ),
-                        parse_mode=telegram.ParseMode.MARKDOWN
-                    )
+    def execute(self, offset=None):
+        # Every chat of the bucket has the same local day
+        today = fire_date(self.at, offset)
+        source = self.run_id(offset, today)
+
+        with self.session_scope() as db_session:
+            self.enqueue(db_session, self.messages(db_session, offset, today), source)
+
+        self.report(source)
+
+    def messages(self, db_session, offset, today):
+        chats = self.local_targets(db_session, offset) \
+            .outerjoin(TargetDayStat, and_(TargetDayStat.target_id == Target.id, TargetDayStat.date == today)) \
+            .add_columns(func.coalesce(TargetDayStat.steps, 0).label('today'))
+
+        for chat in self.stream(chats):
+            yield dict(
+                key=self.message_key(today, chat.chat_id),
+                chat_id=chat.chat_id, text="День подходит к концу и сегодня мы прошли *{0:.2f} км*".format(
+                    chat.today / 1000
+                ),
+                parse_mode=telegram.ParseMode.MARKDOWN
+            )
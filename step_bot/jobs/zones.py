@@ -0,0 +1,17 @@
+from step_bot.jobs import BotJob, LocalTimeJob, jobs
+from step_bot.models import Chat
+
+
+class TimeZoneSync(BotJob):
+    name = "time_zone_sync"
+    at = dict(
+        minute=0
+    )
+
+    def execute(self):
+        with self.session_scope() as db_session:
+            time_zones = [name for name, in db_session.query(Chat.timezone).distinct()]
+
+        for job in jobs.values():
+            if isinstance(job, LocalTimeJob):
+                job.reschedule(time_zones)
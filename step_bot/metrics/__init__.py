@@ -0,0 +1,271 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+JOB_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+CHAT_DEPTH_TOP = 10
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{' + ','.join('{0}="{1}"'.format(key, escape(value)) for key, value in labels) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value))
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+        # Callback metrics are read at scrape time from a list of (labels, value) pairs
+        self.callback = callback
+
+        self.lock = threading.Lock()
+        self.values = dict()
+
+    def key(self, labels):
+        if set(labels.keys()) != set(self.labelnames):
+            raise ValueError('{0} expects labels {1}'.format(self.name, self.labelnames))
+
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        if self.callback is not None:
+            return [(self.name, self.key(labels), value) for labels, value in self.callback()]
+
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [
+            '# HELP {0} {1}'.format(self.name, escape(self.documentation)),
+            '# TYPE {0} {1}'.format(self.name, self.kind)
+        ]
+
+        for name, labels, value in self.samples():
+            lines.append('{0}{1} {2}'.format(name, format_labels(labels), format_value(value)))
+
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.monotonic()
+
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def samples(self):
+        samples = []
+
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                cumulative = 0
+
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append((self.name + '_bucket', key + (('le', format_value(bound)),), cumulative))
+
+                samples.append((self.name + '_sum', key, total))
+                samples.append((self.name + '_count', key, cumulative))
+
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = dict()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics[metric.name] = metric
+
+        return metric
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+handler_latency = registry.register(Histogram(
+    'step_bot_handler_seconds', 'Time spent handling an update', ('handler',)
+))
+handler_errors = registry.register(Counter(
+    'step_bot_handler_errors_total', 'Updates which raised an error', ('handler',)
+))
+send_latency = registry.register(Histogram(
+    'step_bot_send_message_seconds', 'Latency of sendMessage calls to the Bot API'
+))
+send_errors = registry.register(Counter(
+    'step_bot_send_message_errors_total', 'Failed sendMessage calls by error type', ('error',)
+))
+job_duration = registry.register(Histogram(
+    'step_bot_job_seconds', 'Duration of scheduled job runs', ('job',), buckets=JOB_BUCKETS
+))
+job_last_success = registry.register(Gauge(
+    'step_bot_job_last_success_timestamp_seconds', 'Unix time the job last finished without an error', ('job',)
+))
+job_failures = registry.register(Counter(
+    'step_bot_job_failures_total', 'Job runs which raised an error', ('job',)
+))
+outbox_messages = registry.register(Counter(
+    'step_bot_outbox_messages_total', 'Outbox deliveries by result', ('result',)
+))
+shard_updates_dropped = registry.register(Counter(
+    'step_bot_shard_updates_dropped_total', 'Updates dropped because the queue of their shard worker was full',
+    ('shard',)
+))
+shard_restarts = registry.register(Counter(
+    'step_bot_shard_restarts_total', 'Shard workers restarted after they exited', ('shard',)
+))
+
+
+def timed_callback(handler_name, callback):
+    @functools.wraps(callback)
+    def wrapped(*args, **kwargs):
+        with handler_latency.time(handler=handler_name):
+            try:
+                return callback(*args, **kwargs)
+            except Exception:
+                handler_errors.inc(handler=handler_name)
+                raise
+
+    return wrapped
+
+
+def instrument_bot(bot):
+    send_message = bot.send_message
+
+    @functools.wraps(send_message)
+    def timed_send_message(*args, **kwargs):
+        with send_latency.time():
+            try:
+                return send_message(*args, **kwargs)
+            except Exception as e:
+                send_errors.inc(error=type(e).__name__)
+                raise
+
+    # Handlers, jobs and the broadcaster all share this bot instance
+    bot.send_message = timed_send_message
+    bot.sendMessage = timed_send_message
+
+    return bot
+
+
+def init_metrics(updater, pool_metrics, query_stats, chat_executor=None):
+    def pool_stats(name):
+        return lambda: [(dict(), pool_metrics.stats().get(name, 0))]
+
+    def query_scopes(name):
+        return lambda: [(dict(scope=scope), stats[name]) for scope, stats in query_stats.stats().items()]
+
+    registry.register(Gauge(
+        'step_bot_update_queue_depth', 'Updates waiting for the dispatcher',
+        callback=lambda: [(dict(), updater.update_queue.qsize())]
+    ))
+
+    if chat_executor is not None:
+        def deepest_chats():
+            depths = sorted(chat_executor.depths().items(), key=lambda item: item[1], reverse=True)
+
+            # Only the deepest queues are labelled by chat, so the number of series stays bounded
+            return [(dict(chat=chat), depth) for chat, depth in depths[:CHAT_DEPTH_TOP]]
+
+        registry.register(Gauge(
+            'step_bot_chat_queue_depth', 'Updates waiting or running in the deepest chat queues', ('chat',),
+            callback=deepest_chats
+        ))
+        registry.register(Gauge(
+            'step_bot_chat_queues', 'Chats with updates waiting or running',
+            callback=lambda: [(dict(), chat_executor.stats()['chats'])]
+        ))
+        registry.register(Gauge(
+            'step_bot_chat_updates_pending', 'Updates handed to the chat executor and not finished yet',
+            callback=lambda: [(dict(), chat_executor.stats()['pending'])]
+        ))
+
+    registry.register(Gauge('step_bot_db_pool_size', 'Configured size of the database pool',
+                            callback=pool_stats('size')))
+    registry.register(Gauge('step_bot_db_pool_checked_out', 'Database connections in use',
+                            callback=pool_stats('checked_out')))
+    registry.register(Gauge('step_bot_db_pool_overflow', 'Database connections opened above the pool size',
+                            callback=pool_stats('overflow')))
+    registry.register(Counter('step_bot_db_pool_checkouts_total', 'Database connection checkouts',
+                              callback=pool_stats('checkouts')))
+    registry.register(Counter('step_bot_db_pool_timeouts_total', 'Checkouts which timed out waiting for a connection',
+                              callback=pool_stats('timeouts')))
+    registry.register(Counter('step_bot_db_pool_wait_seconds_total', 'Time spent waiting for a database connection',
+                              callback=pool_stats('wait_total')))
+
+    registry.register(Counter('step_bot_db_statements_total', 'SQL statements per handler or job', ('scope',),
+                              callback=query_scopes('statements')))
+    registry.register(Counter('step_bot_db_statement_seconds_total', 'Time in SQL statements per handler or job',
+                              ('scope',), callback=query_scopes('time_total')))
@@ -0,0 +1,53 @@
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from step_bot.metrics import registry
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'StepBotMetrics/1.0'
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = registry.render().encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('Metrics %s - %s', self.address_string(), format % args)
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    thread = None
+
+    def __init__(self, address):
+        super(MetricsServer, self).__init__(address, MetricsRequestHandler)
+
+    def start(self):
+        logging.info('Metrics listening on %s:%s', *self.server_address[:2])
+
+        self.thread = threading.Thread(target=self.serve_forever, name='metrics')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+        if self.thread:
+            self.thread.join()
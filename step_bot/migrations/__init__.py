@@ -0,0 +1,77 @@
+import logging
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, select
+from sqlalchemy.exc import ProgrammingError
+
+from step_bot.migrations.versions import MIGRATIONS
+
+MIGRATION_LOCK_ID = 5730102
+
+metadata = MetaData()
+
+schema_migrations = Table(
+    'schema_migrations', metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String, nullable=False),
+    Column('date_applied', DateTime(timezone=True), server_default=func.now())
+)
+
+
+class SchemaOutdated(RuntimeError):
+    pass
+
+
+def latest_version():
+    return max(version for version, _, _ in MIGRATIONS)
+
+
+def current_version(connection):
+    return connection.execute(select([func.coalesce(func.max(schema_migrations.c.version), 0)])).scalar()
+
+
+def applied_version(engine):
+    """Version of the schema, read only, a database never migrated has none of the tables and is at 0"""
+
+    with engine.connect() as connection:
+        try:
+            return current_version(connection)
+        except ProgrammingError:
+            return 0
+
+
+def check_schema(engine, migrate=True):
+    version = applied_version(engine)
+
+    latest = latest_version()
+    if version >= latest:
+        return version
+
+    if not migrate:
+        raise SchemaOutdated('Database schema is at version {0}, {1} is required'.format(version, latest))
+
+    return upgrade(engine)
+
+
+def upgrade(engine):
+    with engine.connect() as connection:
+        for version, name, migration in sorted(MIGRATIONS, key=lambda item: item[0]):
+            with connection.begin():
+                # Replicas starting together apply every version once, the others wait and skip it
+                connection.execute(select([func.pg_advisory_xact_lock(MIGRATION_LOCK_ID)]))
+
+                schema_migrations.create(connection, checkfirst=True)
+
+                if current_version(connection) >= version:
+                    continue
+
+                logging.info('Applying migration %d %s...', version, name)
+
+                migration(connection)
+
+                connection.execute(schema_migrations.insert().values(version=version, name=name))
+
+        version = current_version(connection)
+
+    logging.info('Database schema is at version %d', version)
+
+    return version
@@ -0,0 +1,200 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from step_bot.models.aggregates import rebuild_aggregates
+
+# The tables as the bot created them before versioned migrations, later changes are applied by the steps below
+BASELINE = [
+    """
+    CREATE TABLE IF NOT EXISTS chats (
+        id UUID NOT NULL,
+        chat_id VARCHAR,
+        current_target_id UUID,
+        date TIMESTAMP WITH TIME ZONE DEFAULT now(),
+        PRIMARY KEY (id),
+        UNIQUE (chat_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS targets (
+        id UUID NOT NULL,
+        chat_id UUID,
+        name VARCHAR,
+        initial_value INTEGER,
+        target_value INTEGER,
+        current_value INTEGER,
+        target_date TIMESTAMP WITH TIME ZONE,
+        date_creation TIMESTAMP WITH TIME ZONE DEFAULT now(),
+        date_edit TIMESTAMP WITH TIME ZONE,
+        PRIMARY KEY (id),
+        FOREIGN KEY (chat_id) REFERENCES chats (id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS steps (
+        id UUID NOT NULL,
+        user_id VARCHAR,
+        target_id UUID,
+        date DATE,
+        steps INTEGER,
+        date_creation TIMESTAMP WITH TIME ZONE DEFAULT now(),
+        date_edit TIMESTAMP WITH TIME ZONE,
+        PRIMARY KEY (id),
+        FOREIGN KEY (target_id) REFERENCES targets (id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS target_day_stats (
+        target_id UUID NOT NULL,
+        date DATE NOT NULL,
+        steps INTEGER NOT NULL,
+        PRIMARY KEY (target_id, date),
+        FOREIGN KEY (target_id) REFERENCES targets (id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_stats (
+        target_id UUID NOT NULL,
+        user_id VARCHAR NOT NULL,
+        steps INTEGER NOT NULL,
+        PRIMARY KEY (target_id, user_id),
+        FOREIGN KEY (target_id) REFERENCES targets (id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS conversation_states (
+        handler VARCHAR NOT NULL,
+        key VARCHAR NOT NULL,
+        state VARCHAR,
+        data JSONB,
+        date_expire TIMESTAMP WITH TIME ZONE,
+        PRIMARY KEY (handler, key)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_conversation_states_date_expire ON conversation_states (date_expire)",
+]
+
+
+def initial(connection):
+    # Frozen DDL rather than the current models, so every later step sees the same starting schema
+    for statement in BASELINE:
+        connection.execute(text(statement))
+
+
+DEDUPLICATE_STEPS = text("""
+    DELETE FROM steps USING (
+        SELECT id, row_number() OVER (
+            PARTITION BY target_id, user_id, date
+            ORDER BY coalesce(date_edit, date_creation) DESC, date_creation DESC, id
+        ) AS position
+        FROM steps
+    ) AS ranked
+    WHERE steps.id = ranked.id AND ranked.position > 1
+    RETURNING steps.target_id
+""")
+
+
+def steps_unique_day(connection):
+    # Writers wait until the duplicates are gone and the key exists
+    connection.execute(text("LOCK TABLE steps IN SHARE ROW EXCLUSIVE MODE"))
+
+    # The latest submission of a day is the one the member meant, older copies were double counted
+    targets = {row.target_id for row in connection.execute(DEDUPLICATE_STEPS)}
+
+    connection.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_steps_target_user_date ON steps (target_id, user_id, date)"
+    ))
+    connection.execute(text("DROP INDEX IF EXISTS ix_steps_target_user_date"))
+
+    db_session = Session(bind=connection)
+    for target_id in targets:
+        rebuild_aggregates(db_session, target_id)
+    db_session.flush()
+
+
+def hot_path_indexes(connection):
+    # steps by target and by target and member are served by uq_steps_target_user_date
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_steps_target_date ON steps (target_id, date)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_steps_user_id ON steps (user_id)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_targets_chat_id ON targets (chat_id)"))
+
+    connection.execute(text("ANALYZE steps"))
+    connection.execute(text("ANALYZE targets"))
+
+
+def chat_timezones(connection):
+    connection.execute(text("ALTER TABLE chats ADD COLUMN IF NOT EXISTS timezone varchar"))
+
+
+OUTBOX = [
+    """
+    CREATE TABLE IF NOT EXISTS outbox (
+        id BIGSERIAL NOT NULL,
+        key VARCHAR NOT NULL,
+        chat_id VARCHAR NOT NULL,
+        method VARCHAR NOT NULL,
+        payload JSONB NOT NULL,
+        state VARCHAR NOT NULL,
+        attempts INTEGER NOT NULL,
+        error VARCHAR,
+        next_attempt TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+        date_creation TIMESTAMP WITH TIME ZONE DEFAULT now(),
+        date_sent TIMESTAMP WITH TIME ZONE,
+        PRIMARY KEY (id),
+        UNIQUE (key)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_outbox_pending ON outbox (next_attempt, id) WHERE state = 'pending'",
+]
+
+
+def outbox(connection):
+    for statement in OUTBOX:
+        connection.execute(text(statement))
+
+
+def backfill_aggregates(connection):
+    # Databases from before the aggregates got them empty from migration 1, writers wait for the rebuild
+    connection.execute(text("LOCK TABLE steps IN SHARE MODE"))
+
+    db_session = Session(bind=connection)
+    rebuild_aggregates(db_session)
+    db_session.flush()
+
+
+def outbox_chat_order(connection):
+    # Serves the claim's lookup of an earlier pending message of the same chat
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_outbox_chat_pending ON outbox (chat_id, id) WHERE state = 'pending'"
+    ))
+
+
+def outbox_source(connection):
+    connection.execute(text("ALTER TABLE outbox ADD COLUMN IF NOT EXISTS source varchar"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_outbox_source ON outbox (source) WHERE source IS NOT NULL"
+    ))
+
+
+def outbox_chats(connection):
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS outbox_chats (
+            chat_id VARCHAR NOT NULL,
+            tokens FLOAT NOT NULL,
+            updated TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+            PRIMARY KEY (chat_id)
+        )
+    """))
+
+
+MIGRATIONS = [
+    (1, 'initial', initial),
+    (2, 'steps_unique_day', steps_unique_day),
+    (3, 'hot_path_indexes', hot_path_indexes),
+    (4, 'chat_timezones', chat_timezones),
+    (5, 'outbox', outbox),
+    (6, 'backfill_aggregates', backfill_aggregates),
+    (7, 'outbox_chat_order', outbox_chat_order),
+    (8, 'outbox_source', outbox_source),
+    (9, 'outbox_chats', outbox_chats),
+]
@@ -1,6 +1,6 @@
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Date
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, ForeignKey, Date, Index, Float
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -14,6 +14,8 @@ class Chat(Base):
     id = Column(UUID(as_uuid=True), primary_key=True)
     chat_id = Column(String, unique=True)
     current_target_id = Column(UUID(as_uuid=True), nullable=True)
+    # IANA name, e.g. Europe/Moscow, chats without one use BOT_TZ
+    timezone = Column(String, nullable=True)
     date = Column(DateTime(timezone=True), server_default=func.now())
 
     current_target = relationship("Target", uselist=False, back_populates="chat")
@@ -29,7 +31,7 @@ class Target(Base):
     __tablename__ = 'targets'
 
     id = Column(UUID(as_uuid=True), primary_key=True)
-    chat_id = Column(UUID(as_uuid=True), ForeignKey('chats.id'))
+    chat_id = Column(UUID(as_uuid=True), ForeignKey('chats.id'), index=True)
     name = Column(String)
     initial_value = Column(Integer, default=0)
     target_value = Column(Integer)
@@ -45,11 +47,15 @@ class Target(Base):
         return self.current_value >= self.target_value
 
 
+# Nobody walks more in a day, larger values are typos or broken exports
+MAX_DAY_STEPS = 200000
+
+
 class Step(Base):
     __tablename__ = 'steps'
 
     id = Column(UUID(as_uuid=True), primary_key=True)
-    user_id = Column(String)
+    user_id = Column(String, index=True)
     target_id = Column(UUID(as_uuid=True), ForeignKey('targets.id'))
     date = Column(Date)
     steps = Column(Integer)
@@ -57,3 +63,70 @@ class Step(Base):
     date_edit = Column(DateTime(timezone=True), onupdate=func.now())
 
     target = relationship("Target", back_populates="steps")
+
+    # One row per member and day, it also serves per-member lookups and rankings of a target
+    __table_args__ = (
+        Index('uq_steps_target_user_date', 'target_id', 'user_id', 'date', unique=True),
+        Index('ix_steps_target_date', 'target_id', 'date'),
+    )
+
+
+class TargetDayStat(Base):
+    __tablename__ = 'target_day_stats'
+
+    target_id = Column(UUID(as_uuid=True), ForeignKey('targets.id'), primary_key=True)
+    date = Column(Date, primary_key=True)
+    steps = Column(Integer, default=0, nullable=False)
+
+
+class UserStat(Base):
+    __tablename__ = 'user_stats'
+
+    target_id = Column(UUID(as_uuid=True), ForeignKey('targets.id'), primary_key=True)
+    user_id = Column(String, primary_key=True)
+    steps = Column(Integer, default=0, nullable=False)
+
+
+class ConversationState(Base):
+    __tablename__ = 'conversation_states'
+
+    handler = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    state = Column(String, nullable=True)
+    data = Column(JSONB, nullable=True)
+    date_expire = Column(DateTime(timezone=True), index=True)
+
+
+class OutboxMessage(Base):
+    __tablename__ = 'outbox'
+
+    id = Column(BigInteger, primary_key=True)
+    # Idempotency key, the same message queued twice is delivered once
+    key = Column(String, nullable=False, unique=True)
+    chat_id = Column(String, nullable=False)
+    method = Column(String, nullable=False, default='send_message')
+    payload = Column(JSONB, nullable=False)
+    state = Column(String, nullable=False, default='pending')
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(String)
+    next_attempt = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    date_creation = Column(DateTime(timezone=True), server_default=func.now())
+    date_sent = Column(DateTime(timezone=True))
+    # Run of the job that queued the message, its delivery report is built from the rows
+    source = Column(String)
+
+    __table_args__ = (
+        Index('ix_outbox_source', 'source', postgresql_where=(source.isnot(None))),
+        Index('ix_outbox_pending', 'next_attempt', 'id', postgresql_where=(state == 'pending')),
+        Index('ix_outbox_chat_pending', 'chat_id', 'id', postgresql_where=(state == 'pending')),
+    )
+
+
+class OutboxChat(Base):
+    """Token bucket of a chat shared by the outbox workers of all processes"""
+
+    __tablename__ = 'outbox_chats'
+
+    chat_id = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
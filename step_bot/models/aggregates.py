@@ -0,0 +1,173 @@
+import uuid
+
+from sqlalchemy import bindparam, func, select, text
+from sqlalchemy.dialects.postgresql import UUID, insert
+
+from step_bot.cache import sync
+from step_bot.models import Step, Target, TargetDayStat, UserStat
+
+ALL_TARGETS = sync.ALL_KEYS
+
+
+def touch_target(db_session, target_id):
+    # Only committed writes drop cached rankings, a rollback keeps them valid
+    sync.touch(db_session, 'leaderboards', target_id)
+
+
+UPSERT_STEP = text("""
+    WITH old AS (
+        SELECT steps FROM steps
+        WHERE target_id = :target_id AND user_id = :user_id AND date = :date
+        FOR UPDATE
+    )
+    INSERT INTO steps (id, target_id, user_id, date, steps)
+    VALUES (:id, :target_id, :user_id, :date, :steps)
+    ON CONFLICT (target_id, user_id, date) DO UPDATE
+        SET steps = excluded.steps, date_edit = now()
+        WHERE EXISTS (SELECT 1 FROM old)
+    RETURNING (SELECT steps FROM old) AS prev_value
+""").bindparams(bindparam('id', type_=UUID(as_uuid=True)), bindparam('target_id', type_=UUID(as_uuid=True)))
+
+UPDATE_STEP = text("""
+    UPDATE steps SET steps = :steps, date_edit = now()
+    FROM (
+        SELECT id, steps FROM steps
+        WHERE target_id = :target_id AND user_id = :user_id AND date = :date
+        FOR UPDATE
+    ) AS old
+    WHERE steps.id = old.id
+    RETURNING old.steps AS prev_value
+""").bindparams(bindparam('target_id', type_=UUID(as_uuid=True)))
+
+# Several days of a member at once, unchanged days keep their date_edit
+UPSERT_STEPS = text("""
+    WITH old AS (
+        SELECT date, steps FROM steps
+        WHERE target_id = :target_id AND user_id = :user_id AND date = ANY(CAST(:dates AS date[]))
+        FOR UPDATE
+    )
+    INSERT INTO steps AS step (id, target_id, user_id, date, steps)
+    SELECT new.id, :target_id, :user_id, new.date, new.steps
+    FROM unnest(CAST(:ids AS uuid[]), CAST(:dates AS date[]), CAST(:steps AS integer[])) AS new (id, date, steps)
+    ON CONFLICT (target_id, user_id, date) DO UPDATE
+        SET steps = excluded.steps,
+            date_edit = CASE WHEN step.steps = excluded.steps THEN step.date_edit ELSE now() END
+        WHERE EXISTS (SELECT 1 FROM old WHERE old.date = excluded.date)
+    RETURNING step.date, (SELECT old.steps FROM old WHERE old.date = step.date) AS prev_value
+""").bindparams(bindparam('target_id', type_=UUID(as_uuid=True)))
+
+
+# Returns the previous value of the day, None when the day is new
+def upsert_step(db_session, target_id, user_id, day, steps):
+    params = dict(target_id=target_id, user_id=str(user_id), date=day, steps=steps)
+
+    row = db_session.execute(UPSERT_STEP, dict(params, id=uuid.uuid4())).first()
+    if row is not None:
+        return row.prev_value
+
+    # A concurrent first submission inserted the day after the lock was taken, it is committed by now
+    return db_session.execute(UPDATE_STEP, params).scalar()
+
+
+# Returns the previous value of every day, None for the new ones
+def upsert_member_steps(db_session, target_id, user_id, days):
+    if not days:
+        return dict()
+
+    dates = sorted(days)
+    params = dict(target_id=target_id, user_id=str(user_id))
+
+    rows = db_session.execute(UPSERT_STEPS, dict(
+        params, dates=dates, steps=[days[day] for day in dates], ids=[str(uuid.uuid4()) for _ in dates]
+    )).fetchall()
+
+    previous = {row.date: row.prev_value for row in rows}
+
+    for day in dates:
+        if day not in previous:
+            # Inserted by a concurrent first submission after the lock was taken, as in upsert_step
+            previous[day] = db_session.execute(UPDATE_STEP, dict(params, date=day, steps=days[day])).scalar()
+
+    return previous
+
+
+def upsert_steps(db_session, model, keys, steps):
+    stmt = insert(model.__table__).values(steps=steps, **keys)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys.keys()), set_=dict(steps=model.__table__.c.steps + stmt.excluded.steps)
+    )
+
+    db_session.execute(stmt)
+
+
+def apply_steps_delta(db_session, target_id, user_id, day, delta):
+    if not delta:
+        return
+
+    db_session.query(Target) \
+        .filter(Target.id == target_id) \
+        .update({Target.current_value: Target.current_value + delta}, synchronize_session=False)
+
+    touch_target(db_session, target_id)
+
+    upsert_steps(db_session, TargetDayStat, dict(target_id=target_id, date=day), delta)
+    upsert_steps(db_session, UserStat, dict(target_id=target_id, user_id=str(user_id)), delta)
+
+
+def apply_steps_deltas(db_session, target_id, user_id, deltas):
+    deltas = {day: delta for day, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    total = sum(deltas.values())
+
+    db_session.query(Target) \
+        .filter(Target.id == target_id) \
+        .update({Target.current_value: Target.current_value + total}, synchronize_session=False)
+
+    touch_target(db_session, target_id)
+
+    stmt = insert(TargetDayStat.__table__).values([
+        dict(target_id=target_id, date=day, steps=delta) for day, delta in sorted(deltas.items())
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['target_id', 'date'], set_=dict(steps=TargetDayStat.__table__.c.steps + stmt.excluded.steps)
+    )
+
+    db_session.execute(stmt)
+
+    upsert_steps(db_session, UserStat, dict(target_id=target_id, user_id=str(user_id)), total)
+
+
+def rebuild_aggregates(db_session, target_id=None):
+    day_stats = select([Step.target_id, Step.date, func.sum(Step.steps)]).group_by(Step.target_id, Step.date)
+    user_stats = select([Step.target_id, Step.user_id, func.sum(Step.steps)]).group_by(Step.target_id, Step.user_id)
+    target_steps = select([func.coalesce(func.sum(Step.steps), 0)]).where(Step.target_id == Target.id).as_scalar()
+
+    day_query = db_session.query(TargetDayStat)
+    user_query = db_session.query(UserStat)
+    target_query = db_session.query(Target)
+
+    if target_id is not None:
+        day_stats = day_stats.where(Step.target_id == target_id)
+        user_stats = user_stats.where(Step.target_id == target_id)
+
+        day_query = day_query.filter(TargetDayStat.target_id == target_id)
+        user_query = user_query.filter(UserStat.target_id == target_id)
+        target_query = target_query.filter(Target.id == target_id)
+
+    touch_target(db_session, ALL_TARGETS if target_id is None else target_id)
+
+    day_query.delete(synchronize_session=False)
+    user_query.delete(synchronize_session=False)
+
+    db_session.execute(
+        TargetDayStat.__table__.insert().from_select(['target_id', 'date', 'steps'], day_stats)
+    )
+    db_session.execute(
+        UserStat.__table__.insert().from_select(['target_id', 'user_id', 'steps'], user_stats)
+    )
+
+    target_query.update(
+        {Target.current_value: func.coalesce(Target.initial_value, 0) + target_steps}, synchronize_session=False
+    )
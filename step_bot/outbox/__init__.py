@@ -0,0 +1,90 @@
+from sqlalchemy import event, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from step_bot.models import OutboxMessage
+
+CHANNEL = 'step_bot_outbox'
+
+NOTIFY = text("SELECT pg_notify(:channel, '')").bindparams(channel=CHANNEL)
+
+REPORT = text("""
+    SELECT count(*) AS total,
+           count(*) FILTER (WHERE state = 'sent') AS sent,
+           count(*) FILTER (WHERE state = 'failed') AS failed,
+           count(*) FILTER (WHERE state = 'pending') AS pending,
+           coalesce(sum(attempts), 0) - count(*) FILTER (WHERE state <> 'pending') AS retries,
+           coalesce(extract(epoch FROM max(date_sent) - min(date_creation)), 0) AS duration
+    FROM outbox WHERE source = :source
+""")
+
+
+class DeliveryReport:
+    name = ""
+
+    def __init__(self, name, total=0, sent=0, failed=0, pending=0, retries=0, duration=0.0):
+        self.name = name
+
+        self.total = total
+        self.sent = sent
+        self.failed = failed
+        self.pending = pending
+        self.retries = retries
+        self.duration = float(duration)
+
+    @property
+    def throughput(self):
+        return self.sent / self.duration if self.duration > 0 else 0.0
+
+    def __str__(self):
+        return 'Broadcast "{0}": {1}/{2} sent, {3} failed, {4} pending, {5} retries in {6:.2f}s ({7:.1f} msg/s)'.format(
+            self.name, self.sent, self.total, self.failed, self.pending, self.retries, self.duration, self.throughput
+        )
+
+
+def message_key(update, index=0):
+    # Updates handled again after a crash produce the same keys, so their replies are not sent twice
+    return 'update:{0}:{1}:{2}'.format(update.effective_chat.id, update.effective_message.message_id, index)
+
+
+def enqueue(db_session, messages, method='send_message', source=None):
+    """Queues messages in the transaction of db_session, they are delivered only if it commits
+
+    Every message is a dict of the Bot API method arguments with a chat_id and an idempotency key. Messages with a
+    source are counted in its delivery report.
+    """
+
+    rows = [
+        dict(key=message.pop('key'), chat_id=str(message['chat_id']), method=method, payload=message, source=source)
+        for message in (dict(message) for message in messages)
+    ]
+    if not rows:
+        return 0
+
+    stmt = insert(OutboxMessage.__table__).values(rows).on_conflict_do_nothing(index_elements=['key'])
+    db_session.execute(stmt)
+
+    # The notification is delivered on commit, so workers wake up once the messages are visible
+    if not db_session.info.get('outbox_notified'):
+        db_session.execute(NOTIFY)
+        db_session.info['outbox_notified'] = True
+
+    return len(rows)
+
+
+def send_message(db_session, key, **kwargs):
+    return enqueue(db_session, [dict(kwargs, key=key)])
+
+
+def delivery_report(db_session, source):
+    return DeliveryReport(source, **dict(db_session.execute(REPORT, dict(source=source)).first()))
+
+
+@event.listens_for(Session, 'after_commit')
+def reset_notified(db_session):
+    db_session.info.pop('outbox_notified', None)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_notified(db_session):
+    db_session.info.pop('outbox_notified', None)
@@ -0,0 +1,234 @@
+import logging
+import select
+import threading
+from concurrent.futures import as_completed
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from step_bot.broadcast import SENT, FAILED, RETRIED
+from step_bot.db import session_scope
+from step_bot.metrics import outbox_messages
+from step_bot.outbox import CHANNEL
+
+# Only the oldest pending message of a chat is due, a later one waits until it is sent or failed, even when it is
+# retried or leased by another worker. Without :chats the messages of every chat are claimed
+CLAIM = text("""
+    UPDATE outbox SET next_attempt = now() + make_interval(secs => :lease)
+    WHERE id IN (
+        SELECT id FROM outbox AS pending
+        WHERE state = 'pending' AND next_attempt <= now()
+        AND (CAST(:chats AS varchar[]) IS NULL OR pending.chat_id = ANY(CAST(:chats AS varchar[])))
+        AND NOT EXISTS (
+            SELECT 1 FROM outbox AS earlier
+            WHERE earlier.chat_id = pending.chat_id AND earlier.state = 'pending' AND earlier.id < pending.id
+        )
+        ORDER BY id
+        LIMIT :batch
+        FOR UPDATE OF pending SKIP LOCKED
+    )
+    RETURNING id, key, chat_id, method, payload, attempts
+""")
+
+MARK_SENT = text("""
+    UPDATE outbox SET state = 'sent', attempts = attempts + 1, date_sent = now(), error = NULL WHERE id = ANY(:ids)
+""")
+
+MARK_FAILED = text("""
+    UPDATE outbox SET state = 'failed', attempts = attempts + 1, error = :error WHERE id = :id
+""")
+
+RETRY = text("""
+    UPDATE outbox SET attempts = attempts + 1, next_attempt = now() + make_interval(secs => :delay), error = :error
+    WHERE id = :id
+""")
+
+PRUNE = text("""
+    DELETE FROM outbox WHERE state <> 'pending' AND date_creation < now() - make_interval(secs => :retention)
+    AND (CAST(:chats AS varchar[]) IS NULL OR chat_id = ANY(CAST(:chats AS varchar[])))
+""")
+
+# Takes a token from the bucket of every claimed chat which has one, returns those chats
+TAKE_TOKENS = text("""
+    INSERT INTO outbox_chats AS chat (chat_id, tokens, updated)
+    SELECT claimed.chat_id, :burst - 1, now() FROM unnest(CAST(:chats AS varchar[])) AS claimed (chat_id)
+    ON CONFLICT (chat_id) DO UPDATE
+        SET tokens = least(:burst, chat.tokens + extract(epoch FROM now() - chat.updated) * :rate) - 1, updated = now()
+        WHERE least(:burst, chat.tokens + extract(epoch FROM now() - chat.updated) * :rate) >= 1
+    RETURNING chat.chat_id
+""")
+
+# Claimed messages of chats without a token are due again once their bucket has one, which costs no attempt
+DEFER = text("""
+    UPDATE outbox SET next_attempt = now() + make_interval(
+        secs => (1 - least(:burst, chat.tokens + extract(epoch FROM now() - chat.updated) * :rate)) / :rate
+    )
+    FROM outbox_chats AS chat
+    WHERE outbox.id = ANY(:ids) AND chat.chat_id = outbox.chat_id
+""")
+
+PRUNE_CHATS = text("""
+    DELETE FROM outbox_chats WHERE tokens + extract(epoch FROM now() - updated) * :rate >= :burst
+""")
+
+
+class OutboxWorker:
+    """Drains the outbox table and delivers messages through the broadcaster's rate limits
+
+    Rows are claimed with FOR UPDATE SKIP LOCKED and leased for OUTBOX_LEASE seconds, so every replica can run a
+    worker. A claim takes the oldest pending message of every chat, so messages of one chat are sent in the order
+    they were queued. The per-chat rate limit is a token bucket in outbox_chats, shared by the workers of all
+    replicas and shards, a chat out of tokens is deferred rather than waited for. Delivery is at least once: a
+    message whose send timed out or whose worker died during the lease is sent again.
+    """
+
+    connection = None
+    thread = None
+
+    prune_every = 600
+
+    def __init__(self, engine, get_db, broadcaster, settings, chats=None):
+        self.engine = engine
+        self.get_db = get_db
+
+        self.broadcaster = broadcaster
+
+        # Only these chats are drained and pruned, e.g. the synthetic ones of the bench
+        self.chats = [str(chat_id) for chat_id in chats] if chats is not None else None
+
+        self.batch = settings.OUTBOX_BATCH
+        self.poll_interval = settings.OUTBOX_POLL_INTERVAL
+        self.lease = settings.OUTBOX_LEASE
+        self.max_attempts = settings.OUTBOX_MAX_ATTEMPTS
+        self.retention = settings.OUTBOX_RETENTION
+
+        self.chat_rate = settings.BROADCAST_CHAT_RATE
+        self.chat_burst = settings.BROADCAST_CHAT_BURST
+
+        self.stopped = threading.Event()
+        self.pruned = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__run, name='outbox')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+        if self.thread:
+            self.thread.join()
+
+        self.__close()
+
+    def __run(self):
+        while not self.stopped.is_set():
+            try:
+                self.listen()
+
+                while not self.stopped.is_set() and self.drain():
+                    pass
+
+                self.prune()
+                self.wait(self.poll_interval)
+            except SQLAlchemyError as e:
+                logging.warning('Outbox delivery failed: %s', e)
+
+                self.__close()
+                self.stopped.wait(self.poll_interval)
+            except Exception as e:
+                # The worker is the only one draining the outbox of this process, it must outlive any error
+                logging.exception(e)
+
+                self.stopped.wait(self.poll_interval)
+
+    def listen(self):
+        if self.connection is not None:
+            return
+
+        # Notifications are only delivered outside of a transaction, hence the autocommit connection
+        self.connection = self.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        self.connection.execute(text('LISTEN {0}'.format(CHANNEL)))
+
+    def wait(self, timeout):
+        raw = self.connection.connection.connection
+
+        if select.select([raw], [], [], timeout)[0]:
+            raw.poll()
+            del raw.notifies[:]
+
+    def __close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except SQLAlchemyError:
+                pass
+
+            self.connection = None
+
+    def prune(self):
+        self.pruned += 1
+        if self.pruned * self.poll_interval < self.prune_every:
+            return
+
+        self.pruned = 0
+
+        with session_scope(self.get_db, 'outbox') as db_session:
+            db_session.execute(PRUNE, dict(retention=self.retention, chats=self.chats))
+            # Full buckets behave as missing ones, dropping them only forgets the chats no longer sent to
+            db_session.execute(PRUNE_CHATS, dict(rate=self.chat_rate, burst=self.chat_burst))
+
+    def drain(self):
+        bucket = dict(rate=self.chat_rate, burst=self.chat_burst)
+
+        with session_scope(self.get_db, 'outbox') as db_session:
+            rows = db_session.execute(CLAIM, dict(lease=self.lease, batch=self.batch, chats=self.chats)).fetchall()
+            if not rows:
+                return 0
+
+            chats = sorted({row.chat_id for row in rows})
+            ready = {chat_id for chat_id, in db_session.execute(TAKE_TOKENS, dict(bucket, chats=chats))}
+
+            deferred = [row.id for row in rows if row.chat_id not in ready]
+            if deferred:
+                db_session.execute(DEFER, dict(bucket, ids=deferred))
+
+        futures = {
+            self.broadcaster.executor.submit(self.deliver, row): row for row in rows if row.chat_id in ready
+        }
+
+        # A slow send delays only its own chat, the others are recorded as soon as they are done
+        for future in as_completed(futures):
+            self.record([(futures[future], ) + future.result()])
+
+        return len(rows)
+
+    def deliver(self, row):
+        return self.broadcaster.send(row.method, row.payload, row.key, row.attempts)
+
+    def record(self, results):
+        sent = [row.id for row, result, delay, error in results if result == SENT]
+
+        failed = []
+        retried = []
+        for row, result, delay, error in results:
+            # Attempts counts the sends before this one
+            if result == FAILED or (result == RETRIED and row.attempts + 1 >= self.max_attempts):
+                failed.append(dict(id=row.id, error=error or 'too many attempts'))
+            elif result == RETRIED:
+                retried.append(dict(id=row.id, delay=delay, error=error))
+
+        with session_scope(self.get_db, 'outbox') as db_session:
+            if sent:
+                db_session.execute(MARK_SENT, dict(ids=sent))
+            if failed:
+                db_session.execute(MARK_FAILED, failed)
+            if retried:
+                db_session.execute(RETRY, retried)
+
+        outbox_messages.inc(len(sent), result=SENT)
+        outbox_messages.inc(len(failed), result=FAILED)
+        outbox_messages.inc(len(retried), result=RETRIED)
+
+        if failed:
+            logging.error('%d outbox messages dropped', len(failed))
@@ -0,0 +1,101 @@
+from collections import namedtuple
+from datetime import timedelta
+
+import numpy as np
+from sqlalchemy import Date, cast, func, literal_column
+
+from step_bot.models import Step, TargetDayStat
+
+Period = namedtuple('Period', ['start', 'steps'])
+MemberConsistency = namedtuple('MemberConsistency', ['user_id', 'active_days', 'total', 'share'])
+Forecast = namedtuple('Forecast', ['pace', 'required', 'projected', 'reach_date', 'on_track'])
+
+
+def truncate(unit, column):
+    # The unit is a literal so the select list and GROUP BY render the very same expression
+    return cast(func.date_trunc(literal_column("'{0}'".format(unit)), column), Date)
+
+
+def load_periods(db_session, target_id):
+    """Weekly and monthly totals of a target in one pass over its daily aggregates"""
+
+    week = truncate('week', TargetDayStat.date)
+    month = truncate('month', TargetDayStat.date)
+
+    rows = db_session.query(week.label('week'), month.label('month'), func.sum(TargetDayStat.steps).label('steps')) \
+        .filter(TargetDayStat.target_id == target_id) \
+        .group_by(func.grouping_sets(week, month)) \
+        .all()
+
+    weeks = sorted(Period(row.week, row.steps) for row in rows if row.week is not None)
+    months = sorted(Period(row.month, row.steps) for row in rows if row.month is not None)
+
+    return weeks, months
+
+
+def load_daily(db_session, target_id):
+    return db_session.query(TargetDayStat.date, TargetDayStat.steps) \
+        .filter(TargetDayStat.target_id == target_id) \
+        .order_by(TargetDayStat.date) \
+        .all()
+
+
+def load_consistency(db_session, target_id, days):
+    rows = db_session.query(Step.user_id, func.count().filter(Step.steps > 0), func.sum(Step.steps)) \
+        .filter(Step.target_id == target_id) \
+        .group_by(Step.user_id) \
+        .all()
+
+    result = [
+        MemberConsistency(user_id, active_days, total or 0, min(active_days / days, 1.0) if days else 0.0)
+        for user_id, active_days, total in rows
+    ]
+
+    return sorted(result, key=lambda member: (member.share, member.total), reverse=True)
+
+
+def daily_series(rows, date_from, date_to):
+    """Dense array of steps per day from date_from to date_to, days without steps are zeros"""
+
+    size = (date_to - date_from).days + 1
+    series = np.zeros(max(size, 0), dtype=np.int64)
+
+    if not rows or size <= 0:
+        return series
+
+    dates, steps = zip(*rows)
+    offsets = (np.array(dates, dtype='datetime64[D]') - np.datetime64(date_from, 'D')).astype(np.int64)
+
+    inside = (offsets >= 0) & (offsets < size)
+    np.add.at(series, offsets[inside], np.array(steps, dtype=np.int64)[inside])
+
+    return series
+
+
+def rolling_mean(series, window):
+    """Mean over the last window days for every day, the first days average over what they have"""
+
+    sums = np.concatenate(([0], np.cumsum(series, dtype=np.float64)))
+    ends = np.arange(1, len(series) + 1)
+    starts = np.maximum(ends - window, 0)
+
+    return (sums[ends] - sums[starts]) / (ends - starts)
+
+
+def forecast(series, current_value, target_value, today, target_date, window=7):
+    pace = float(rolling_mean(series, window)[-1]) if len(series) else 0.0
+
+    remaining = target_value - current_value
+    days_left = (target_date - today).days + 1
+
+    if remaining <= 0:
+        return Forecast(pace=pace, required=0.0, projected=current_value, reach_date=today, on_track=True)
+
+    required = remaining / days_left if days_left > 0 else None
+    projected = current_value + pace * max(days_left, 0)
+    reach_date = today + timedelta(days=int(np.ceil(remaining / pace)) - 1) if pace > 0 else None
+
+    return Forecast(
+        pace=pace, required=required, projected=projected, reach_date=reach_date,
+        on_track=days_left > 0 and projected >= target_value
+    )
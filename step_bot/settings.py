@@ -22,6 +22,25 @@ BOT_REQUEST_KWARGS = dict()
 
 BOT_TZ = pytz.timezone(environ_var("BOT_TZ", "Europe/Volgograd"))
 
+BOT_MODE = environ_var("BOT_MODE", 'polling')
+BOT_WEBHOOK_LISTEN = environ_var("BOT_WEBHOOK_LISTEN", '0.0.0.0')
+BOT_WEBHOOK_PORT = int(environ_var("BOT_WEBHOOK_PORT", 8443))
+BOT_WEBHOOK_URL = environ_var("BOT_WEBHOOK_URL", '')
+BOT_WEBHOOK_SECRET = environ_var("BOT_WEBHOOK_SECRET", '')
+BOT_WEBHOOK_MAX_BODY = int(environ_var("BOT_WEBHOOK_MAX_BODY", 1024 * 1024))
+
+BOT_SHARDS = int(environ_var("BOT_SHARDS", 0))
+BOT_SHARD_QUEUE_SIZE = int(environ_var("BOT_SHARD_QUEUE_SIZE", 1000))
+# Seconds an update waits for room in the queue of its shard worker before it is dropped
+BOT_SHARD_PUT_TIMEOUT = float(environ_var("BOT_SHARD_PUT_TIMEOUT", 5))
+
+# Threads handling updates of different chats in parallel, 0 handles every update on the dispatcher thread
+DISPATCH_WORKERS = int(environ_var("DISPATCH_WORKERS", 8))
+DISPATCH_MAX_PENDING = int(environ_var("DISPATCH_MAX_PENDING", 1000))
+
+METRICS_LISTEN = environ_var("METRICS_LISTEN", '127.0.0.1')
+METRICS_PORT = int(environ_var("METRICS_PORT", 9108))
+
 if BOT_PROXY_ENABLE:
     BOT_REQUEST_KWARGS.update(dict(
         proxy_url=environ_var("BOT_PROXY_URL", ''),
@@ -43,3 +62,59 @@ POSTGRES_PORT = int(environ_var("POSTGRES_PORT", 5432))
 POSTGRES_USER = environ_var("POSTGRES_USER", 'step_bot_user')
 POSTGRES_PASS = environ_var("POSTGRES_PASS", 'step_bot_pass')
 POSTGRES_MAX_CONN = int(environ_var("POSTGRES_MAX_CONN", 2))
+POSTGRES_MAX_OVERFLOW = int(environ_var("POSTGRES_MAX_OVERFLOW", 8))
+POSTGRES_POOL_TIMEOUT = int(environ_var("POSTGRES_POOL_TIMEOUT", 30))
+POSTGRES_POOL_RECYCLE = int(environ_var("POSTGRES_POOL_RECYCLE", 1800))
+POSTGRES_POOL_PRE_PING = environ_var("POSTGRES_POOL_PRE_PING", True)
+
+DB_AUTO_MIGRATE = environ_var("DB_AUTO_MIGRATE", True)
+
+SQL_SLOW_QUERY = float(environ_var("SQL_SLOW_QUERY", 250))
+SQL_N_PLUS_ONE = int(environ_var("SQL_N_PLUS_ONE", 10))
+
+BROADCAST_WORKERS = int(environ_var("BROADCAST_WORKERS", 8))
+BROADCAST_GLOBAL_RATE = float(environ_var("BROADCAST_GLOBAL_RATE", 30))
+BROADCAST_GLOBAL_BURST = int(environ_var("BROADCAST_GLOBAL_BURST", 30))
+BROADCAST_CHAT_RATE = float(environ_var("BROADCAST_CHAT_RATE", 20 / 60))
+BROADCAST_CHAT_BURST = int(environ_var("BROADCAST_CHAT_BURST", 3))
+BROADCAST_BACKOFF = float(environ_var("BROADCAST_BACKOFF", 0.5))
+
+JOB_STREAM_BATCH = int(environ_var("JOB_STREAM_BATCH", 500))
+# Seconds a job waits for its messages to be delivered before it logs the report of what is left pending
+JOB_REPORT_TIMEOUT = int(environ_var("JOB_REPORT_TIMEOUT", 600))
+
+OUTBOX_BATCH = int(environ_var("OUTBOX_BATCH", 100))
+OUTBOX_POLL_INTERVAL = float(environ_var("OUTBOX_POLL_INTERVAL", 1))
+OUTBOX_LEASE = int(environ_var("OUTBOX_LEASE", 60))
+OUTBOX_MAX_ATTEMPTS = int(environ_var("OUTBOX_MAX_ATTEMPTS", 8))
+OUTBOX_RETENTION = int(environ_var("OUTBOX_RETENTION", 7 * 86400))
+
+CHAT_CACHE_SIZE = int(environ_var("CHAT_CACHE_SIZE", 10000))
+CHAT_CACHE_TTL = int(environ_var("CHAT_CACHE_TTL", 300))
+
+ADMIN_CACHE_SIZE = int(environ_var("ADMIN_CACHE_SIZE", 10000))
+ADMIN_CACHE_TTL = int(environ_var("ADMIN_CACHE_TTL", 3600))
+ADMIN_CACHE_REFRESH = int(environ_var("ADMIN_CACHE_REFRESH", 300))
+
+LEADERBOARD_CACHE_SIZE = int(environ_var("LEADERBOARD_CACHE_SIZE", 1000))
+LEADERBOARD_CACHE_TTL = int(environ_var("LEADERBOARD_CACHE_TTL", 3600))
+
+MEMBER_CACHE_SIZE = int(environ_var("MEMBER_CACHE_SIZE", 10000))
+MEMBER_CACHE_TTL = int(environ_var("MEMBER_CACHE_TTL", 86400))
+
+CHART_WORKERS = int(environ_var("CHART_WORKERS", 2))
+CHART_CACHE_SIZE = int(environ_var("CHART_CACHE_SIZE", 1000))
+CHART_CACHE_TTL = int(environ_var("CHART_CACHE_TTL", 86400))
+CHART_TOP_MEMBERS = int(environ_var("CHART_TOP_MEMBERS", 8))
+
+ASYNC_DB_WORKERS = int(environ_var("ASYNC_DB_WORKERS", POSTGRES_MAX_CONN))
+ASYNC_IO_WORKERS = int(environ_var("ASYNC_IO_WORKERS", 16))
+
+SCHEDULER_LOCK_ID = int(environ_var("SCHEDULER_LOCK_ID", 5730101))
+SCHEDULER_ELECTION_INTERVAL = int(environ_var("SCHEDULER_ELECTION_INTERVAL", 5))
+SCHEDULER_MISFIRE_GRACE = int(environ_var("SCHEDULER_MISFIRE_GRACE", 300))
+
+CONVERSATION_STORE = environ_var("CONVERSATION_STORE", 'memory')
+CONVERSATION_MAX_ENTRIES = int(environ_var("CONVERSATION_MAX_ENTRIES", 10000))
+
+IMPORT_MAX_SIZE = int(environ_var("IMPORT_MAX_SIZE", 5 * 1024 * 1024))
@@ -0,0 +1,123 @@
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+
+from step_bot.metrics import shard_restarts, shard_updates_dropped
+
+
+def update_chat_id(data):
+    for key in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if key in data:
+            return data[key]['chat']['id']
+
+    callback_query = data.get('callback_query')
+    if callback_query and 'message' in callback_query:
+        return callback_query['message']['chat']['id']
+
+    # Payments and inline queries go to the shard of their user, which also handles the user's private chat
+    for value in data.values():
+        if isinstance(value, dict) and 'from' in value:
+            return value['from']['id']
+
+    return None
+
+
+def shard_for(chat_id, shards):
+    if chat_id is None:
+        return 0
+
+    return int(chat_id) % shards
+
+
+def run_worker(shard, queue):
+    from step_bot import settings
+    from step_bot.bot import Bot
+
+    # The front process owns the signals and stops workers through their queues
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    logging.basicConfig(
+        level=getattr(logging, settings.LOG_LEVEL.upper()),
+        format='%(levelname)s - shard {0} - %(asctime)s: %(message)s'.format(shard)
+    )
+
+    Bot(settings, shard=shard).serve_shard(queue)
+
+
+class ShardRouter:
+    shards = 1
+
+    put_timeout = 5.0
+    restart_interval = 10.0
+
+    def __init__(self, shards, queue_size, put_timeout):
+        self.context = multiprocessing.get_context('spawn')
+
+        self.shards = shards
+        self.put_timeout = put_timeout
+
+        self.queues = [self.context.Queue(queue_size) for _ in range(shards)]
+        self.processes = [self.__process(shard) for shard in range(shards)]
+
+        self.lock = threading.Lock()
+        self.restarted = [0.0] * shards
+
+    def __process(self, shard):
+        return self.context.Process(
+            target=run_worker, args=(shard, self.queues[shard]), name='shard-{0}'.format(shard)
+        )
+
+    def start(self):
+        logging.info('Starting %d shard workers...', self.shards)
+
+        for process in self.processes:
+            process.start()
+
+    def route(self, data):
+        shard = shard_for(update_chat_id(data), self.shards)
+
+        self.revive(shard)
+
+        # The webhook and polling threads wait here, a worker which does not keep up costs updates instead of them
+        try:
+            self.queues[shard].put(data, timeout=self.put_timeout)
+        except queue.Full:
+            logging.warning('Queue of shard %s is full, update %s dropped', shard, data.get('update_id'))
+            shard_updates_dropped.inc(shard=str(shard))
+
+    def revive(self, shard):
+        with self.lock:
+            process = self.processes[shard]
+            if process.is_alive() or process.exitcode is None:
+                return
+
+            # A worker failing on startup is not respawned for every update
+            now = time.monotonic()
+            if now - self.restarted[shard] < self.restart_interval:
+                return
+
+            self.restarted[shard] = now
+
+            logging.error('Shard worker %s exited with code %s, restarting', process.name, process.exitcode)
+            shard_restarts.inc(shard=str(shard))
+
+            self.processes[shard] = self.__process(shard)
+            self.processes[shard].start()
+
+    def stop(self, timeout=30):
+        for shard, process in enumerate(self.processes):
+            try:
+                self.queues[shard].put(None, timeout=self.put_timeout)
+            except queue.Full:
+                logging.warning('Queue of shard %s is full, its worker is not stopped gracefully', shard)
+
+        for process in self.processes:
+            process.join(timeout)
+
+            if process.is_alive():
+                logging.warning('Shard worker %s did not stop in time, terminating', process.name)
+                process.terminate()
@@ -0,0 +1,55 @@
+from datetime import datetime, time, timedelta
+
+import pytz
+
+
+def get_timezone(name, default):
+    """Time zone of a chat, chats which never set one live in the bot's default zone"""
+
+    if not name:
+        return default
+
+    try:
+        return pytz.timezone(name)
+    except pytz.UnknownTimeZoneError:
+        return default
+
+
+def utc_offset(tz, at, now=None):
+    """Offset in minutes the zone has at the local time `at` of the current local day"""
+
+    now = now or datetime.now(tz=pytz.utc)
+    local = datetime.combine(now.astimezone(tz).date(), time(hour=at.get('hour', 0), minute=at.get('minute', 0)))
+
+    return int(tz.localize(local).utcoffset().total_seconds() // 60)
+
+
+def utc_time(at, offset):
+    """Hour and minute in UTC of the local time `at` in a zone with the given offset"""
+
+    minutes = (at.get('hour', 0) * 60 + at.get('minute', 0) - offset) % (24 * 60)
+
+    return dict(hour=minutes // 60, minute=minutes % 60)
+
+
+def fire_date(at, offset, now=None):
+    """Local day of the latest run of a daily job at the local time `at`, a run late past midnight keeps its day"""
+
+    local = (now or datetime.now(tz=pytz.utc)) + timedelta(minutes=offset)
+    scheduled = local.replace(hour=at.get('hour', 0), minute=at.get('minute', 0), second=0, microsecond=0)
+
+    if local < scheduled:
+        scheduled -= timedelta(days=1)
+
+    return scheduled.date()
+
+
+def group_by_offset(names, default, at, now=None):
+    """Splits time zone names by their offset at the local time `at`, None stands for the default zone"""
+
+    buckets = dict()
+    for name in names:
+        offset = utc_offset(get_timezone(name, default), at, now)
+        buckets.setdefault(offset, set()).add(name)
+
+    return buckets
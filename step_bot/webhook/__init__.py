@@ -0,0 +1,87 @@
+import hmac
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'StepBotWebhook/1.0'
+
+    def do_GET(self):
+        self.respond(200)
+
+    def do_POST(self):
+        # The request line is decoded as latin-1, its bytes are compared since any of them may be sent
+        if not hmac.compare_digest(self.path.encode('iso-8859-1'), self.server.path.encode('utf-8')):
+            return self.respond(404)
+
+        if self.headers.get('content-type', '').split(';')[0].strip() != 'application/json':
+            return self.respond(415)
+
+        try:
+            length = int(self.headers.get('content-length'))
+        except (TypeError, ValueError):
+            return self.respond(411)
+
+        if length < 0 or length > self.server.max_body:
+            return self.respond(413)
+
+        try:
+            data = json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError:
+            return self.respond(400)
+
+        # Telegram drops an update answered with 200, so it is answered once the update is queued for the dispatcher
+        try:
+            self.server.consumer(data)
+        except Exception as e:
+            logging.exception(e)
+
+            return self.respond(500)
+
+        self.respond(200)
+
+    def respond(self, code):
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_request(self, code='-', size='-'):
+        # The request line carries the secret path, so it is kept out of the log
+        logging.debug('Webhook %s - %s', self.address_string(), code)
+
+    def log_message(self, format, *args):
+        logging.debug('Webhook %s - %s', self.address_string(), format % args)
+
+
+class WebhookServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    path = ''
+    max_body = 1024 * 1024
+
+    consumer = None
+    thread = None
+
+    def __init__(self, address, path, consumer, max_body=None):
+        super(WebhookServer, self).__init__(address, WebhookRequestHandler)
+
+        self.path = path
+        self.consumer = consumer
+        self.max_body = max_body or self.max_body
+
+    def start(self):
+        logging.info('Webhook listening on %s:%s', *self.server_address[:2])
+
+        self.thread = threading.Thread(target=self.serve_forever, name='webhook')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+        if self.thread:
+            self.thread.join()
@@ -0,0 +1,71 @@
+import os
+import uuid
+
+import pytest
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import NullPool
+
+project_path = os.path.realpath(os.path.join(os.path.dirname(__file__), os.pardir))
+load_dotenv(os.path.join(project_path, os.environ.get('DOTENV', '.env')))
+
+
+@pytest.fixture(scope='session')
+def settings():
+    from step_bot import settings
+
+    return settings
+
+
+@pytest.fixture(scope='session')
+def db_url():
+    """URL of a database created for the session on the server of TEST_DATABASE_URL and dropped after it
+
+    Tests using it skip without TEST_DATABASE_URL, the database of the bot settings is never touched.
+    """
+
+    url = os.environ.get('TEST_DATABASE_URL')
+    if not url:
+        pytest.skip('TEST_DATABASE_URL is not set')
+
+    server = create_engine(url, poolclass=NullPool, isolation_level='AUTOCOMMIT')
+    name = 'step_bot_test_{0}'.format(uuid.uuid4().hex[:12])
+
+    try:
+        server.execute('CREATE DATABASE {0}'.format(name))
+    except OperationalError as e:
+        server.dispose()
+        pytest.skip('PostgreSQL is not available: {0}'.format(e))
+
+    test_url = make_url(url)
+    test_url.database = name
+
+    yield str(test_url)
+
+    server.execute('DROP DATABASE IF EXISTS {0}'.format(name))
+    server.dispose()
+
+
+@pytest.fixture(scope='session')
+def db_settings(settings, db_url):
+    from bench.runner import bench_settings
+
+    return bench_settings(settings, db_url)
+
+
+@pytest.fixture(scope='session')
+def db_engine(db_settings):
+    """Engine of the test database with the schema migrated"""
+
+    from step_bot.db import create_db_engine
+    from step_bot.migrations import check_schema
+
+    engine = create_db_engine(db_settings)
+
+    check_schema(engine)
+
+    yield engine
+
+    engine.dispose()
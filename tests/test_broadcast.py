@@ -0,0 +1,39 @@
+from step_bot import broadcast
+from step_bot.broadcast import TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refills_at_its_rate(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(broadcast.time, 'monotonic', clock)
+
+    bucket = TokenBucket(2, 3)
+
+    # A full bucket lets a burst through at once
+    assert [bucket.consume() for _ in range(3)] == [0, 0, 0]
+    assert bucket.consume() == 0.5
+
+    clock.now += 0.25
+    assert bucket.consume() == 0.25
+
+    clock.now += 0.25
+    assert bucket.consume() == 0
+    assert bucket.consume() == 0.5
+
+
+def test_token_bucket_does_not_grow_past_its_capacity(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(broadcast.time, 'monotonic', clock)
+
+    bucket = TokenBucket(10)
+    clock.now += 60
+
+    assert [bucket.consume() for _ in range(10)] == [0] * 10
+    assert bucket.consume() == 0.1
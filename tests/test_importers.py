@@ -0,0 +1,105 @@
+import io
+import json
+from datetime import date
+
+import pytest
+import pytz
+
+from step_bot.importers import ImportFileError, parse_csv, parse_json, parse_steps, parser_for
+from step_bot.models import MAX_DAY_STEPS
+
+TZ = pytz.timezone('America/New_York')
+
+# 2024-01-02 00:00 UTC, the evening of 2024-01-01 in New York
+MIDNIGHT_UTC = 1704153600000
+
+
+def csv_file(text):
+    return io.BytesIO(text.encode('utf-8'))
+
+
+def json_file(data):
+    return io.BytesIO(json.dumps(data).encode('utf-8'))
+
+
+def test_parser_for_extension():
+    assert parser_for('export.CSV') is parse_csv
+    assert parser_for('steps.json') is parse_json
+    assert parser_for('steps.xml') is None
+    assert parser_for(None) is None
+
+
+@pytest.mark.parametrize('value', ['-1', str(MAX_DAY_STEPS + 1), 'inf', '1e999', 'nan', 'many'])
+def test_parse_steps_rejects_out_of_range(value):
+    with pytest.raises(ValueError):
+        parse_steps(value)
+
+
+def test_parse_steps():
+    assert parse_steps(' 1234.0 ') == 1234
+    assert parse_steps('') == 0
+    assert parse_steps(MAX_DAY_STEPS) == MAX_DAY_STEPS
+
+
+def test_csv_daily_rows_keep_the_largest_device():
+    collector = parse_csv(csv_file(
+        'Date,Steps\n2024-01-02,1000\n02.01.2024,3000\n01/03/2024,500\nyesterday,10\n2024-01-04,1e999\n'
+    ), TZ)
+
+    assert collector.result() == {date(2024, 1, 2): 3000, date(2024, 1, 3): 500}
+    assert (collector.rows, collector.invalid) == (5, 2)
+
+
+def test_csv_intervals_are_summed_in_the_chat_time_zone():
+    collector = parse_csv(csv_file(
+        'Exported by a fitness app\nstart_time,count\n{0},100\n{1},50\n'.format(MIDNIGHT_UTC, MIDNIGHT_UTC + 3600000)
+    ), TZ)
+
+    assert collector.result() == {date(2024, 1, 1): 150}
+
+
+def test_csv_interval_sums_out_of_range_are_invalid():
+    collector = parse_csv(csv_file('start_time,count\n{0},{2}\n{1},{2}\n'.format(
+        MIDNIGHT_UTC, MIDNIGHT_UTC + 3600000, MAX_DAY_STEPS
+    )), TZ)
+
+    assert collector.result() == dict()
+    assert collector.invalid == 1
+
+
+def test_csv_samsung_days_are_utc_midnights():
+    collector = parse_csv(csv_file(
+        'com.samsung.health.step_daily_trend.day_time,com.samsung.health.step_daily_trend.count\n'
+        '{0},7000\n'.format(MIDNIGHT_UTC)
+    ), TZ)
+
+    assert collector.result() == {date(2024, 1, 2): 7000}
+
+
+def test_csv_without_columns():
+    with pytest.raises(ImportFileError):
+        parse_csv(csv_file('when,how many\n2024-01-02,1000\n'), TZ)
+
+
+def test_json_records():
+    collector = parse_json(json_file(dict(steps=[
+        dict(date='2024-01-02', steps=4000), dict(date='2024-01-03', value='2500'), dict(date='2024-01-04'),
+    ])), TZ)
+
+    assert collector.result() == {date(2024, 1, 2): 4000, date(2024, 1, 3): 2500}
+    assert collector.invalid == 1
+
+
+def test_json_google_fit_buckets():
+    collector = parse_json(json_file(dict(bucket=[
+        dict(startTimeMillis=str(MIDNIGHT_UTC + 12 * 3600000), dataset=[
+            dict(point=[dict(value=[dict(intVal=1000)]), dict(value=[dict(intVal=500)])])
+        ])
+    ])), TZ)
+
+    assert collector.result() == {date(2024, 1, 2): 1500}
+
+
+def test_invalid_json():
+    with pytest.raises(ImportFileError):
+        parse_json(io.BytesIO(b'{"steps": ['), TZ)
@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy import text
+
+from step_bot.jobs.leader import LeaderElection
+
+REPLICAS = 3
+JOBS = 6
+
+LOCK_ID = 5730199
+JOBS_TABLE = 'test_leader_jobs'
+
+fired = Counter()
+fired_lock = threading.Lock()
+
+
+def record_fire(job_id):
+    with fired_lock:
+        fired[job_id] += 1
+
+
+class Replica:
+    """Scheduler and leader election of one bot replica, wired as Bot does"""
+
+    def __init__(self, db_engine, dedicated_engine, run_dates):
+        self.scheduler = BackgroundScheduler(timezone=pytz.utc)
+        self.scheduler.configure(
+            jobstores=dict(default=SQLAlchemyJobStore(engine=db_engine, tablename=JOBS_TABLE)),
+            job_defaults=dict(coalesce=True, misfire_grace_time=60)
+        )
+
+        # Every replica registers the same jobs on startup
+        for index, run_date in enumerate(run_dates):
+            job_id = 'job-{0}'.format(index)
+
+            self.scheduler.add_job(
+                record_fire, 'date', run_date=run_date, id=job_id, kwargs=dict(job_id=job_id), replace_existing=True
+            )
+
+        self.leader = LeaderElection(
+            dedicated_engine, LOCK_ID, 1, on_elected=self.scheduler.resume, on_demoted=self.scheduler.pause
+        )
+
+    def start(self):
+        self.scheduler.start(paused=True)
+        self.leader.start()
+
+    def stop(self):
+        self.leader.stop()
+        self.scheduler.shutdown()
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+
+    while not condition():
+        if time.monotonic() >= deadline:
+            return False
+
+        time.sleep(0.1)
+
+    return True
+
+
+@pytest.fixture
+def dedicated_engine(db_engine, db_settings):
+    from step_bot.db import create_dedicated_engine
+
+    engine = create_dedicated_engine(db_settings)
+
+    yield engine
+
+    with db_engine.begin() as connection:
+        connection.execute(text('DROP TABLE IF EXISTS {0}'.format(JOBS_TABLE)))
+
+    engine.dispose()
+
+
+def test_jobs_fire_once_across_replicas(db_engine, dedicated_engine):
+    fired.clear()
+
+    now = datetime.now(tz=pytz.utc)
+    run_dates = [now + timedelta(seconds=3 + index) for index in range(JOBS)]
+
+    replicas = [Replica(db_engine, dedicated_engine, run_dates) for _ in range(REPLICAS)]
+    for replica in replicas:
+        replica.start()
+
+    stopped = []
+
+    try:
+        assert wait_for(lambda: any(replica.leader.is_leader for replica in replicas), 10)
+
+        # The leader goes away between the runs, another replica takes over the rest of them
+        assert wait_for(lambda: sum(fired.values()) >= JOBS // 2, 30)
+
+        leader = next(replica for replica in replicas if replica.leader.is_leader)
+        leader.stop()
+        stopped.append(leader)
+
+        assert wait_for(lambda: len(fired) >= JOBS, 30)
+
+        # Late duplicates would show up within a few election rounds
+        time.sleep(3)
+
+        assert sum(replica.leader.is_leader for replica in replicas if replica not in stopped) == 1
+    finally:
+        for replica in replicas:
+            if replica not in stopped:
+                replica.stop()
+
+    assert fired == Counter({'job-{0}'.format(index): 1 for index in range(JOBS)})
@@ -0,0 +1,32 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from step_bot.db.queries import instrument_engine, query_budget, query_scope
+
+
+class Settings:
+    SQL_SLOW_QUERY = 1000
+    SQL_N_PLUS_ONE = 10
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine('sqlite://')
+    instrument_engine(engine, Settings)
+
+    yield engine
+
+    engine.dispose()
+
+
+def test_query_budget_fails_past_the_limit(engine):
+    with query_budget(2, 'budget test'):
+        with query_scope('budget test'):
+            engine.execute(text('SELECT 1'))
+            engine.execute(text('SELECT 2'))
+
+    with pytest.raises(AssertionError, match='budget test issued 3 statements, the budget is 2'):
+        with query_budget(2, 'budget test'):
+            with query_scope('budget test'):
+                for _ in range(3):
+                    engine.execute(text('SELECT 1'))
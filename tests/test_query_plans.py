@@ -0,0 +1,115 @@
+import json
+import uuid
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import and_, func, text
+from sqlalchemy.orm import Query
+
+CHATS = 200
+USERS = 20
+DAYS = 90
+
+SEED_STEPS = text("""
+    INSERT INTO steps (id, target_id, user_id, date, steps)
+    SELECT md5(random()::text || clock_timestamp()::text)::uuid, targets.id, members.user_id::text,
+           current_date - days.shift, (random() * 20000)::int
+    FROM targets
+    JOIN chats ON chats.id = targets.chat_id
+    CROSS JOIN generate_series(1, :users) AS members(user_id)
+    CROSS JOIN generate_series(0, :days - 1) AS days(shift)
+    WHERE chats.chat_id = ANY(:chats)
+    ON CONFLICT DO NOTHING
+""")
+
+
+def hot_queries(target_id, chat_uuid, chat_id, user_id, day):
+    from step_bot.models import Chat, Step, Target, UserStat
+
+    total = func.sum(Step.steps)
+
+    # The statements handlers issue on every update, with the filters they use
+    return [
+        ('chat with target', Query([Chat, Target])
+            .outerjoin(Target, Target.id == Chat.current_target_id)
+            .filter(Chat.chat_id == str(chat_id))),
+        ('targets of chat', Query([Target]).filter(Target.chat_id == chat_uuid)),
+        ('member day', Query([Step.steps])
+            .filter(Step.target_id == target_id, Step.user_id == str(user_id), Step.date == day)),
+        ('member history', Query([Step.date, Step.steps])
+            .filter(Step.target_id == target_id, Step.user_id == str(user_id))),
+        ('target days', Query([Step.date, total])
+            .filter(Step.target_id == target_id, Step.date >= day - timedelta(days=7))
+            .group_by(Step.date)),
+        ('member progress', Query([Target.current_value, UserStat.steps])
+            .outerjoin(UserStat, and_(UserStat.target_id == Target.id, UserStat.user_id == str(user_id)))
+            .filter(Target.id == target_id)),
+    ]
+
+
+def plan_nodes(plan):
+    yield plan
+
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def explain(connection, query):
+    compiled = query.with_labels().statement.compile(dialect=connection.dialect)
+    params = {key: str(value) if isinstance(value, uuid.UUID) else value for key, value in compiled.params.items()}
+
+    result = connection.execute('EXPLAIN (FORMAT JSON) ' + str(compiled), params).scalar()
+    if isinstance(result, str):
+        result = json.loads(result)
+
+    return list(plan_nodes(result[0]['Plan']))
+
+
+@pytest.fixture(scope='module')
+def seeded_chat(db_engine, settings, db_url):
+    from bench.runner import BenchRunner
+    from bench.updates import chat_ids
+    from step_bot.db import session_scope
+    from step_bot.models import Chat
+
+    runner = BenchRunner(settings, db_url, chats=CHATS, users=USERS, days=DAYS)
+    runner.seed()
+
+    try:
+        with db_engine.begin() as connection:
+            connection.execute(
+                SEED_STEPS, users=USERS, days=DAYS, chats=[str(chat_id) for chat_id in chat_ids(CHATS)]
+            )
+            connection.execute(text("ANALYZE steps"))
+            connection.execute(text("ANALYZE targets"))
+            connection.execute(text("ANALYZE chats"))
+
+        with session_scope(runner.get_db) as db_session:
+            chat = db_session.query(Chat).filter(Chat.chat_id == str(chat_ids(CHATS)[0])).one()
+            seeded = chat.chat_id, chat.id, chat.current_target_id
+
+        yield seeded
+    finally:
+        runner.cleanup()
+        runner.db_engine.dispose()
+
+
+def test_hot_queries_use_indexes(db_engine, seeded_chat):
+    chat_id, chat_uuid, target_id = seeded_chat
+
+    seq_scans = dict()
+
+    with db_engine.connect() as connection:
+        # Small seeded tables may be cheaper to scan, a sequential scan left after this means no usable index
+        connection.execute(text("SET enable_seqscan = off"))
+
+        for name, query in hot_queries(target_id, chat_uuid, chat_id, 1, date.today()):
+            nodes = explain(connection, query)
+
+            relations = [node['Relation Name'] for node in nodes if node['Node Type'] == 'Seq Scan']
+            if relations:
+                seq_scans[name] = relations
+
+        connection.execute(text("RESET enable_seqscan"))
+
+    assert seq_scans == dict()
@@ -0,0 +1,42 @@
+from datetime import date, datetime
+
+import pytz
+
+from step_bot.timezones import fire_date, group_by_offset, utc_time
+
+AT = dict(hour=21, minute=30)
+
+
+def test_utc_time_wraps_around_midnight():
+    assert utc_time(AT, 0) == dict(hour=21, minute=30)
+    assert utc_time(AT, 180) == dict(hour=18, minute=30)
+    assert utc_time(AT, -300) == dict(hour=2, minute=30)
+    assert utc_time(dict(hour=1), 330) == dict(hour=19, minute=30)
+
+
+def test_fire_date_keeps_the_day_of_a_late_run():
+    # 21:30 in UTC+3 is 18:30 UTC
+    on_time = datetime(2024, 3, 10, 18, 30, tzinfo=pytz.utc)
+    late = datetime(2024, 3, 10, 21, 5, tzinfo=pytz.utc)
+    early = datetime(2024, 3, 10, 18, 0, tzinfo=pytz.utc)
+
+    assert fire_date(AT, 180, on_time) == date(2024, 3, 10)
+    assert fire_date(AT, 180, late) == date(2024, 3, 10)
+    assert fire_date(AT, 180, early) == date(2024, 3, 9)
+
+
+def test_fire_date_of_a_zone_ahead_of_utc_date():
+    # 21:30 in UTC+14 is 07:30 UTC of the same local day
+    assert fire_date(AT, 14 * 60, datetime(2024, 3, 10, 7, 40, tzinfo=pytz.utc)) == date(2024, 3, 10)
+
+
+def test_group_by_offset_uses_the_offset_at_the_local_time():
+    default = pytz.timezone('Europe/Volgograd')
+    names = [None, 'Europe/Moscow', 'Europe/Berlin', 'America/New_York', 'Not/AZone']
+
+    winter = group_by_offset(names, default, AT, datetime(2024, 1, 15, 12, tzinfo=pytz.utc))
+    summer = group_by_offset(names, default, AT, datetime(2024, 7, 15, 12, tzinfo=pytz.utc))
+
+    # Unknown zones fall back to the default one
+    assert winter == {180: {None, 'Europe/Moscow', 'Not/AZone'}, 60: {'Europe/Berlin'}, -300: {'America/New_York'}}
+    assert summer == {180: {None, 'Europe/Moscow', 'Not/AZone'}, 120: {'Europe/Berlin'}, -240: {'America/New_York'}}
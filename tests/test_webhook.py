@@ -0,0 +1,116 @@
+import queue
+import socket
+import threading
+import time
+
+import pytest
+from telegram import Update
+from telegram.ext import Filters, MessageHandler, Updater
+
+from bench.fake_api import FakeTelegramApi
+from step_bot.webhook import WebhookServer
+
+TOKEN = '123456:webhook'
+SECRET = 'webhook-secret'
+
+
+def message_update(update_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': int(time.time()), 'text': text,
+            'chat': dict(id=-1001, type='group', title='Steps'), 'from': dict(id=1, is_bot=False, first_name='Member')
+        }
+    }
+
+
+def post_raw(address, path, body):
+    request = b''.join([
+        b'POST ', path, b' HTTP/1.1\r\n', b'Host: localhost\r\n', b'Content-Type: application/json\r\n',
+        b'Content-Length: ', str(len(body)).encode('ascii'), b'\r\n', b'Connection: close\r\n\r\n', body
+    ])
+
+    with socket.create_connection(address, timeout=5) as connection:
+        connection.sendall(request)
+
+        return int(connection.recv(1024).split()[1])
+
+
+@pytest.fixture
+def api():
+    api = FakeTelegramApi()
+    api.start()
+
+    yield api
+
+    api.stop()
+
+
+@pytest.fixture
+def updater(api):
+    updater = Updater(TOKEN, base_url=api.base_url)
+
+    dispatcher = threading.Thread(target=updater.dispatcher.start, name='dispatcher')
+    dispatcher.daemon = True
+    dispatcher.start()
+
+    yield updater
+
+    updater.dispatcher.stop()
+
+
+def start_webhook(updater, consumer):
+    webhook = WebhookServer(('127.0.0.1', 0), '/' + SECRET, consumer)
+    webhook.start()
+
+    updater.bot.set_webhook(url='http://{0}:{1}/{2}'.format(*webhook.server_address[:2], SECRET))
+
+    return webhook
+
+
+@pytest.fixture
+def webhook(updater):
+    # As Bot.push_update, the update is decoded and queued for the dispatcher
+    webhook = start_webhook(updater, lambda data: updater.update_queue.put(Update.de_json(data, updater.bot)))
+
+    yield webhook
+
+    webhook.stop()
+
+
+def test_updates_reach_the_dispatcher(api, updater, webhook):
+    received = queue.Queue()
+    updater.dispatcher.add_handler(
+        MessageHandler(Filters.text, lambda bot, update: received.put(update.effective_message.text))
+    )
+
+    assert api.post_update(message_update(1, 'first')) == 200
+    assert api.post_update(message_update(2, 'second')) == 200
+
+    assert received.get(timeout=5) == 'first'
+    assert received.get(timeout=5) == 'second'
+
+
+def test_other_paths_are_rejected(api, webhook):
+    body = b'{"update_id": 1}'
+
+    api.webhook_url = api.webhook_url.replace(SECRET, 'wrong-secret')
+    assert api.post_update(message_update(1, 'first')) == 404
+
+    assert post_raw(webhook.server_address[:2], '/{0}é'.format(SECRET).encode('utf-8'), body) == 404
+    assert post_raw(webhook.server_address[:2], b'/\xff\xfe', body) == 404
+
+    # The server survived the requests above
+    assert post_raw(webhook.server_address[:2], '/{0}'.format(SECRET).encode('utf-8'), b'not json') == 400
+
+
+def test_updates_failed_to_queue_are_not_acknowledged(api, updater):
+    def consumer(data):
+        raise RuntimeError('queue is closed')
+
+    webhook = start_webhook(updater, consumer)
+
+    try:
+        assert api.post_update(message_update(1, 'first')) == 500
+    finally:
+        webhook.stop()